@@ -1,9 +1,11 @@
 # Add noqa on top-level convenience imports
 from __future__ import unicode_literals
 
+import sys
+
 from .account import Account
 from .attachments import FileAttachment, ItemAttachment
-from .autodiscover import discover
+from .autodiscover import discover, discover_many
 from .configuration import Configuration
 from .credentials import DELEGATE, IMPERSONATION, Credentials, OAuthCredentials, ServiceAccount
 from .ewsdatetime import EWSDate, EWSDateTime, EWSTimeZone, UTC, UTC_NOW
@@ -14,9 +16,11 @@ from .items import AcceptItem, TentativelyAcceptItem, DeclineItem, CalendarItem,
 from .properties import Body, HTMLBody, ItemId, Mailbox, Attendee, Room, RoomList, UID
 from .protocol import BaseProtocol
 from .restriction import Q
+from .services import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from .transport import BASIC, DIGEST, NTLM, GSSAPI
 from .version import Build, Version
 from .settings import OofSettings
+from .throttling import ThrottlingGovernor, BackOffStore, FileBackOffStore
 
 __version__ = '1.11.5'
 
@@ -24,7 +28,7 @@ __all__ = [
     '__version__',
     'Account',
     'FileAttachment', 'ItemAttachment',
-    'discover',
+    'discover', 'discover_many',
     'Configuration',
     'DELEGATE', 'IMPERSONATION', 'Credentials', 'ServiceAccount',
     'EWSDate', 'EWSDateTime', 'EWSTimeZone', 'UTC', 'UTC_NOW',
@@ -33,7 +37,9 @@ __all__ = [
     'CalendarItem', 'CancelCalendarItem', 'Contact', 'DistributionList', 'Message', 'PostItem', 'Task',
     'ItemId', 'Mailbox', 'Attendee', 'Room', 'RoomList', 'Body', 'HTMLBody', 'UID',
     'OofSettings',
+    'ThrottlingGovernor', 'BackOffStore', 'FileBackOffStore',
     'Q',
+    'PRIORITY_HIGH', 'PRIORITY_NORMAL', 'PRIORITY_LOW',
     'Folder', 'FolderCollection', 'SHALLOW', 'DEEP',
     'BASIC', 'DIGEST', 'NTLM', 'GSSAPI',
     'Build', 'Version',
@@ -48,6 +54,10 @@ def close_connections():
     from .protocol import close_connections as close_protocol_connections
     close_autodiscover_connections()
     close_protocol_connections()
+    if sys.version_info >= (3, 6):
+        # exchangelib.aio uses async generators
+        from .aio import close_executors
+        close_executors()
 
 
 # Pre-register these extended properties. They are not part of the standard EWS fields but are useful for identification
@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from collections import defaultdict
 from locale import getlocale
 from logging import getLogger
+from multiprocessing.pool import ThreadPool
 
 import math
 from cached_property import threaded_cached_property
@@ -15,7 +16,8 @@ from exchangelib.services import GetUserOofSettings, SetUserOofSettings, SyncFol
 from exchangelib.settings import OofSettings
 from .autodiscover import discover
 from .credentials import DELEGATE, IMPERSONATION, ACCESS_TYPES
-from .errors import ErrorAccessDenied, UnknownTimeZone
+from .errors import ErrorAccessDenied, UnknownTimeZone, ErrorFolderNotFound, ErrorItemNotFound, ErrorInvalidOperation, \
+    ErrorNoPublicFolderReplicaAvailable
 from .ewsdatetime import EWSTimeZone, UTC
 from .fields import FieldPath
 from .folders import Folder, AdminAuditLogs, ArchiveDeletedItems, ArchiveInbox, ArchiveMsgFolderRoot, \
@@ -24,13 +26,13 @@ from .folders import Folder, AdminAuditLogs, ArchiveDeletedItems, ArchiveInbox,
     Directory, Drafts, Favorites, IMContactList, Inbox, Journal, JunkEmail, LocalFailures, MsgFolderRoot, MyContacts, \
     Notes, Outbox, PeopleConnect, PublicFoldersRoot, QuickContacts, RecipientCache, RecoverableItemsDeletions, \
     RecoverableItemsPurges, RecoverableItemsRoot, RecoverableItemsVersions, Root, SearchFolders, SentItems, \
-    ServerFailures, SyncIssues, Tasks, ToDoSearch, VoiceMail
+    ServerFailures, SyncIssues, Tasks, ToDoSearch, VoiceMail, FolderCollection
 from .items import Item, BulkCreateResult, HARD_DELETE, \
     AUTO_RESOLVE, SEND_TO_NONE, SAVE_ONLY, SEND_AND_SAVE_COPY, SEND_ONLY, ALL_OCCURRENCIES, \
     DELETE_TYPE_CHOICES, MESSAGE_DISPOSITION_CHOICES, CONFLICT_RESOLUTION_CHOICES, AFFECTED_TASK_OCCURRENCES_CHOICES, \
     SEND_MEETING_INVITATIONS_CHOICES, SEND_MEETING_INVITATIONS_AND_CANCELLATIONS_CHOICES, \
     SEND_MEETING_CANCELLATIONS_CHOICES, ID_ONLY
-from .properties import Mailbox
+from .properties import Mailbox, ParentFolderId
 from .protocol import Protocol
 from .queryset import QuerySet
 from .services import ExportItems, UploadItems, GetItem, CreateItem, UpdateItem, DeleteItem, MoveItem, SendItem, \
@@ -97,18 +99,81 @@ class Account(object):
             raise ValueError("Expected 'default_timezone' to be an EWSTimeZone, got %s" % self.default_timezone)
         # We may need to override the default server version on a per-account basis because Microsoft may report one
         # server version up-front but delegate account requests to an older backend server.
-        self.version = self.protocol.version
+        self.version = self.protocol.get_account_version(self.primary_smtp_address) or self.protocol.version
+        # The root folder is fetched when first needed. See also warm_up()
+
+        if not isinstance(self.protocol, Protocol):
+            raise ValueError("Expected 'protocol' to be a Protocol, got %s" % self.protocol)
+        log.debug('Added account: %s', self)
+
+    @threaded_cached_property
+    def root(self):
         try:
-            self.root = Root.get_distinguished(account=self)
+            return Root.get_distinguished(account=self)
         except ErrorAccessDenied:
             # We may not have access to folder services. This will leave the account severely crippled, but at least
             # survive the error.
             log.warning('Access denied to root folder')
-            self.root = Root(account=self)
+            return Root(account=self)
+
+    def _warm_up(self, folder_classes, snapshot=None):
+        # Fetches the root folder and the distinguished folders in 'folder_classes' in one GetFolder request, or
+        # restores them from 'snapshot'. Returns the folders as a snapshot.
+        folder_classes = [Root] + [cls for cls in folder_classes if cls.supports_version(self.version)]
+        if snapshot is not None and all(
+                isinstance(snapshot.get(cls.DISTINGUISHED_FOLDER_ID, False), (dict, type(None)))
+                for cls in folder_classes
+        ):
+            folders = {}
+            for cls in folder_classes:
+                data = snapshot[cls.DISTINGUISHED_FOLDER_ID]
+                folders[cls] = None if data is None else self._folder_from_snapshot(cls, data)
+        else:
+            folders = {}
+            requested = [cls(account=self, name=cls.DISTINGUISHED_FOLDER_ID, is_distinguished=True)
+                         for cls in folder_classes]
+            for cls, f in zip(folder_classes, FolderCollection(account=self, folders=requested).get_folders()):
+                if isinstance(f, (ErrorAccessDenied, ErrorFolderNotFound, ErrorItemNotFound, ErrorInvalidOperation,
+                                  ErrorNoPublicFolderReplicaAvailable)):
+                    # The server does not have this distinguished folder, or we don't have access to it. Leave it to
+                    # get_default_folder() to find a suitable folder.
+                    folders[cls] = None
+                    continue
+                if isinstance(f, Exception):
+                    raise f
+                folders[cls] = f
+        root = folders.pop(Root) or Root(account=self)
+        for f in folders.values():
+            if f is not None:
+                root.add_distinguished_folder(f)
+        self.root = root
+        snapshot = {cls.DISTINGUISHED_FOLDER_ID: None if f is None else self._folder_to_snapshot(f)
+                    for cls, f in folders.items()}
+        snapshot[Root.DISTINGUISHED_FOLDER_ID] = None if root.id is None else self._folder_to_snapshot(root)
+        return snapshot
+
+    @staticmethod
+    def _folder_to_snapshot(folder):
+        # Store enough to find the folder by name and parent after a warm start, not just by ID
+        return dict(
+            id=folder.id,
+            changekey=folder.changekey,
+            name=folder.name,
+            folder_class=folder.folder_class,
+            parent=[folder.parent_folder_id.id, folder.parent_folder_id.changekey] if folder.parent_folder_id else None,
+        )
 
-        if not isinstance(self.protocol, Protocol):
-            raise ValueError("Expected 'protocol' to be a Protocol, got %s" % self.protocol)
-        log.debug('Added account: %s', self)
+    def _folder_from_snapshot(self, folder_cls, data):
+        parent = data.get('parent')
+        return folder_cls(
+            account=self,
+            id=data['id'],
+            changekey=data.get('changekey'),
+            name=data.get('name'),
+            folder_class=data.get('folder_class'),
+            parent_folder_id=ParentFolderId(id=parent[0], changekey=parent[1]) if parent else None,
+            is_distinguished=True,
+        )
 
     @property
     def folders(self):
@@ -326,7 +391,8 @@ class Account(object):
             oof_settings=value,
         )
 
-    def _consume_item_service(self, service_cls, items, chunk_size, kwargs):
+    def _consume_item_service(self, service_cls, items, chunk_size, kwargs, streaming=False, priority=None,
+                              ordered=True):
         # 'items' could be an unevaluated QuerySet, e.g. if we ended up here via `some_folder.filter(...).delete()`. In
         # that case, we want to use its iterator. Otherwise, peek() will start a count() which is wasteful because we
         # need the item IDs immediately afterwards. iterator() will only do the bare minimum.
@@ -338,27 +404,48 @@ class Account(object):
             # empty 'ids' and return early.
             return
         kwargs['items'] = items
-        for i in service_cls(account=self, chunk_size=chunk_size).call(**kwargs):
+        service = service_cls(account=self, chunk_size=chunk_size, streaming=streaming, priority=priority,
+                              ordered=ordered)
+        for i in service.call(**kwargs):
             yield i
 
-    def export(self, items, chunk_size=None):
+    @staticmethod
+    def _bulk_results(results, ordered, convert=None):
+        # Returns a list of results in input order, or a generator of (input index, result) tuples if not 'ordered'.
+        # 'convert' is applied to all results that are not exceptions.
+        if convert is not None:
+            if ordered:
+                results = (i if isinstance(i, Exception) else convert(i) for i in results)
+            else:
+                results = ((n, i if isinstance(i, Exception) else convert(i)) for n, i in results)
+        return list(results) if ordered else results
+
+    def export(self, items, chunk_size=None, priority=None, ordered=True):
         """Return export strings of the given items
 
         :param items: An iterable containing the Items we want to export
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
 
         :return A list of strings, the exported representation of the object
         """
-        return list(
-            self._consume_item_service(service_cls=ExportItems, items=items, chunk_size=chunk_size, kwargs=dict())
+        return self._bulk_results(
+            self._consume_item_service(service_cls=ExportItems, items=items, chunk_size=chunk_size, kwargs=dict(),
+                                       priority=priority, ordered=ordered),
+            ordered=ordered,
         )
 
-    def upload(self, data, chunk_size=None):
+    def upload(self, data, chunk_size=None, priority=None, ordered=True):
         """Adds objects retrieved from export into the given folders
 
         :param data: An iterable of tuples containing the folder we want to upload the data to and the
             string outputs of exports.
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
 
         :return A list of tuples with the new ids and changekeys
 
@@ -372,11 +459,14 @@ class Account(object):
         if is_empty:
             # We accept generators, so it's not always convenient for caller to know up-front if 'upload_data' is empty.
             # Allow empty 'upload_data' and return early.
-            return []
-        return list(UploadItems(account=self, chunk_size=chunk_size).call(data=data))
+            return [] if ordered else iter([])
+        return self._bulk_results(
+            UploadItems(account=self, chunk_size=chunk_size, priority=priority, ordered=ordered).call(data=data),
+            ordered=ordered,
+        )
 
     def bulk_create(self, folder, items, message_disposition=SAVE_ONLY, send_meeting_invitations=SEND_TO_NONE,
-                    chunk_size=None):
+                    chunk_size=None, priority=None, ordered=True):
         """Creates new items in 'folder'
 
         :param folder: the folder to create the items in
@@ -386,6 +476,9 @@ class Account(object):
         :param send_meeting_invitations: only applicable to CalendarItem items. Possible values are specified in
                SEND_MEETING_INVITATIONS_CHOICES
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
         :return: a list of either BulkCreateResult or exception instances in the same order as the input. The returned
                  BulkCreateResult objects are normal Item objects except they only contain the 'id' and 'changekey'
                  of the created item, and the 'id' of any attachments that were also created.
@@ -419,19 +512,19 @@ class Account(object):
             message_disposition,
             send_meeting_invitations,
         )
-        return list(
-            i if isinstance(i, Exception)
-            else BulkCreateResult.from_xml(elem=i, account=self)
-            for i in self._consume_item_service(service_cls=CreateItem, items=items, chunk_size=chunk_size, kwargs=dict(
+        return self._bulk_results(
+            self._consume_item_service(service_cls=CreateItem, items=items, chunk_size=chunk_size, kwargs=dict(
                 folder=folder,
                 message_disposition=message_disposition,
                 send_meeting_invitations=send_meeting_invitations,
-            ))
+            ), priority=priority, ordered=ordered),
+            ordered=ordered,
+            convert=lambda i: BulkCreateResult.from_xml(elem=i, account=self),
         )
 
     def bulk_update(self, items, conflict_resolution=AUTO_RESOLVE, message_disposition=SAVE_ONLY,
                     send_meeting_invitations_or_cancellations=SEND_TO_NONE, suppress_read_receipts=True,
-                    chunk_size=None):
+                    chunk_size=None, priority=None, ordered=True):
         """
         Bulk updates existing items
 
@@ -444,6 +537,9 @@ class Account(object):
                specified in SEND_MEETING_INVITATIONS_AND_CANCELLATIONS_CHOICES
         :param suppress_read_receipts: nly supported from Exchange 2013. True or False
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
 
         :return: a list of either (id, changekey) tuples or exception instances, in the same order as the input
         """
@@ -475,18 +571,20 @@ class Account(object):
             message_disposition,
             send_meeting_invitations_or_cancellations,
         )
-        return list(
-            i if isinstance(i, Exception) else Item.id_from_xml(i)
-            for i in self._consume_item_service(service_cls=UpdateItem, items=items, chunk_size=chunk_size, kwargs=dict(
+        return self._bulk_results(
+            self._consume_item_service(service_cls=UpdateItem, items=items, chunk_size=chunk_size, kwargs=dict(
                 conflict_resolution=conflict_resolution,
                 message_disposition=message_disposition,
                 send_meeting_invitations_or_cancellations=send_meeting_invitations_or_cancellations,
                 suppress_read_receipts=suppress_read_receipts,
-            ))
+            ), priority=priority, ordered=ordered),
+            ordered=ordered,
+            convert=Item.id_from_xml,
         )
 
     def bulk_delete(self, ids, delete_type=HARD_DELETE, send_meeting_cancellations=SEND_TO_NONE,
-                    affected_task_occurrences=ALL_OCCURRENCIES, suppress_read_receipts=True, chunk_size=None):
+                    affected_task_occurrences=ALL_OCCURRENCIES, suppress_read_receipts=True, chunk_size=None,
+                    priority=None, ordered=True):
         """
         Bulk deletes items.
 
@@ -498,6 +596,9 @@ class Account(object):
                AFFECTED_TASK_OCCURRENCES_CHOICES.
         :param suppress_read_receipts: only supported from Exchange 2013. True or False.
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
 
         :return: a list of either True or exception instances, in the same order as the input
         """
@@ -522,22 +623,24 @@ class Account(object):
             send_meeting_cancellations,
             affected_task_occurrences,
         )
-        return list(
+        return self._bulk_results(
             self._consume_item_service(service_cls=DeleteItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 delete_type=delete_type,
                 send_meeting_cancellations=send_meeting_cancellations,
                 affected_task_occurrences=affected_task_occurrences,
                 suppress_read_receipts=suppress_read_receipts,
-            ))
+            ), priority=priority, ordered=ordered),
+            ordered=ordered,
         )
 
-    def bulk_send(self, ids, save_copy=True, copy_to_folder=None, chunk_size=None):
+    def bulk_send(self, ids, save_copy=True, copy_to_folder=None, chunk_size=None, priority=None):
         """ Send existing draft messages. If requested, save a copy in 'copy_to_folder'
 
         :param ids: an iterable of either (id, changekey) tuples or Item objects.
         :param save_copy: If true, saves a copy of the message
         :param copy_to_folder: If requested, save a copy of the message in this folder. Default is the Sent folder
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
         :return: Status for each send operation, in the same order as the input
         """
         if copy_to_folder and not save_copy:
@@ -547,51 +650,65 @@ class Account(object):
         return list(
             self._consume_item_service(service_cls=SendItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 saved_item_folder=copy_to_folder,
-            ))
+            ), priority=priority)
         )
 
-    def bulk_copy(self, ids, to_folder, chunk_size=None):
+    def bulk_copy(self, ids, to_folder, chunk_size=None, priority=None, ordered=True):
         """ Copy items to another folder
 
         :param ids: an iterable of either (id, changekey) tuples or Item objects.
         :param to_folder: The destination folder of the copy operation
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
         :return: Status for each send operation, in the same order as the input
         """
         if not isinstance(to_folder, Folder):
             raise ValueError("'to_folder' %r must be a Folder instance" % to_folder)
-        return list(
-            i if isinstance(i, Exception) else Item.id_from_xml(i)
-            for i in self._consume_item_service(service_cls=CopyItem, items=ids, chunk_size=chunk_size, kwargs=dict(
+        return self._bulk_results(
+            self._consume_item_service(service_cls=CopyItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 to_folder=to_folder,
-            ))
+            ), priority=priority, ordered=ordered),
+            ordered=ordered,
+            convert=Item.id_from_xml,
         )
 
-    def bulk_move(self, ids, to_folder, chunk_size=None):
+    def bulk_move(self, ids, to_folder, chunk_size=None, priority=None, ordered=True):
         """Move items to another folder
 
         :param ids: an iterable of either (id, changekey) tuples or Item objects.
         :param to_folder: The destination folder of the copy operation
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
         :return: The new IDs of the moved items, in the same order as the input. If 'to_folder' is a public folder or a
         folder in a different mailbox, an empty list is returned.
         """
         if not isinstance(to_folder, Folder):
             raise ValueError("'to_folder' %r must be a Folder instance" % to_folder)
-        return list(
-            i if isinstance(i, Exception) else Item.id_from_xml(i)
-            for i in self._consume_item_service(service_cls=MoveItem, items=ids, chunk_size=chunk_size, kwargs=dict(
+        return self._bulk_results(
+            self._consume_item_service(service_cls=MoveItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 to_folder=to_folder,
-            ))
+            ), priority=priority, ordered=ordered),
+            ordered=ordered,
+            convert=Item.id_from_xml,
         )
 
-    def fetch(self, ids, folder=None, only_fields=None, chunk_size=None):
+    def fetch(self, ids, folder=None, only_fields=None, chunk_size=None, streaming=False, priority=None,
+              ordered=True):
         """ Fetch items by ID
 
         :param ids: an iterable of either (id, changekey) tuples or Item objects.
         :param folder: used for validating 'only_fields'
         :param only_fields: A list of string or FieldPath items specifying the fields to fetch. Default to all fields
         :param chunk_size: The number of items to send to the server in a single request
+        :param priority: The priority of the requests when waiting for a session. One of PRIORITIES
+        :param streaming: If True, parse responses incrementally so only one item is held in memory at a time. Chunks
+          are then fetched one after another instead of concurrently
+        :param ordered: If False, return a generator of (input index, result) tuples in the order the requests finish,
+          instead of results in the same order as the input. A slow request then doesn't hold back other results
         :return: A generator of Item objects, in the same order as the input
         """
         validation_folder = folder or Folder(account=self)  # Default to a folder type that supports all item types
@@ -604,15 +721,15 @@ class Account(object):
         else:
             additional_fields = validation_folder.validate_fields(fields=only_fields)
         # Always use IdOnly here, because AllProperties doesn't actually get *all* properties
-        for i in self._consume_item_service(service_cls=GetItem, items=ids, chunk_size=chunk_size, kwargs=dict(
+        results = self._consume_item_service(service_cls=GetItem, items=ids, chunk_size=chunk_size, kwargs=dict(
                 additional_fields=additional_fields,
                 shape=ID_ONLY,
-        )):
-            if isinstance(i, Exception):
-                yield i
-            else:
-                item = validation_folder.item_model_from_tag(i.tag).from_xml(elem=i, account=self)
-                yield item
+        ), streaming=streaming, priority=priority, ordered=ordered)
+        for res in results:
+            n, i = (None, res) if ordered else res
+            if not isinstance(i, Exception):
+                i = validation_folder.item_model_from_tag(i.tag).from_xml(elem=i, account=self)
+            yield i if ordered else (n, i)
 
     def __str__(self):
         txt = '%s' % self.primary_smtp_address
@@ -620,6 +737,7 @@ class Account(object):
             txt += ' (%s)' % self.fullname
         return txt
 
+
 class FreeBusyAccount(Account):
     '''
     The `FreeBusyAccount` class is necessary in order to fetch free-busy data via exchangelib.
@@ -633,3 +751,37 @@ class FreeBusyAccount(Account):
         # We are intentionally *not* calling the __init__ of it's super class,
         # as to not run any authentication logic.
         self.primary_smtp_address = primary_smtp_address
+
+
+def warm_up(accounts, folder_classes=(), max_workers=10, snapshot=None):
+    """
+    Prepares many accounts for work at once. Fetches the root folder and the distinguished folders in
+    'folder_classes', e.g. (Inbox, Calendar), for each account, using one GetFolder request per account and at most
+    'max_workers' requests in flight. Afterwards, account.root and e.g. account.inbox don't need any requests.
+
+    Returns a snapshot of the folder IDs, names, folder classes and parent IDs, as a JSON-serializable dict. Pass a
+    persisted snapshot as 'snapshot' to restore the folders of accounts in the snapshot without any requests. Accounts
+    that fail to warm up are logged and left out of the snapshot. They fetch their folders when needed, as usual.
+    """
+    for cls in folder_classes:
+        if not cls.DISTINGUISHED_FOLDER_ID or cls == AdminAuditLogs:
+            # AdminAuditLogs folder is not retrievable and makes the entire request fail
+            raise ValueError("'folder_classes' entry %s must be a retrievable distinguished folder class" % cls)
+    if max_workers < 1:
+        raise ValueError("'max_workers' %r must be a positive number" % max_workers)
+    snapshot = snapshot or {}
+
+    def warm_up_one(account):
+        key = account.primary_smtp_address.lower()
+        try:
+            return key, account._warm_up(folder_classes=folder_classes, snapshot=snapshot.get(key))
+        except Exception as e:
+            log.warning('Failed to warm up account %s: %s', account, e)
+            return key, None
+
+    pool = ThreadPool(processes=max_workers)
+    try:
+        return {key: folder_ids for key, folder_ids in pool.imap_unordered(warm_up_one, accounts)
+                if folder_ids is not None}
+    finally:
+        pool.terminate()
@@ -0,0 +1,165 @@
+# coding=utf-8
+"""
+Asyncio support for exchangelib. Requires Python 3.6 or later.
+
+The HTTP transport is implemented on top of 'requests', because the NTLM, Digest and Kerberos authentication handlers
+we support only exist for that library. Instead of parking one OS thread per caller on a blocking socket, coroutines
+wait on the event loop. Iteration (Account.fetch() and QuerySets) pulls one batch at a time in a small thread pool per
+Protocol. The pool has as many workers as the Protocol may have sessions, and no thread is held while the consumer
+processes a batch.
+
+Bulk operations, export() and upload() run as a whole in the default executor of the event loop. Like in the
+synchronous API, the chunks of one bulk operation are sent concurrently via the thread pool of the Protocol, so these
+calls never occupy a worker in the per-Protocol pool that iterating coroutines depend on. The synchronous API is
+unaffected.
+
+Example:
+
+    async def main(accounts):
+        for account in accounts:
+            async for item in AsyncAccount(account).fetch(ids=...):
+                ...
+
+    asyncio.get_event_loop().run_until_complete(main(...))
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from itertools import islice
+import logging
+from threading import Lock
+import weakref
+
+log = logging.getLogger(__name__)
+
+_executors = weakref.WeakKeyDictionary()
+_executors_lock = Lock()
+
+
+def _executor_size(protocol):
+    return protocol.max_pool_size
+
+
+def get_executor(protocol):
+    """Return the thread pool used to run blocking requests for this protocol. There is one pool per protocol, with as
+    many workers as the protocol may have sessions.
+    """
+    with _executors_lock:
+        executor = _executors.get(protocol)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=_executor_size(protocol))
+            _executors[protocol] = executor
+        return executor
+
+
+def close_executors():
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=False)
+        _executors.clear()
+
+
+async def run_blocking(protocol, func, *args, **kwargs):
+    """Run a blocking call in the thread pool belonging to 'protocol' and return the result"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(protocol), functools.partial(func, *args, **kwargs))
+
+
+async def run_in_default_executor(func, *args, **kwargs):
+    """Run a long-running blocking call in the default executor of the event loop and return the result. Use this for
+    calls that do their own request pooling, so they don't tie up a worker in the thread pool of the protocol.
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def iterate_blocking(protocol, iterable, batch_size):
+    """Asynchronously iterate over a blocking iterable. Items are pulled from the iterable in batches of 'batch_size'
+    items in a worker thread, so the event loop only context-switches once per batch. No thread is held while the
+    consumer processes a batch.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = await run_blocking(protocol, lambda: list(islice(iterator, batch_size)))
+        if not batch:
+            return
+        for elem in batch:
+            yield elem
+        if len(batch) < batch_size:
+            return
+
+
+class AsyncAccount(object):
+    """
+    Awaitable and async-iterable versions of the Account methods that do bulk work. Wraps an existing Account:
+
+        async_account = AsyncAccount(account)
+        results = await async_account.bulk_delete(ids=...)
+        async for item in async_account.fetch(ids=...):
+            ...
+    """
+    def __init__(self, account):
+        self.account = account
+
+    @property
+    def protocol(self):
+        return self.account.protocol
+
+    def _batch_size(self, chunk_size):
+        from .services import CHUNK_SIZE
+        return chunk_size or CHUNK_SIZE
+
+    async def fetch(self, ids, folder=None, only_fields=None, chunk_size=None, streaming=False, priority=None):
+        async for item in iterate_blocking(
+                self.protocol,
+                self.account.fetch(ids=ids, folder=folder, only_fields=only_fields, chunk_size=chunk_size,
+                                   streaming=streaming, priority=priority),
+                self._batch_size(chunk_size),
+        ):
+            yield item
+
+    async def export(self, items, chunk_size=None, priority=None):
+        return await run_in_default_executor(self.account.export, items=items, chunk_size=chunk_size,
+                                             priority=priority)
+
+    async def upload(self, data, chunk_size=None, priority=None):
+        return await run_in_default_executor(self.account.upload, data=data, chunk_size=chunk_size,
+                                             priority=priority)
+
+    async def bulk_create(self, folder, items, **kwargs):
+        return await run_in_default_executor(self.account.bulk_create, folder=folder, items=items, **kwargs)
+
+    async def bulk_update(self, items, **kwargs):
+        return await run_in_default_executor(self.account.bulk_update, items=items, **kwargs)
+
+    async def bulk_delete(self, ids, **kwargs):
+        return await run_in_default_executor(self.account.bulk_delete, ids=ids, **kwargs)
+
+    async def bulk_send(self, ids, **kwargs):
+        return await run_in_default_executor(self.account.bulk_send, ids=ids, **kwargs)
+
+    async def bulk_copy(self, ids, to_folder, **kwargs):
+        return await run_in_default_executor(self.account.bulk_copy, ids=ids, to_folder=to_folder, **kwargs)
+
+    async def bulk_move(self, ids, to_folder, **kwargs):
+        return await run_in_default_executor(self.account.bulk_move, ids=ids, to_folder=to_folder, **kwargs)
+
+    async def listen_for_notifications(self, subscription_id, timeout_s=30*60):
+        # A streaming subscription occupies a session for as long as the connection is open. Use the default executor
+        # of the event loop for the stream, so we don't starve the thread pool of the protocol.
+        loop = asyncio.get_event_loop()
+        notifications = self.account.listen_for_notifications(subscription_id=subscription_id, timeout_s=timeout_s)
+        while True:
+            notification = await loop.run_in_executor(None, next, notifications, None)
+            if notification is None:
+                return
+            yield notification
+
+    def __str__(self):
+        return str(self.account)
+
+
+def aiter_queryset(qs):
+    """Returns an async iterator over the results of a QuerySet. Used by QuerySet.__aiter__()"""
+    page_size = qs.page_size or 100
+    return iterate_blocking(qs.folder_collection.account.protocol, qs, page_size)
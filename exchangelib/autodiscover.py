@@ -11,29 +11,33 @@ If you have problems autodiscovering, start by doing an official test at https:/
 """
 from __future__ import unicode_literals
 
-from contextlib import contextmanager
+from collections import Counter, OrderedDict
+import errno
 import getpass
 import glob
+import json
 import logging
+from multiprocessing.pool import ThreadPool
 import os
-import shelve
-import sys
+import sqlite3
 import tempfile
-from threading import Lock
+from threading import Event, Lock, Thread, local
+import time
 
 import dns.resolver
-from future.moves.queue import LifoQueue
-from future.utils import raise_from, PY2, python_2_unicode_compatible
+from future.moves.queue import Empty, Queue
+from future.utils import raise_from, python_2_unicode_compatible
 from six import text_type
 
 from . import transport
 from .credentials import Credentials
+from .endpoint_cache import check_private_path
 from .errors import AutoDiscoverFailed, AutoDiscoverRedirect, AutoDiscoverCircularRedirect, TransportError, \
     RedirectError, ErrorNonExistentMailbox, UnauthorizedError
 from .protocol import BaseProtocol, Protocol
 from .transport import DEFAULT_ENCODING, DEFAULT_HEADERS
 from .util import create_element, get_xml_attr, add_xml_child, to_xml, is_xml, post_ratelimited, xml_to_str, \
-    get_domain, CONNECTION_ERRORS, TLS_ERRORS
+    get_domain, get_redirect_url, split_url, CONNECTION_ERRORS, TLS_ERRORS
 
 
 log = logging.getLogger(__name__)
@@ -44,36 +48,18 @@ ERROR_NS = 'http://schemas.microsoft.com/exchange/autodiscover/responseschema/20
 RESPONSE_NS = 'http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a'
 
 
-def shelve_filename():
-    # 'shelve' may pickle objects using different pickle protocol versions. Append the python major+minor version
-    # numbers to the filename. Also append the username, to avoid permission errors.
-    major, minor = sys.version_info[:2]
+def cache_dirname():
+    # Append the username, to avoid permission errors
     try:
         user = getpass.getuser()
     except KeyError:
         # getuser() fails on some systems. Provide a sane default. See issue #448
         user = 'exchangelib'
-    return 'exchangelib.cache.{user}.py{major}{minor}'.format(user=user, major=major, minor=minor)
+    return 'exchangelib.autodiscover.{user}'.format(user=user)
 
 
-AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), shelve_filename())
-
-
-@contextmanager
-def shelve_open_with_failover(filename):
-    # We can expect empty or corrupt files. Whatever happens, just delete the cache file and try again.
-    # 'shelve' may add a backend-specific suffix to the file, so also delete all files with a suffix.
-    # We don't know which file caused the error, so just delete them all.
-    try:
-        shelve_handle = shelve.open(filename)
-    except Exception as e:
-        for f in glob.glob(filename + '*'):
-            log.warning('Deleting invalid cache file %s (%r)', f, e)
-            os.unlink(f)
-        shelve_handle = shelve.open(filename)
-    yield shelve_handle
-    if PY2:
-        shelve_handle.close()
+# The database and its WAL files live in a private directory. See AutodiscoverCache._connect()
+AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), cache_dirname(), 'cache.sqlite')
 
 
 @python_2_unicode_compatible
@@ -81,42 +67,153 @@ class AutodiscoverCache(object):
     # Stores the translation from (email domain, credentials) -> AutodiscoverProtocol object so we can re-use TCP
     # connections to an autodiscover server within the same process. Also persists the email domain -> (autodiscover
     # endpoint URL, auth_type) translation to the filesystem so the cache can be shared between multiple processes.
+    #
+    # Additionally, the result of autodiscover for each email address is cached, i.e. either the primary SMTP address
+    # and EWS endpoint, or the email address we were redirected to. With a warm cache, discover() doesn't need to
+    # contact the autodiscover server at all. Domains where all autodiscover attempts failed are cached for a short
+    # while, so we don't repeat the full, slow autodiscover dance for every email address in a broken domain.
 
     # According to Microsoft, we may forever cache the (email domain -> autodiscover endpoint URL) mapping, or until
     # it stops responding. My previous experience with Exchange products in mind, I'm not sure if I should trust that
     # advice. But it could save some valuable seconds every time we start a new connection to a known server. In any
     # case, the persistent storage must not contain any sensitive information since the cache could be readable by
     # unprivileged users. Domain, endpoint and auth_type are OK to cache since this info is make publicly available on
-    # HTTP and DNS servers via the autodiscover protocol. Just don't persist any credentials info.
+    # HTTP and DNS servers via the autodiscover protocol. Just don't persist any credentials info. Email addresses are
+    # cached too, so the cache file is only readable by the current user.
 
     # If an autodiscover lookup fails for any reason, the corresponding cache entry must be purged.
 
-    # 'shelve' is supposedly thread-safe and process-safe, which suits our needs.
+    # The persistent storage is an SQLite database in WAL mode, which allows concurrent readers and writers in multiple
+    # threads and processes. Entries read from the database are kept in memory for MEMORY_TTL seconds, so most lookups
+    # don't touch the file at all.
+
+    # The number of seconds to trust an entry in the in-memory cache before reading it again from persistent storage
+    MEMORY_TTL = 300
+    # The number of seconds to cache autodiscover results for an email address
+    EMAIL_TTL = 24 * 3600
+    # The number of seconds to remember that autodiscover failed for a domain
+    NEGATIVE_TTL = 300
+
+    # Kinds of cache entries
+    DOMAIN = 'domain'
+    EMAIL = 'email'
+    FAILED = 'failed'
+    STRATEGY = 'strategy'
+
     def __init__(self):
         self._protocols = {}  # Mapping from (domain, credentials) to AutodiscoverProtocol
+        self._memory = {}  # Mapping from (kind, key) to (value, time to read again from persistent storage)
+        self._memory_lock = Lock()
+        self._local = local()  # Holds a database connection per thread
+        self._warned = False
 
     @property
     def _storage_file(self):
         return AUTODISCOVER_PERSISTENT_STORAGE
 
+    def _connect(self):
+        filename = self._storage_file
+        path = os.path.dirname(filename)
+        try:
+            os.makedirs(path, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # The default directory has a predictable name in the shared temp directory. Another local user could create it
+        # first and plant a database that we would trust. Raises OSError if other users could have created or modified
+        # the directory or the database.
+        check_private_path(path)
+        if not os.path.lexists(filename):
+            # Create the file with restrictive permissions
+            os.close(os.open(filename, os.O_RDWR | os.O_CREAT, 0o600))
+        check_private_path(filename, is_dir=False)
+        conn = sqlite3.connect(filename, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                     '(kind TEXT, key TEXT, value TEXT, expires REAL, PRIMARY KEY (kind, key))')
+        return conn
+
+    def _get_connection(self):
+        # SQLite connections can't be shared between threads, so each thread has its own connection
+        if getattr(self._local, 'conn', None) is None or self._local.filename != self._storage_file:
+            self._local.conn, self._local.filename = self._connect(), self._storage_file
+        return self._local.conn
+
+    def _execute(self, sql, params=()):
+        try:
+            return self._get_connection().execute(sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            # The database is locked by other processes for too long, or we have an I/O error. The file is shared with
+            # other processes, so don't delete it. The cache is an optimization; just skip it this time.
+            log.warning('Skipping autodiscover cache file %s (%r)', self._storage_file, e)
+            return []
+        except (IOError, OSError) as e:
+            # The cache directory or file is unsafe or inaccessible, see _connect(). Skip the cache.
+            if not self._warned:
+                log.warning('Ignoring unsafe autodiscover cache (%s)', e)
+                self._warned = True
+            return []
+        except sqlite3.DatabaseError as e:
+            # We can expect empty or corrupt files. Delete the cache file and try again. Also delete the WAL and shared
+            # memory files, which have the same name with a suffix.
+            self._local.conn = None
+            for f in glob.glob(self._storage_file + '*'):
+                log.warning('Deleting invalid cache file %s (%r)', f, e)
+                os.unlink(f)
+            return self._get_connection().execute(sql, params).fetchall()
+
+    def _get(self, kind, key):
+        now = time.time()
+        with self._memory_lock:
+            value, read_again = self._memory.get((kind, key), (None, 0))
+        if read_again > now:
+            return value
+        rows = self._execute('SELECT value, expires FROM entries WHERE kind = ? AND key = ?', (kind, key))
+        value, expires = (json.loads(rows[0][0]), rows[0][1]) if rows else (None, None)
+        if expires is not None and expires < now:
+            value, expires = None, None
+        read_again = now + self.MEMORY_TTL
+        if expires is not None:
+            read_again = min(read_again, expires)
+        with self._memory_lock:
+            self._memory[(kind, key)] = value, read_again
+        return value
+
+    def _set(self, kind, key, value, ttl=None):
+        expires = None if ttl is None else time.time() + ttl
+        self._execute('INSERT OR REPLACE INTO entries (kind, key, value, expires) VALUES (?, ?, ?, ?)',
+                      (kind, key, json.dumps(value), expires))
+        read_again = time.time() + self.MEMORY_TTL
+        if expires is not None:
+            read_again = min(read_again, expires)
+        with self._memory_lock:
+            self._memory[(kind, key)] = value, read_again
+
+    def _delete(self, kind, key):
+        self._execute('DELETE FROM entries WHERE kind = ? AND key = ?', (kind, key))
+        with self._memory_lock:
+            self._memory.pop((kind, key), None)
+
     def clear(self):
         # Wipe the entire cache
-        with shelve_open_with_failover(self._storage_file) as db:
-            db.clear()
+        self._execute('DELETE FROM entries')
+        with self._memory_lock:
+            self._memory.clear()
         self._protocols.clear()
 
     def __contains__(self, key):
         domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            return str(domain) in db
+        return self._get(self.DOMAIN, str(domain)) is not None
 
     def __getitem__(self, key):
         protocol = self._protocols.get(key)
         if protocol:
             return protocol
         domain, credentials = key
-        with shelve_open_with_failover(self._storage_file) as db:
-            endpoint, auth_type = db[str(domain)]  # It's OK to fail with KeyError here
+        value = self._get(self.DOMAIN, str(domain))
+        if value is None:
+            raise KeyError(key)
+        endpoint, auth_type = value
         protocol = AutodiscoverProtocol(service_endpoint=endpoint, credentials=credentials, auth_type=auth_type)
         self._protocols[key] = protocol
         return protocol
@@ -124,24 +221,50 @@ class AutodiscoverCache(object):
     def __setitem__(self, key, protocol):
         # Populate both local and persistent cache
         domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            db[str(domain)] = (protocol.service_endpoint, protocol.auth_type)
+        self._set(self.DOMAIN, str(domain), (protocol.service_endpoint, protocol.auth_type))
         self._protocols[key] = protocol
 
     def __delitem__(self, key):
         # Empty both local and persistent cache. Don't fail on non-existing entries because we could end here
         # multiple times due to race conditions.
         domain = key[0]
-        with shelve_open_with_failover(self._storage_file) as db:
-            try:
-                del db[str(domain)]
-            except KeyError:
-                pass
+        self._delete(self.DOMAIN, str(domain))
         try:
             del self._protocols[key]
         except KeyError:
             pass
 
+    def get_email(self, email):
+        """Returns a (primary_smtp_address, ews_url) tuple or a redirect email address for the email address, or None
+        if we don't know"""
+        value = self._get(self.EMAIL, email.lower())
+        if isinstance(value, list):
+            return tuple(value)
+        return value
+
+    def set_email(self, email, value):
+        """Caches a (primary_smtp_address, ews_url) tuple or a redirect email address for the email address"""
+        self._set(self.EMAIL, email.lower(), value, ttl=self.EMAIL_TTL)
+
+    def del_email(self, email):
+        self._delete(self.EMAIL, email.lower())
+
+    def has_failed(self, domain):
+        """Returns True if autodiscover failed for the domain within the last NEGATIVE_TTL seconds"""
+        return self._get(self.FAILED, str(domain)) is not None
+
+    def set_failed(self, domain):
+        self._set(self.FAILED, str(domain), True, ttl=self.NEGATIVE_TTL)
+
+    def get_strategy(self, domain):
+        """Returns the name of the autodiscover strategy that last succeeded for the domain. See
+        AUTODISCOVER_STRATEGIES
+        """
+        return self._get(self.STRATEGY, str(domain))
+
+    def set_strategy(self, domain, strategy):
+        self._set(self.STRATEGY, str(domain), strategy)
+
     def close(self):
         # Close all open connections
         for (domain, _), protocol in self._protocols.items():
@@ -179,6 +302,20 @@ def discover(email, credentials):
     log.debug('Attempting autodiscover on email %s', email)
     if not isinstance(credentials, Credentials):
         raise ValueError("'credentials' %r must be a Credentials instance" % credentials)
+    # This is the main path when we have seen the email address before. No need to take the lock.
+    cached = _autodiscover_cache.get_email(email)
+    if isinstance(cached, tuple):
+        primary_smtp_address, ews_url = cached
+        log.debug('Cache hit for email %s: %s', email, ews_url)
+        try:
+            return primary_smtp_address, Protocol(service_endpoint=ews_url, credentials=credentials, auth_type=None)
+        except TransportError as e:
+            log.debug('Cached EWS endpoint %s for email %s failed (%s)', ews_url, email, e)
+            _autodiscover_cache.del_email(email)
+    elif cached is not None:
+        log.debug('Cache hit for email %s: redirect to %s', email, cached)
+        return discover(email=cached, credentials=credentials)
+
     domain = get_domain(email)
     # We may be using multiple different credentials and changing our minds on TLS verification. This key combination
     # should be safe.
@@ -203,26 +340,113 @@ def discover(email, credentials):
                 log.debug('%s redirects to %s', email, e.redirect_email)
                 if email.lower() == e.redirect_email.lower():
                     raise_from(AutoDiscoverCircularRedirect('Redirect to same email address: %s' % email), None)
+                _autodiscover_cache.set_email(email, e.redirect_email)
                 # Start over with the new email address after releasing the lock
                 email = e.redirect_email
+        elif _autodiscover_cache.has_failed(domain):
+            raise AutoDiscoverFailed('Autodiscover failed recently for domain %s' % domain)
         else:
             log.debug('Cache miss for domain %s credentials %s', domain, credentials)
             log.debug('Cache contents: %s', _autodiscover_cache)
             try:
                 # This eventually fills the cache in _autodiscover_hostname
+                if AutodiscoverProtocol.CONCURRENT_PROBING:
+                    return _try_autodiscover_concurrently(domain=domain, credentials=credentials, email=email)
                 return _try_autodiscover(hostname=domain, credentials=credentials, email=email)
             except AutoDiscoverRedirect as e:
                 if email.lower() == e.redirect_email.lower():
                     raise_from(AutoDiscoverCircularRedirect('Redirect to same email address: %s' % email), None)
                 log.debug('%s redirects to %s', email, e.redirect_email)
+                _autodiscover_cache.set_email(email, e.redirect_email)
                 # Start over with the new email address after releasing the lock
                 email = e.redirect_email
+            except AutoDiscoverFailed:
+                # Don't do the full autodiscover dance for this domain again for a while
+                _autodiscover_cache.set_failed(domain)
+                raise
     log.debug('Released autodiscover_cache_lock')
     # We fell out of the with statement, so either cache was filled by someone else, or autodiscover redirected us to
     # another email address. Start over after releasing the lock.
     return discover(email=email, credentials=credentials)
 
 
+def discover_many(emails, credentials, max_workers=10):
+    """
+    Autodiscovers many email addresses at once, e.g. all mailboxes in a tenant. Returns a generator of
+    (email, primary_smtp_address, protocol) tuples in the order that autodiscover finishes. If autodiscover fails for an
+    email address, the exception is returned in place of the primary SMTP address, and the protocol is None.
+
+    One email address per domain is autodiscovered first, to find and cache the autodiscover server of the domain. The
+    remaining email addresses are then sent directly to the cached autodiscover server, with at most 'max_workers'
+    requests in flight at a time. The session pool of each cached autodiscover server is grown to 'max_workers'
+    sessions, so requests for the same domain don't wait for each other.
+    """
+    if not isinstance(credentials, Credentials):
+        raise ValueError("'credentials' %r must be a Credentials instance" % credentials)
+    if max_workers < 1:
+        raise ValueError("'max_workers' %r must be a positive number" % max_workers)
+    first, rest, seen_domains = [], [], set()
+    for email in emails:
+        domain = get_domain(email)
+        if domain in seen_domains:
+            rest.append(email)
+        else:
+            seen_domains.add(domain)
+            first.append(email)
+
+    def discover_one(email):
+        try:
+            primary_smtp_address, protocol = _discover_unlocked(email=email, credentials=credentials)
+            return email, primary_smtp_address, protocol
+        except Exception as e:
+            return email, e, None
+
+    def reserve_sessions():
+        # The remaining email addresses of a domain share the autodiscover protocol of the domain
+        for domain, num_emails in Counter(get_domain(email) for email in rest).items():
+            try:
+                protocol = _autodiscover_cache[(domain, credentials)]
+            except KeyError:
+                # Autodiscover failed for the domain
+                continue
+            protocol.reserve_sessions(min(num_emails, max_workers))
+
+    pool = ThreadPool(processes=max_workers)
+    try:
+        for res in pool.imap_unordered(discover_one, first):
+            yield res
+        reserve_sessions()
+        for res in pool.imap_unordered(discover_one, rest):
+            yield res
+    finally:
+        pool.terminate()
+
+
+def _discover_unlocked(email, credentials):
+    # Like discover(), but doesn't serialize on _autodiscover_cache_lock when the autodiscover server for the domain is
+    # already known.
+    domain = get_domain(email)
+    autodiscover_key = (domain, credentials)
+    if _autodiscover_cache.get_email(email) is not None or autodiscover_key not in _autodiscover_cache:
+        return discover(email=email, credentials=credentials)
+    try:
+        protocol = _autodiscover_cache[autodiscover_key]
+    except KeyError:
+        # Someone removed the cache entry in the meantime
+        return discover(email=email, credentials=credentials)
+    try:
+        return _autodiscover_quick(credentials=credentials, email=email, protocol=protocol)
+    except AutoDiscoverFailed:
+        # Let discover() handle the cleanup and start over
+        return discover(email=email, credentials=credentials)
+    except AutoDiscoverRedirect as e:
+        log.debug('%s redirects to %s', email, e.redirect_email)
+        if email.lower() == e.redirect_email.lower():
+            raise_from(AutoDiscoverCircularRedirect('Redirect to same email address: %s' % email), None)
+        _autodiscover_cache.set_email(email, e.redirect_email)
+        return discover(email=e.redirect_email, credentials=credentials)
+
+
 def _try_autodiscover(hostname, credentials, email):
     # Implements the full chain of autodiscover server discovery attempts. Tries to return autodiscover data from the
     # final host.
@@ -305,39 +529,248 @@ def _get_auth_type_or_raise(url, email, hostname):
 def _autodiscover_hostname(hostname, credentials, email, has_ssl):
     # Tries to get autodiscover data on a specific host. If we are HTTP redirected, we restart the autodiscover dance on
     # the new host.
+    autodiscover_protocol, result = _probe_hostname(hostname=hostname, credentials=credentials, email=email,
+                                                    has_ssl=has_ssl)
+    return _use_autodiscover_result(autodiscover_protocol=autodiscover_protocol, result=result,
+                                    credentials=credentials, email=email)
+
+
+def _probe_hostname(hostname, credentials, email, has_ssl):
+    # Sends an autodiscover request to a specific host, without touching the cache. Returns the autodiscover protocol
+    # and either an (ews_url, primary_smtp_address) tuple or one of the valid error responses. Raises RedirectError on
+    # HTTP redirects and AutoDiscoverFailed if the host is not a working autodiscover server.
     url = '%s://%s/Autodiscover/Autodiscover.xml' % ('https' if has_ssl else 'http', hostname)
     log.info('Trying autodiscover on %s', url)
     auth_type = _get_auth_type_or_raise(url=url, email=email, hostname=hostname)
     autodiscover_protocol = AutodiscoverProtocol(service_endpoint=url, credentials=credentials, auth_type=auth_type)
     r = _get_response(protocol=autodiscover_protocol, email=email)
-    domain = get_domain(email)
     try:
-        ews_url, primary_smtp_address = _parse_response(r.content)
-        if not primary_smtp_address:
-            primary_smtp_address = email
-    except (ErrorNonExistentMailbox, AutoDiscoverRedirect):
+        return autodiscover_protocol, _parse_response(r.content)
+    except (ErrorNonExistentMailbox, AutoDiscoverRedirect) as e:
         # These are both valid responses from an autodiscover server, showing that we have found the correct
-        # server for the original domain. Fill cache before re-raising
-        log.debug('Adding cache entry for %s (hostname %s)', domain, hostname)
+        # server for the original domain.
+        return autodiscover_protocol, e
+
+
+def _use_autodiscover_result(autodiscover_protocol, result, credentials, email):
+    # Caches the autodiscover server that gave us 'result', and returns the result or raises the error response
+    domain = get_domain(email)
+    if isinstance(result, Exception):
+        # Fill cache before re-raising
+        log.debug('Adding cache entry for %s (endpoint %s)', domain, autodiscover_protocol.service_endpoint)
         # We have already acquired the cache lock at this point
         _autodiscover_cache[(domain, credentials)] = autodiscover_protocol
-        raise
+        raise result
+    ews_url, primary_smtp_address = result
+    if not primary_smtp_address:
+        primary_smtp_address = email
 
     # Cache the final hostname of the autodiscover service so we don't need to autodiscover the same domain again
-    log.debug('Adding cache entry for %s (hostname %s, has_ssl %s)', domain, hostname, has_ssl)
+    log.debug('Adding cache entry for %s (endpoint %s)', domain, autodiscover_protocol.service_endpoint)
     # We have already acquired the cache lock at this point
     _autodiscover_cache[(domain, credentials)] = autodiscover_protocol
+    _autodiscover_cache.set_email(email, (primary_smtp_address, ews_url))
     # Autodiscover response contains an auth type, but we don't want to spend time here testing if it actually works.
     # Instead of forcing a possibly-wrong auth type, just let Protocol auto-detect the auth type.
     return primary_smtp_address, Protocol(service_endpoint=ews_url, credentials=credentials, auth_type=None)
 
 
+def _probe_with_redirects(hostname, credentials, email, has_ssl, cancelled):
+    # Like _probe_hostname(), but follows HTTPS redirects to other hosts. Gives up if 'cancelled' is set.
+    seen = set()
+    while True:
+        if cancelled.is_set():
+            raise AutoDiscoverFailed('Cancelled')
+        seen.add(hostname)
+        try:
+            return _probe_hostname(hostname=hostname, credentials=credentials, email=email, has_ssl=has_ssl)
+        except RedirectError as e:
+            if not e.has_ssl:
+                raise_from(AutoDiscoverFailed(
+                    '%s redirected us to %s but only HTTPS redirects allowed' % (hostname, e.url)
+                ), None)
+            if e.server in seen:
+                raise_from(AutoDiscoverFailed('Redirect loop at %s' % e.server), None)
+            log.info('%s redirected us to %s', hostname, e.server)
+            hostname, has_ssl = e.server, True
+
+
+def _probe_https(domain, credentials, email, cancelled):
+    return _probe_with_redirects(hostname=domain, credentials=credentials, email=email, has_ssl=True,
+                                 cancelled=cancelled)
+
+
+def _probe_autodiscover_https(domain, credentials, email, cancelled):
+    return _probe_with_redirects(hostname='autodiscover.%s' % domain, credentials=credentials, email=email,
+                                 has_ssl=True, cancelled=cancelled)
+
+
+def _probe_autodiscover_http(domain, credentials, email, cancelled):
+    # The autodiscover HTTP redirect method. Plain HTTP is only used to look for a redirect to an HTTPS server. We never
+    # send credentials or the autodiscover request in cleartext.
+    hostname = 'autodiscover.%s' % domain
+    url = 'http://%s/Autodiscover/Autodiscover.xml' % hostname
+    log.info('Looking for an HTTPS redirect on %s', url)
+    try:
+        with AutodiscoverProtocol.raw_session() as s:
+            r = s.get(url=url, headers=DEFAULT_HEADERS.copy(), timeout=AutodiscoverProtocol.TIMEOUT,
+                      allow_redirects=False)
+    except CONNECTION_ERRORS as e:
+        raise_from(AutoDiscoverFailed('Error connecting to %s: %s' % (url, e)), None)
+    if r.status_code not in (301, 302):
+        raise AutoDiscoverFailed('%s did not redirect us (status code %s)' % (url, r.status_code))
+    redirect_url = get_redirect_url(r)
+    redirect_has_ssl, redirect_hostname, _ = split_url(redirect_url)
+    if not redirect_has_ssl:
+        raise AutoDiscoverFailed('%s redirected us to %s but only HTTPS redirects allowed' % (url, redirect_url))
+    log.info('%s redirected us to %s', url, redirect_url)
+    return _probe_with_redirects(hostname=redirect_hostname, credentials=credentials, email=email, has_ssl=True,
+                                 cancelled=cancelled)
+
+
+def _probe_dns(domain, credentials, email, cancelled):
+    hostname = _get_canonical_name(hostname='autodiscover.%s' % domain)
+    if not hostname:
+        hostname = _get_hostname_from_srv(hostname='autodiscover.%s' % domain)
+    return _probe_with_redirects(hostname=hostname, credentials=credentials, email=email, has_ssl=True,
+                                 cancelled=cancelled)
+
+
+def _probe_srv(domain, credentials, email, cancelled):
+    hostname = _get_hostname_from_srv(hostname='_autodiscover._tcp.%s' % domain)
+    return _probe_with_redirects(hostname=hostname, credentials=credentials, email=email, has_ssl=True,
+                                 cancelled=cancelled)
+
+
+# The steps of the autodiscover protocol, as used by _try_autodiscover_concurrently(). Each strategy is called with
+# (domain, credentials, email, cancelled) and returns the result of _probe_hostname().
+AUTODISCOVER_STRATEGIES = OrderedDict([
+    ('https', _probe_https),
+    ('autodiscover_https', _probe_autodiscover_https),
+    ('autodiscover_http', _probe_autodiscover_http),
+    ('dns', _probe_dns),
+    ('srv', _probe_srv),
+])
+
+# Results of these strategies are only used when the listed strategies have failed. An HTTP redirect must not win over
+# a direct HTTPS response.
+DEFERRED_STRATEGIES = {
+    'autodiscover_http': ('https', 'autodiscover_https'),
+}
+
+
+def _try_autodiscover_concurrently(domain, credentials, email):
+    # Runs all steps of the autodiscover protocol at the same time and uses the first valid response, instead of
+    # waiting for each step to time out before trying the next one. The strategy that last succeeded for the domain
+    # gets a head start of AutodiscoverProtocol.HEAD_START seconds. The remaining steps are cancelled when we have a
+    # winner. Steps that are already waiting for a response finish in the background. Their results are discarded and
+    # their autodiscover protocols are closed.
+    results = Queue()
+    cancelled = Event()
+    results_lock = Lock()
+
+    def run(name):
+        try:
+            res = AUTODISCOVER_STRATEGIES[name](domain, credentials, email, cancelled)
+        except Exception as e:
+            results.put((name, None, e))
+            return
+        with results_lock:
+            if not cancelled.is_set():
+                results.put((name, res, None))
+                return
+        # We already have a winner
+        res[0].close()
+
+    def start(names):
+        for name in names:
+            t = Thread(target=run, args=(name,), name='exchangelib-autodiscover-%s' % name)
+            # Don't keep the interpreter alive for a step we gave up on
+            t.daemon = True
+            t.start()
+
+    def use(name, res):
+        log.debug('Autodiscover strategy %s succeeded for domain %s', name, domain)
+        if name != preferred:
+            _autodiscover_cache.set_strategy(domain, name)
+        return _use_autodiscover_result(autodiscover_protocol=res[0], result=res[1], credentials=credentials,
+                                        email=email)
+
+    preferred = _autodiscover_cache.get_strategy(domain)
+    if preferred in AUTODISCOVER_STRATEGIES:
+        pending = [name for name in AUTODISCOVER_STRATEGIES if name != preferred]
+        start([preferred])
+        running = 1
+    else:
+        pending = []
+        start(AUTODISCOVER_STRATEGIES)
+        running = len(AUTODISCOVER_STRATEGIES)
+    failed = set()
+    deferred = None  # A (name, result) tuple that must wait for other strategies to fail
+    errors = []
+    try:
+        while running:
+            if deferred and failed.issuperset(DEFERRED_STRATEGIES[deferred[0]]):
+                name, res = deferred
+                deferred = None
+                return use(name, res)
+            try:
+                name, res, e = results.get(timeout=AutodiscoverProtocol.HEAD_START if pending else None)
+            except Empty:
+                # The preferred strategy is slow. Start the others.
+                start(pending)
+                running, pending = running + len(pending), []
+                continue
+            running -= 1
+            if e is None:
+                if not failed.issuperset(DEFERRED_STRATEGIES.get(name, ())):
+                    log.debug('Autodiscover strategy %s succeeded for domain %s. Waiting for %s', name, domain,
+                              DEFERRED_STRATEGIES[name])
+                    deferred = name, res
+                    if pending:
+                        start(pending)
+                        running, pending = running + len(pending), []
+                    continue
+                return use(name, res)
+            log.info('Autodiscover strategy %s failed for domain %s (%s)', name, domain, e)
+            failed.add(name)
+            errors.append(e)
+            if pending:
+                # The preferred strategy failed. Start the others.
+                start(pending)
+                running, pending = running + len(pending), []
+        if deferred:
+            # All strategies that take precedence have failed
+            name, res = deferred
+            deferred = None
+            return use(name, res)
+    finally:
+        with results_lock:
+            cancelled.set()
+        # Close the protocols of successful strategies that we didn't use
+        if deferred:
+            deferred[1][0].close()
+        while True:
+            try:
+                name, res, e = results.get(block=False)
+            except Empty:
+                break
+            if e is None:
+                res[0].close()
+    for e in errors:
+        if not isinstance(e, TransportError):
+            # Not a failed connection but something unexpected, e.g. a bug or a weird response. Don't hide it.
+            raise e
+    raise AutoDiscoverFailed('All steps in the autodiscover protocol failed')
+
+
 def _autodiscover_quick(credentials, email, protocol):
     r = _get_response(protocol=protocol, email=email)
     ews_url, primary_smtp_address = _parse_response(r.content)
     if not primary_smtp_address:
         primary_smtp_address = email
     log.debug('Autodiscover success: %s may connect to %s as primary email %s', email, ews_url, primary_smtp_address)
+    _autodiscover_cache.set_email(email, (primary_smtp_address, ews_url))
     # Autodiscover response contains an auth type, but we don't want to spend time here testing if it actually works.
     # Instead of forcing a possibly-wrong auth type, just let Protocol auto-detect the auth type.
     return primary_smtp_address, Protocol(service_endpoint=ews_url, credentials=credentials, auth_type=None)
@@ -497,12 +930,32 @@ def _get_hostname_from_srv(hostname):
 class AutodiscoverProtocol(BaseProtocol):
     # Protocol which implements the bare essentials for autodiscover
     TIMEOUT = 10  # Seconds
+    # Try all steps of the autodiscover protocol at the same time instead of one after the other. This finds the
+    # autodiscover server much faster if some steps time out, at the cost of more requests.
+    CONCURRENT_PROBING = False
+    # When probing concurrently, the number of seconds to wait for the strategy that last succeeded for a domain
+    # before starting the other strategies.
+    HEAD_START = 2
 
     def __init__(self, *args, **kwargs):
         super(AutodiscoverProtocol, self).__init__(*args, **kwargs)
-        self._session_pool = LifoQueue(maxsize=self.SESSION_POOLSIZE)
-        for _ in range(self.SESSION_POOLSIZE):
-            self._session_pool.put(self.create_session(), block=False)
+        self._create_session_pool()
+
+    @property
+    def governor(self):
+        # Autodiscover requests are not subject to EWS throttling budgets
+        return None
+
+    def reserve_sessions(self, num_sessions):
+        """Grows the session pool to at least 'num_sessions' sessions, so that many concurrent requests don't wait for
+        a session. See discover_many()
+        """
+        with self._session_pool_lock:
+            if num_sessions > self.max_pool_size:
+                self.max_pool_size = num_sessions
+                self._session_pool.maxsize = num_sessions
+        while self._session_pool_target < num_sessions:
+            self.increase_poolsize()
 
     def __str__(self):
         return '''\
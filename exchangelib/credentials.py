@@ -9,10 +9,12 @@ from __future__ import unicode_literals
 
 import datetime
 import logging
-from multiprocessing import Lock
+import time
 
 from future.utils import python_2_unicode_compatible
 
+from .throttling import BackOffStore
+
 log = logging.getLogger(__name__)
 
 IMPERSONATION = 'impersonation'
@@ -35,6 +37,8 @@ class Credentials(object):
     EMAIL = 'email'
     DOMAIN = 'domain'
     UPN = 'upn'
+    # An optional ThrottlingGovernor that paces requests made with these credentials
+    governor = None
 
     def __init__(self, username, password):
         if username.count('@') == 1:
@@ -78,32 +82,70 @@ class OAuthCredentials(Credentials):
     """
     Keeps login info the way Office365 likes it.
     :param token: Office365 access token
-
-    Note that you should either pass a password or an access token, not both.
+    :param identity: Optional. A stable identifier for the login, e.g. the user or application ID the token is issued
+      to. When set, credentials are compared by identity instead of by token, so refreshing the token doesn't create a
+      new Protocol with new sessions.
+    :param token_provider: Optional. A callable returning the current access token. It is called for every request, so
+      it should return a cached token and only fetch a new token when the cached one is about to expire.
+
+    Note that you should either pass a password or an access token, not both. A token can be replaced by assigning to
+    'token', which takes effect on the next request.
     """
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, token=None, identity=None, token_provider=None):
+        if token is None and token_provider is None:
+            raise ValueError("Either 'token' or 'token_provider' must be set")
+        if token_provider is not None and not callable(token_provider):
+            raise ValueError("'token_provider' %r must be callable" % token_provider)
+        if token_provider is not None and identity is None:
+            raise ValueError("'identity' must be set when 'token_provider' is set")
+        self._token = token
+        self.identity = identity
+        self.token_provider = token_provider
+
+    @property
+    def token(self):
+        if self.token_provider is not None:
+            return self.token_provider()
+        return self._token
+
+    @token.setter
+    def token(self, value):
+        self._token = value
+
+    def _key(self):
+        if self.identity is not None:
+            return self.identity
+        return self.token
 
     def __eq__(self, other):
-        return self.token == other.token
+        return self._key() == other._key()
 
     def __hash__(self):
-        return hash(self.token)
+        return hash(self._key())
 
     def __repr__(self):
+        if self.identity is not None:
+            return self.__class__.__name__ + repr((self.identity, '********'))
         return self.__class__.__name__ + ' ********'
 
 
 class ServiceAccount(Credentials):
-    def __init__(self, username, password, max_wait=3600):
+    def __init__(self, username, password, max_wait=3600, governor=None, back_off_store=None):
         """
         A Credentials class that enables fault-tolerance handling. Tells internal methods to do an exponential back off
         when requests start failing, and wait up to max_wait seconds before failing.
+
+        'governor' is an optional ThrottlingGovernor which paces requests to stay within the throttling policy of the
+        server, instead of only backing off after the server has started throttling.
+
+        'back_off_store' is an optional BackOffStore which keeps the back off value requested by the server. Use a
+        FileBackOffStore to share the back off value between processes. By default, the value is only shared by
+        threads in this process.
         """
         super(ServiceAccount, self).__init__(username, password)
         self.max_wait = max_wait
-        self._back_off_until = None
-        self._back_off_lock = Lock()
+        self.governor = governor
+        self.back_off_store = back_off_store or BackOffStore()
 
     @property
     def fail_fast(self):
@@ -111,24 +153,21 @@ class ServiceAccount(Credentials):
 
     @property
     def back_off_until(self):
-        """Returns the back off value as a datetime. Resets the current back off value if it has expired."""
-        if self._back_off_until is None:
+        """Returns the back off value as a datetime, or None if there is no back off value or it has expired"""
+        value = self.back_off_store.get()
+        # Don't reset an expired value in the store. Another process may just have set a new value.
+        if value is None or value < time.time():
             return None
-        with self._back_off_lock:
-            if self._back_off_until is None:
-                return None
-            if self._back_off_until < datetime.datetime.now():
-                self._back_off_until = None  # The backoff value has expired. Reset
-                return None
-            return self._back_off_until
+        return datetime.datetime.fromtimestamp(value)
 
     @back_off_until.setter
     def back_off_until(self, value):
-        with self._back_off_lock:
-            self._back_off_until = value
+        # Setting None resets the back off. Otherwise, never shorten a back off that another client may have reported.
+        if value is None:
+            self.back_off_store.set(None)
+            return
+        self.back_off_store.extend(time.mktime(value.timetuple()) + value.microsecond / 1e6)
 
     def back_off(self, seconds):
         seconds = seconds or 60  # Back off 60 seconds if we didn't get an explicit suggested value
-        value = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
-        with self._back_off_lock:
-            self._back_off_until = value
+        self.back_off_store.extend(time.time() + seconds)
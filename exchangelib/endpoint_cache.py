@@ -0,0 +1,207 @@
+# coding=utf-8
+"""
+A persistent cache of what we learn about EWS endpoints: the auth type, the server version, and the API versions of
+mailboxes that are served by a backend server with a different version than the one reported by the endpoint. With a
+warm cache, a new Protocol doesn't need to send any requests to guess the auth type and server version.
+
+Each endpoint is stored as a small JSON file in a cache directory. Files are written to a temporary file which is then
+renamed, so readers in other processes always see a complete file. Concurrent updates to the same endpoint are not
+merged; the last writer wins. That's OK because everything in the cache can be learned again from the server.
+
+As with the autodiscover cache, the cache must not contain any sensitive information, since it could be readable by
+other users. Credentials are never stored.
+
+The default cache directory has a predictable name in the shared temp directory. Another local user could create the
+directory first and plant entries that we would trust. Therefore, the cache directory is ignored if it is a symlink, is
+not owned by the current user, or is writable by the group or by others.
+"""
+from __future__ import unicode_literals
+
+import errno
+import getpass
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+
+from six import text_type
+
+from .version import Build, Version
+
+log = logging.getLogger(__name__)
+
+
+def cache_dirname():
+    # Append the username, to avoid permission errors
+    try:
+        user = getpass.getuser()
+    except KeyError:
+        # getuser() fails on some systems. Provide a sane default. See issue #448
+        user = 'exchangelib'
+    return 'exchangelib.endpoints.{user}'.format(user=user)
+
+
+ENDPOINT_PERSISTENT_STORAGE = os.path.join(tempfile.gettempdir(), cache_dirname())
+
+
+def check_private_path(path, is_dir=True):
+    """Raises OSError unless 'path' is a real directory, or a regular file if 'is_dir' is False, that only the current
+    user can write to. Symlinks are not followed.
+    """
+    st = os.lstat(path)
+    if is_dir and (stat.S_ISLNK(st.st_mode) or not stat.S_ISDIR(st.st_mode)):
+        raise OSError('%s is not a directory' % path)
+    if not is_dir and not stat.S_ISREG(st.st_mode):
+        raise OSError('%s is not a regular file' % path)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise OSError('%s is not owned by the current user' % path)
+    if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise OSError('%s is writable by other users' % path)
+
+
+class JSONFileCache(object):
+    """Stores a JSON object per key, in a file in the 'path' directory. The key is stored in the KEY_NAME member of
+    the object. The directory is ignored if other users could have created or modified it, see _check_path()."""
+    KEY_NAME = 'key'
+
+    def __init__(self, path):
+        self.path = path
+        self._warned = False
+
+    def _filename(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _check_path(self):
+        """Raises OSError unless the cache directory is a real directory that only the current user can write to"""
+        check_private_path(self.path)
+
+    def _is_safe_path(self):
+        try:
+            self._check_path()
+        except OSError as e:
+            if e.errno != errno.ENOENT and not self._warned:
+                log.warning('Ignoring unsafe cache directory (%s)', e)
+                self._warned = True
+            return False
+        return True
+
+    def _read(self, key):
+        if not self._is_safe_path():
+            return {}
+        try:
+            with io.open(self._filename(key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError):
+            # No cache entry
+            return {}
+        except ValueError as e:
+            # Corrupt file. Start over.
+            log.warning('Ignoring invalid cache entry for %s %s (%r)', self.KEY_NAME, key, e)
+            return {}
+        if not isinstance(data, dict) or data.get(self.KEY_NAME) != key:
+            # Hash collision or invalid file
+            return {}
+        return data
+
+    def _write(self, key, data):
+        data[self.KEY_NAME] = key
+        try:
+            os.makedirs(self.path, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._check_path()
+        filename = self._filename(key)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with io.open(fd, 'w', encoding='utf-8') as f:
+                f.write(text_type(json.dumps(data)))
+            if sys.platform == 'win32' and os.path.exists(filename):
+                # os.rename() doesn't overwrite files on Windows
+                os.unlink(filename)
+            os.rename(tmp_filename, filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+
+    def _update(self, key, **kwargs):
+        data = self._read(key)
+        data.update(kwargs)
+        try:
+            self._write(key, data)
+        except (IOError, OSError) as e:
+            # The cache is an optimization. Don't fail if we can't write to it.
+            log.warning('Could not update cache entry for %s %s (%r)', self.KEY_NAME, key, e)
+
+    def invalidate(self, key):
+        """Removes the cache entry. Don't fail on non-existing entries because we could end here multiple times due to
+        race conditions."""
+        log.debug('Invalidating cache entry for %s %s', self.KEY_NAME, key)
+        try:
+            os.unlink(self._filename(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        if not self._is_safe_path():
+            return
+        for f in glob.glob(os.path.join(self.path, '*.json')):
+            try:
+                os.unlink(f)
+            except OSError:
+                pass
+
+    def __repr__(self):
+        return self.__class__.__name__ + repr((self.path,))
+
+
+class EndpointCache(JSONFileCache):
+    """Maps EWS endpoint URLs to the auth type, server version and per-mailbox versions we learned from the server"""
+    KEY_NAME = 'endpoint'
+
+    @staticmethod
+    def _version_to_json(version):
+        build = version.build
+        return dict(
+            build=[build.major_version, build.minor_version, build.major_build, build.minor_build],
+            api_version=version.api_version,
+        )
+
+    @staticmethod
+    def _version_from_json(data):
+        if not data:
+            return None
+        try:
+            return Version(build=Build(*data['build']), api_version=data['api_version'])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def get(self, endpoint):
+        """Returns an (auth_type, version) tuple. Values we don't know yet are None"""
+        data = self._read(endpoint)
+        return data.get('auth_type'), self._version_from_json(data.get('version'))
+
+    def set(self, endpoint, auth_type, version):
+        if version is None or version.build is None:
+            # Only cache versions that were confirmed by the server
+            self._update(endpoint, auth_type=auth_type)
+        else:
+            self._update(endpoint, auth_type=auth_type, version=self._version_to_json(version))
+
+    def get_mailbox_version(self, endpoint, mailbox):
+        """Returns the version of the backend server for this mailbox, if it differs from the endpoint version"""
+        data = self._read(endpoint)
+        return self._version_from_json(data.get('mailboxes', {}).get(mailbox.lower()))
+
+    def set_mailbox_version(self, endpoint, mailbox, version):
+        if version.build is None:
+            return
+        data = self._read(endpoint)
+        mailboxes = data.get('mailboxes', {})
+        mailboxes[mailbox.lower()] = self._version_to_json(version)
+        self._update(endpoint, mailboxes=mailboxes)
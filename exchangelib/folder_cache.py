@@ -0,0 +1,33 @@
+# coding=utf-8
+"""
+A persistent cache of folder hierarchies. Fetching the folder hierarchy of a mailbox with thousands of folders is slow,
+and Root normally does it from scratch in every process. With a folder cache, Root stores the hierarchy together with
+the SyncFolderHierarchy sync state. Later processes load the stored hierarchy and only request the changes since the
+last sync. Enable it with e.g.:
+
+    Root.FOLDER_CACHE = FolderHierarchyCache('/var/cache/exchangelib/folders')
+
+The cache contains folder names, so it's disabled by default. Choose a directory that is only readable by the user
+running the process.
+"""
+from __future__ import unicode_literals
+
+import logging
+
+from .endpoint_cache import JSONFileCache
+
+log = logging.getLogger(__name__)
+
+
+class FolderHierarchyCache(JSONFileCache):
+    """Maps mailbox email addresses to a snapshot of the folder hierarchy of the mailbox. See Root.get_snapshot()"""
+    KEY_NAME = 'mailbox'
+
+    def get(self, mailbox):
+        return self._read(mailbox.lower()).get('snapshot')
+
+    def set(self, mailbox, snapshot):
+        self._update(mailbox.lower(), snapshot=snapshot)
+
+    def invalidate(self, mailbox):
+        super(FolderHierarchyCache, self).invalidate(mailbox.lower())
@@ -1,6 +1,7 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 from fnmatch import fnmatch
 import logging
 from operator import attrgetter
@@ -12,8 +13,10 @@ from cached_property import threaded_cached_property
 from future.utils import python_2_unicode_compatible
 from six import text_type, string_types
 
+from .changes import DeleteFolderChange
 from .errors import ErrorAccessDenied, ErrorFolderNotFound, ErrorCannotEmptyFolder, ErrorCannotDeleteObject, \
-    ErrorNoPublicFolderReplicaAvailable, ErrorInvalidOperation, ErrorDeleteDistinguishedFolder, ErrorItemNotFound
+    ErrorNoPublicFolderReplicaAvailable, ErrorInvalidOperation, ErrorDeleteDistinguishedFolder, ErrorItemNotFound, \
+    ErrorInvalidSyncStateData
 from .fields import IntegerField, TextField, DateTimeField, FieldPath, EffectiveRightsField, MailboxField, IdField, \
     EWSElementField
 from .items import Item, CalendarItem, Contact, Message, Task, MeetingRequest, MeetingResponse, MeetingCancellation, \
@@ -178,7 +181,7 @@ class FolderCollection(SearchableMixIn):
         return tuple(item_model for folder in self.folders for item_model in folder.supported_item_models)
 
     def find_items(self, q, shape=ID_ONLY, depth=SHALLOW, additional_fields=None, order_fields=None,
-                   calendar_view=None, page_size=None, max_items=None):
+                   calendar_view=None, page_size=None, max_items=None, priority=None, concurrent_paging=False):
         """
         Private method to call the FindItem service
 
@@ -192,6 +195,9 @@ class FolderCollection(SearchableMixIn):
         :param calendar_view: a CalendarView instance, if any
         :param page_size: the requested number of items per page
         :param max_items: the max number of items to return
+        :param priority: the priority of the requests when waiting for a session
+        :param concurrent_paging: if True, request all pages after the first one concurrently. Only used when
+               searching a single folder without a calendar view
         :return: a generator for the returned item IDs or items
         """
         if shape not in SHAPE_CHOICES:
@@ -211,15 +217,7 @@ class FolderCollection(SearchableMixIn):
             raise ValueError("'calendar_view' %s must be a CalendarView instance" % calendar_view)
 
         # Build up any restrictions
-        if q.is_empty():
-            restriction = None
-            query_string = None
-        elif q.query_string:
-            restriction = None
-            query_string = Restriction(q, folders=self.folders)
-        else:
-            restriction = Restriction(q, folders=self.folders)
-            query_string = None
+        restriction, query_string = self._get_restriction(q)
         log.debug(
             'Finding %s items un folders %s (shape: %s, depth: %s, additional_fields: %s, restriction: %s)',
             self.folders,
@@ -229,7 +227,8 @@ class FolderCollection(SearchableMixIn):
             additional_fields,
             restriction.q if restriction else None,
         )
-        items = FindItem(account=self.account, folders=self.folders, chunk_size=page_size).call(
+        items = FindItem(account=self.account, folders=self.folders, chunk_size=page_size, priority=priority,
+                         concurrent_paging=concurrent_paging).call(
             additional_fields=additional_fields,
             restriction=restriction,
             order_fields=order_fields,
@@ -249,6 +248,36 @@ class FolderCollection(SearchableMixIn):
                 else:
                     yield Folder.item_model_from_tag(i.tag).from_xml(elem=i, account=self.account)
 
+    def count_items(self, q, depth=SHALLOW, priority=None):
+        """
+        Private method to count the items matching a query with a single FindItem request, using the total number of
+        items that the server reports. Doesn't support calendar views.
+
+        :param q: a Q instance containing any restrictions
+        :param depth: controls the whether to count soft-deleted items or not.
+        :param priority: the priority of the requests when waiting for a session
+        :return: the number of matching items
+        """
+        if depth not in ITEM_TRAVERSAL_CHOICES:
+            raise ValueError("'depth' %s must be one of %s" % (depth, ITEM_TRAVERSAL_CHOICES))
+        if not self.folders:
+            log.debug('Folder list is empty')
+            return 0
+        restriction, query_string = self._get_restriction(q)
+        return FindItem(account=self.account, folders=self.folders, chunk_size=1, priority=priority).count(
+            restriction=restriction,
+            query_string=query_string,
+            depth=depth,
+        )
+
+    def _get_restriction(self, q):
+        # Returns a (restriction, query_string) tuple for the Q instance. At most one of them is set.
+        if q.is_empty():
+            return None, None
+        if q.query_string:
+            return None, Restriction(q, folders=self.folders)
+        return Restriction(q, folders=self.folders), None
+
     def _get_folder_fields(self):
         additional_fields = set()
         for folder in self.folders:
@@ -262,7 +291,7 @@ class FolderCollection(SearchableMixIn):
                 )
         return additional_fields
 
-    def find_folders(self, shape=ID_ONLY, depth=DEEP, page_size=None):
+    def find_folders(self, shape=ID_ONLY, depth=DEEP, page_size=None, concurrent_paging=False):
         # 'depth' controls whether to return direct children or recurse into sub-folders
         if not self.account:
             raise ValueError('Folder must have an account')
@@ -275,7 +304,8 @@ class FolderCollection(SearchableMixIn):
             return []
         additional_fields = self._get_folder_fields()
         # TODO: Support the Restriction class for folders, too
-        return FindFolder(account=self.account, folders=self.folders, chunk_size=page_size).call(
+        return FindFolder(account=self.account, folders=self.folders, chunk_size=page_size,
+                          concurrent_paging=concurrent_paging).call(
                 additional_fields=additional_fields,
                 shape=shape,
                 depth=depth,
@@ -395,7 +425,7 @@ class Folder(RegisterMixIn, SearchableMixIn):
     @property
     def children(self):
         # It's dangerous to return a generator here because we may then call methods on a child that result in the
-        # cache being updated while it's iterated.
+        # cache being updated while it's iterated. get_children() returns a list.
         return FolderCollection(account=self.account, folders=self.account.root.get_children(self))
 
     @property
@@ -442,6 +472,16 @@ class Folder(RegisterMixIn, SearchableMixIn):
             for c in self.walk():
                 if fnmatch(c.name, tail or '*'):
                     yield c
+        elif not any(c in head for c in '*?['):
+            # Not a pattern. Look up the child by name
+            c = self.account.root.get_child(self, head)
+            if c is None:
+                return
+            if tail is None:
+                yield c
+                return
+            for f in c.glob(tail):
+                yield f
         else:
             # Regular pattern
             for c in self.children:
@@ -611,7 +651,7 @@ class Folder(RegisterMixIn, SearchableMixIn):
         )
 
     def find_people(self, q, shape=ID_ONLY, depth=SHALLOW, additional_fields=None, order_fields=None, page_size=None,
-                    max_items=None):
+                    max_items=None, priority=None):
         """
         Private method to call the FindPeople service
 
@@ -623,6 +663,7 @@ class Folder(RegisterMixIn, SearchableMixIn):
         :param order_fields: the SortOrder fields, if any
         :param page_size: the requested number of items per page
         :param max_items: the max number of items to return
+        :param priority: the priority of the requests when waiting for a session
         :return: a generator for the returned personas
         """
         if shape not in SHAPE_CHOICES:
@@ -647,7 +688,7 @@ class Folder(RegisterMixIn, SearchableMixIn):
         else:
             restriction = Restriction(q, folders=[self])
             query_string = None
-        personas = FindPeople(account=self.account, chunk_size=page_size).call(
+        personas = FindPeople(account=self.account, chunk_size=page_size, priority=priority).call(
                 folder=self,
                 additional_fields=additional_fields,
                 restriction=restriction,
@@ -897,10 +938,10 @@ class Folder(RegisterMixIn, SearchableMixIn):
             return self.parent
         if other == '.':
             return self
-        for c in self.children:
-            if c.name == other:
-                return c
-        raise ErrorFolderNotFound("No subfolder with name '%s'" % other)
+        child = self.account.root.get_child(self, other)
+        if child is None:
+            raise ErrorFolderNotFound("No subfolder with name '%s'" % other)
+        return child
 
     # Python 2 requires __div__
     __div__ = __truediv__
@@ -916,13 +957,23 @@ class Folder(RegisterMixIn, SearchableMixIn):
 
 class Root(Folder):
     DISTINGUISHED_FOLDER_ID = 'root'
+    # A FolderHierarchyCache instance. If set, the folder hierarchy is stored in the cache and kept up to date with
+    # SyncFolderHierarchy, instead of being fetched from scratch in every process. See exchangelib.folder_cache.
+    FOLDER_CACHE = None
 
     def __init__(self, **kwargs):
         super(Root, self).__init__(**kwargs)
-        self._subfolders = None  # See self._folders_map()
+        self._subfolders = None  # See self._load_folders()
+        # Indexes of self._subfolders, see _set_folders_map()
+        self._parents = {}  # Maps folder ID to (parent ID, name) of the folder, as indexed
+        self._children_by_id = {}  # Maps parent ID to an ordered {folder ID: folder} dict of child folders
+        self._children_by_name = {}  # Maps parent ID to a {name: folder} dict of child folders
+        self._distinguished_folders = {}  # Maps folder class to distinguished folder, see add_distinguished_folder()
+        self._sync_state = None  # The SyncFolderHierarchy sync state of self._subfolders, see sync_hierarchy()
 
     def refresh(self):
         self._subfolders = None
+        self._sync_state = None
         super(Root, self).refresh()
 
     @property
@@ -938,11 +989,16 @@ class Root(Folder):
         if not folder.id:
             raise ValueError("'folder' must have an ID")
         self._folders_map[folder.id] = folder
+        self._unindex_folder(folder.id)
+        self._index_folder(folder)
 
     def update_folder(self, folder):
+        # Must be called when the name or parent of a cached folder changes, to keep the indexes up to date
         if not folder.id:
             raise ValueError("'folder' must have an ID")
         self._folders_map[folder.id] = folder
+        self._unindex_folder(folder.id)
+        self._index_folder(folder)
 
     def remove_folder(self, folder):
         if not folder.id:
@@ -951,25 +1007,96 @@ class Root(Folder):
             del self._folders_map[folder.id]
         except KeyError:
             pass
+        self._unindex_folder(folder.id)
+
+    def _set_folders_map(self, folders_map, sync_state=None):
+        # Publishes a complete folder hierarchy and its sync state. The indexes are built before anything is published,
+        # and the map is published last, so other threads never see a partially loaded hierarchy.
+        indexes = {}, {}, {}
+        for f in folders_map.values():
+            self._index_folder(f, indexes=indexes)
+        self._parents, self._children_by_id, self._children_by_name = indexes
+        self._sync_state = sync_state
+        self._subfolders = folders_map
+
+    def _index_folder(self, folder, indexes=None):
+        if not folder.parent_folder_id or folder.parent_folder_id.id == folder.id:
+            # Some folders have a parent that references itself. Don't make them children of themselves.
+            return
+        parents, children_by_id, children_by_name = indexes or (
+            self._parents, self._children_by_id, self._children_by_name
+        )
+        parent_id = folder.parent_folder_id.id
+        parents[folder.id] = (parent_id, folder.name)
+        children_by_id.setdefault(parent_id, OrderedDict())[folder.id] = folder
+        children_by_name.setdefault(parent_id, {})[folder.name] = folder
+
+    def _unindex_folder(self, folder_id):
+        try:
+            parent_id, name = self._parents.pop(folder_id)
+        except KeyError:
+            return
+        children = self._children_by_id[parent_id]
+        children.pop(folder_id, None)
+        if not children:
+            del self._children_by_id[parent_id]
+        children_by_name = self._children_by_name.get(parent_id, {})
+        if name in children_by_name and children_by_name[name].id == folder_id:
+            del children_by_name[name]
+            if not children_by_name:
+                del self._children_by_name[parent_id]
+
+    def add_distinguished_folder(self, folder):
+        # Caches a distinguished folder that was fetched in advance, so get_default_folder() doesn't need to fetch it
+        if not folder.is_distinguished:
+            raise ValueError("'folder' must be a distinguished folder")
+        self._distinguished_folders[folder.__class__] = folder
 
     def clear_cache(self):
         self._subfolders = None
+        self._sync_state = None
 
     def get_children(self, folder):
-        for f in self._folders_map.values():
-            if not f.parent:
-                continue
-            if f.parent.id == folder.id:
-                yield f
+        self._load_folders()
+        return list(self._children_by_id.get(folder.id, {}).values())
+
+    def get_child(self, folder, name):
+        """Returns the direct child of 'folder' with this name, or None"""
+        self._load_folders()
+        child = self._children_by_name.get(folder.id, {}).get(name)
+        if child is not None and child.name == name:
+            return child
+        # The child may have been renamed without calling update_folder(). Search the children of the folder.
+        for child in self._children_by_id.get(folder.id, {}).values():
+            if child.name == name:
+                return child
+        return None
 
     @property
     def _folders_map(self):
+        self._load_folders()
+        return self._subfolders
+
+    def _load_folders(self, sync=False):
+        # Loads the folder hierarchy and its indexes, unless they are already loaded. If 'sync' is True or FOLDER_CACHE
+        # is set, also gets a sync state for the hierarchy. The hierarchy is built locally and only published when it
+        # is complete.
         if self._subfolders is not None:
-            return self._subfolders
+            return
+
+        if self.FOLDER_CACHE is not None:
+            snapshot = self.FOLDER_CACHE.get(self.account.primary_smtp_address)
+            folders_map = self._load_snapshot(snapshot) if snapshot else None
+            if folders_map is not None:
+                try:
+                    self._sync(folders_map=folders_map, sync_state=snapshot['sync_state'])
+                    return
+                except ErrorInvalidSyncStateData:
+                    log.warning('Cached folder hierarchy of %s is too old. Fetching it again', self.account)
 
         # Map root, and all subfolders of root, at arbitrary depth by folder ID. First get distinguished folders, then
         # everything else. AdminAuditLogs folder is not retrievable and makes the entire request fail.
-        folders_map = {self.id: self}
+        folders_map = OrderedDict([(self.id, self)])
         distinguished_folders = [
             cls(account=self.account, name=cls.DISTINGUISHED_FOLDER_ID, is_distinguished=True)
             for cls in WELLKNOWN_FOLDERS
@@ -991,6 +1118,18 @@ class Root(Folder):
                 if isinstance(f, Exception):
                     raise f
                 folders_map[f.id] = f
+        except ErrorAccessDenied:
+            # We may not have GetFolder access
+            pass
+        if sync or self.FOLDER_CACHE is not None:
+            # Get everything else from a full SyncFolderHierarchy instead of FindFolder. This also gives us a sync
+            # state, so the next process only needs to ask for changes, and we only fetch the hierarchy once.
+            try:
+                self._sync(folders_map=folders_map)
+                return
+            except ErrorAccessDenied:
+                pass
+        try:
             for f in FolderCollection(account=self.account, folders=[self]).find_folders(depth=DEEP):
                 if isinstance(f, Exception):
                     raise f
@@ -999,9 +1138,93 @@ class Root(Folder):
                     continue
                 folders_map[f.id] = f
         except ErrorAccessDenied:
-            # We may not have GetFolder or FindFolder access
+            # We may not have FindFolder access
             pass
-        self._subfolders = folders_map
+        self._set_folders_map(folders_map)
+
+    def sync_hierarchy(self):
+        """Updates the cached folder hierarchy with the changes since the last sync, using SyncFolderHierarchy. Stores
+        the result in FOLDER_CACHE, if set.
+        """
+        if self._subfolders is None:
+            self._load_folders(sync=True)
+            if self._sync_state is not None:
+                # Loading the folder hierarchy also brought it up to date
+                return
+        self._sync()
+
+    def _sync(self, folders_map=None, sync_state=None):
+        # Applies the changes since 'sync_state' to 'folders_map' and publishes the result. Defaults to a copy of the
+        # loaded folder hierarchy and its sync state. Without a sync state, all folders are returned as new folders.
+        if folders_map is None:
+            folders_map, sync_state = OrderedDict(self._subfolders), self._sync_state
+        new_sync_state = sync_state
+        for change in self.account.sync_folder_hierarchy(shape='AllProperties', sync_state=sync_state):
+            if change is None or isinstance(change, string_types):
+                # The last element is the new sync state
+                new_sync_state = change
+            elif isinstance(change, DeleteFolderChange):
+                folder_id, _ = change.item_id
+                folders_map.pop(folder_id, None)
+            elif change.folder is not None:
+                fresh_folder = change.folder
+                folder = folders_map.get(fresh_folder.id)
+                if folder is None:
+                    folders_map[fresh_folder.id] = fresh_folder
+                    continue
+                # Update the existing instance. It may be referenced elsewhere, and it knows if it is distinguished.
+                folder.changekey = fresh_folder.changekey
+                for f in folder.supported_fields():
+                    setattr(folder, f.name, getattr(fresh_folder, f.name, None))
+        self._set_folders_map(folders_map, sync_state=new_sync_state)
+        if self.FOLDER_CACHE is not None:
+            self.FOLDER_CACHE.set(self.account.primary_smtp_address, self.get_snapshot())
+
+    @staticmethod
+    def _snapshot_fields(folder_cls):
+        # Only plain text and integer values can be stored in a snapshot
+        return [f for f in folder_cls.supported_fields() if f.__class__ in (TextField, IntegerField)]
+
+    def get_snapshot(self):
+        """Returns the cached folder hierarchy and its sync state as a JSON-serializable dict"""
+        folders = []
+        for f in self._folders_map.values():
+            if f is self:
+                continue
+            data = {field.name: getattr(f, field.name) for field in self._snapshot_fields(f.__class__)}
+            data.update(
+                folder_cls=f.__class__.__name__,
+                is_distinguished=f.is_distinguished,
+                id=f.id,
+                changekey=f.changekey,
+                parent=[f.parent_folder_id.id, f.parent_folder_id.changekey] if f.parent_folder_id else None,
+            )
+            folders.append(data)
+        return dict(root=self.id, sync_state=self._sync_state, folders=folders)
+
+    def _load_snapshot(self, snapshot):
+        # Returns the folder hierarchy stored in a snapshot created by get_snapshot(), without publishing it. Returns
+        # None if the snapshot can't be used.
+        if snapshot.get('root') != self.id or not snapshot.get('sync_state'):
+            return None
+        folder_classes = {}
+        classes_to_check = [Folder]
+        while classes_to_check:
+            folder_cls = classes_to_check.pop()
+            folder_classes[folder_cls.__name__] = folder_cls
+            classes_to_check.extend(folder_cls.__subclasses__())
+        folders_map = OrderedDict([(self.id, self)])
+        try:
+            for data in snapshot['folders']:
+                folder_cls = folder_classes[data['folder_cls']]
+                kwargs = {f.name: data.get(f.name) for f in self._snapshot_fields(folder_cls)}
+                if data['parent']:
+                    kwargs['parent_folder_id'] = ParentFolderId(id=data['parent'][0], changekey=data['parent'][1])
+                folders_map[data['id']] = folder_cls(account=self.account, is_distinguished=data['is_distinguished'],
+                                                     id=data['id'], changekey=data['changekey'], **kwargs)
+        except (KeyError, IndexError, TypeError) as e:
+            log.warning('Ignoring invalid cached folder hierarchy of %s (%r)', self.account, e)
+            return None
         return folders_map
 
     def get_default_folder(self, folder_cls):
@@ -1009,7 +1232,10 @@ class Root(Folder):
         # folder was found, try as best we can to return the default folder of type 'folder_cls'
         if not folder_cls.DISTINGUISHED_FOLDER_ID:
             raise ValueError("'folder_cls' %s must have a DISTINGUISHED_FOLDER_ID value" % folder_cls)
-        if self._subfolders is not None:
+        if folder_cls in self._distinguished_folders:
+            log.debug('Found prefetched distinguished %s folder', folder_cls)
+            return self._distinguished_folders[folder_cls]
+        if self._subfolders is not None or self.FOLDER_CACHE is not None:
             for f in self._folders_map.values():
                 # Require exact class, to not match subclasses, e.g. RecipientCache instead of Contacts
                 if f.__class__ == folder_cls and f.is_distinguished:
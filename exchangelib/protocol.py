@@ -7,40 +7,277 @@ when creating an Account.
 """
 from __future__ import unicode_literals
 
+from collections import defaultdict, deque, OrderedDict
 import logging
 from multiprocessing.pool import ThreadPool
 import os
-from threading import Lock
+from threading import Condition, Lock, Thread
+import time
 
 import requests.adapters
 import requests.sessions
 from future.utils import with_metaclass, python_2_unicode_compatible
-from future.moves.queue import LifoQueue, Empty, Full
+from future.moves.queue import Empty, Full
 
-from .credentials import Credentials
+from .credentials import Credentials, OAuthCredentials
+from .endpoint_cache import EndpointCache, ENDPOINT_PERSISTENT_STORAGE
 from .errors import TransportError
 from .properties import FreeBusyViewOptions, MailboxData, TimeWindow, TimeZone
 from .services import GetServerTimeZones, GetRoomLists, GetRooms, ResolveNames, GetUserAvailability, \
-    GetSearchableMailboxes
+    GetSearchableMailboxes, PRIORITIES, PRIORITY_NORMAL
 from .transport import get_auth_instance, get_service_authtype, AUTH_TYPE_MAP, DEFAULT_HEADERS
-from .util import split_url
+from .util import split_url, time_func
 from .version import Version, API_VERSIONS
 
 log = logging.getLogger(__name__)
 
+# Exchange sets this cookie to route subsequent requests for the same anchor mailbox directly to its backend server
+BACKEND_COOKIE = 'X-BackEndOverrideCookie'
+
 
 def close_connections():
     CachingProtocol.clear_cache()
 
 
+class SessionPool(object):
+    """
+    A LIFO pool of sessions which is shared by all mailboxes using the same Protocol. When there are no idle sessions,
+    waiting threads are queued per mailbox, and sessions are granted to the mailboxes in turn, in proportion to their
+    weight (stride scheduling). A mailbox with many waiting requests thus can't starve other mailboxes. Optionally,
+    the number of sessions a single mailbox may use at any time can be capped.
+
+    Waiters with a higher priority (see PRIORITIES) are served before waiters with a lower priority, regardless of
+    mailbox. To avoid starving low-priority waiters, a waiter is promoted one priority class for every PRIORITY_AGING
+    seconds it has waited.
+
+    Idle sessions remember the mailbox they last served. A request for a mailbox prefers a session that last served
+    the same mailbox, so consecutive requests for a mailbox reuse the connection and backend server of the previous
+    request. If there is no such session, the most recently used session is handed out.
+
+    The interface follows Queue.LifoQueue, i.e. get() and put() raise Empty and Full.
+    """
+    PRIORITY_AGING = 10
+
+    def __init__(self, maxsize, max_per_mailbox=None):
+        if max_per_mailbox is not None and max_per_mailbox < 1:
+            raise ValueError("'max_per_mailbox' %r must be a positive number" % max_per_mailbox)
+        self.maxsize = maxsize
+        self.max_per_mailbox = max_per_mailbox
+        self._cond = Condition()
+        self._idle = []
+        self._waiters = {}  # Mailbox -> deque of waiters
+        self._in_use = defaultdict(int)  # Mailbox -> number of sessions in use
+        self._owners = {}  # Session id -> mailbox, for sessions in use
+        self._affinity = {}  # Session id -> mailbox last served, for idle sessions
+        self._idle_since = {}  # Session id -> time the session was returned to the pool, for idle sessions
+        self._weights = {}  # Mailbox -> weight, for mailboxes with a non-default weight
+        self._pass = {}  # Mailbox -> virtual time of the next grant to the mailbox
+        self._virtual_time = 0.0  # The virtual time of the latest grant
+
+    def qsize(self):
+        return len(self._idle)
+
+    def num_in_use(self):
+        """Return the number of sessions that were handed out and not returned yet"""
+        with self._cond:
+            return len(self._owners)
+
+    def set_weight(self, mailbox, weight):
+        """Give 'mailbox' a 'weight' times larger share of sessions than mailboxes with the default weight of 1"""
+        if weight <= 0:
+            raise ValueError("'weight' %r must be a positive number" % weight)
+        with self._cond:
+            self._weights[mailbox] = weight
+
+    def get(self, mailbox=None, priority=PRIORITY_NORMAL, block=True, timeout=None):
+        """Get a session to use for a request to 'mailbox'"""
+        if priority not in PRIORITIES:
+            raise ValueError("'priority' %r must be one of %s" % (priority, PRIORITIES))
+        with self._cond:
+            if self._idle and self._is_eligible(mailbox):
+                # Nobody eligible is waiting, since idle sessions are granted to waiters right away
+                return self._grant(mailbox)
+            if not block:
+                raise Empty()
+            waiter = dict(mailbox=mailbox, rank=PRIORITIES.index(priority), since=time_func(), session=None)
+            self._waiters.setdefault(mailbox, deque()).append(waiter)
+            deadline = None if timeout is None else time_func() + timeout
+            while waiter['session'] is None:
+                remaining = None if deadline is None else deadline - time_func()
+                if remaining is not None and remaining <= 0:
+                    self._remove_waiter(waiter)
+                    raise Empty()
+                self._cond.wait(remaining)
+            return waiter['session']
+
+    def put(self, session, block=False):
+        """Return a session to the pool. 'block' is accepted for compatibility with Queue.put()"""
+        with self._cond:
+            mailbox = self._release_owner(session)
+            if len(self._idle) >= self.maxsize:
+                raise Full()
+            self._idle.append(session)
+            self._idle_since[id(session)] = time_func()
+            if mailbox is not None:
+                self._affinity[id(session)] = mailbox
+            self._dispatch()
+
+    def pop_idle(self):
+        """Remove and return the session that has been idle the longest, without granting it to a mailbox. Raises
+        Empty if there are no idle sessions"""
+        with self._cond:
+            if not self._idle:
+                raise Empty()
+            session = self._idle.pop(0)
+            self._idle_since.pop(id(session), None)
+            self._affinity.pop(id(session), None)
+            return session
+
+    def pop_expired(self, max_idle):
+        """Remove and return the sessions that have been idle for more than 'max_idle' seconds"""
+        with self._cond:
+            expires = time_func() - max_idle
+            # Sessions are appended to the idle list, so the sessions that have been idle the longest come first
+            expired = []
+            while self._idle and self._idle_since.get(id(self._idle[0]), 0) < expires:
+                session = self._idle.pop(0)
+                self._idle_since.pop(id(session), None)
+                self._affinity.pop(id(session), None)
+                expired.append(session)
+            return expired
+
+    def discard(self, session):
+        """Forget a session in use which will not be returned to the pool"""
+        with self._cond:
+            self._release_owner(session)
+            self._dispatch()
+
+    def replace(self, session, new_session):
+        """Let 'new_session' take over the place of 'session', which will not be returned to the pool"""
+        with self._cond:
+            mailbox = self._owners.pop(id(session), None)
+            self._owners[id(new_session)] = mailbox
+
+    def _is_eligible(self, mailbox):
+        return self.max_per_mailbox is None or self._in_use[mailbox] < self.max_per_mailbox
+
+    def _grant(self, mailbox):
+        # Hand out an idle session to 'mailbox', and charge the mailbox a stride inversely proportional to its weight.
+        # Prefer the most recently used session that last served the same mailbox.
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._affinity.get(id(self._idle[i])) == mailbox:
+                session = self._idle.pop(i)
+                break
+        else:
+            session = self._idle.pop()
+        self._affinity.pop(id(session), None)
+        self._idle_since.pop(id(session), None)
+        self._owners[id(session)] = mailbox
+        self._in_use[mailbox] += 1
+        pass_ = max(self._pass.get(mailbox, 0.0), self._virtual_time)
+        self._virtual_time = pass_
+        self._pass[mailbox] = pass_ + 1.0 / self._weights.get(mailbox, 1)
+        return session
+
+    def _get_rank(self, waiter, now):
+        # The priority class of the waiter, promoted according to the time it has waited. Lower is better.
+        return max(0, waiter['rank'] - int((now - waiter['since']) / self.PRIORITY_AGING))
+
+    def _dispatch(self):
+        # Grant idle sessions to waiters. Pick the best-ranked waiter, and among mailboxes with equally ranked waiters,
+        # the eligible mailbox with the lowest virtual time. Mailboxes that have been idle start at the current virtual
+        # time, so they can't save up for a burst.
+        granted = False
+        now = time_func()
+        while self._idle:
+            best = None
+            for mailbox, waiters in self._waiters.items():
+                if not self._is_eligible(mailbox):
+                    continue
+                # Waiters are in FIFO order, so min() picks the oldest of the best-ranked waiters
+                waiter = min(waiters, key=lambda w: self._get_rank(w, now))
+                key = self._get_rank(waiter, now), max(self._pass.get(mailbox, 0.0), self._virtual_time)
+                if best is None or key < best[0]:
+                    best = key, waiter
+            if best is None:
+                break
+            waiter = best[1]
+            self._remove_waiter(waiter)
+            waiter['session'] = self._grant(waiter['mailbox'])
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _remove_waiter(self, waiter):
+        waiters = self._waiters[waiter['mailbox']]
+        waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[waiter['mailbox']]
+
+    def _release_owner(self, session):
+        # Returns the mailbox that used the session, if any
+        try:
+            mailbox = self._owners.pop(id(session))
+        except KeyError:
+            return None
+        self._in_use[mailbox] -= 1
+        if not self._in_use[mailbox] and mailbox not in self._waiters:
+            # Forget about inactive mailboxes, unless they still owe us virtual time
+            del self._in_use[mailbox]
+            if self._pass.get(mailbox, 0.0) <= self._virtual_time:
+                self._pass.pop(mailbox, None)
+        return mailbox
+
+
+class RetryBudget(object):
+    """
+    A token bucket limiting the number of retries of failed requests to a fraction of the successful requests. During
+    an outage, every request fails, and retrying all of them would only add to the load on the server. The bucket
+    starts full, each retry takes a token, and each successful request adds 'ratio' tokens.
+    """
+    def __init__(self, max_tokens, ratio):
+        self.max_tokens = max_tokens
+        self.ratio = ratio
+        self._tokens = float(max_tokens)
+        self._lock = Lock()
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def deposit(self):
+        """Register a successful request"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Returns True if we may retry a failed request"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
 class BaseProtocol(object):
     # Base class for Protocol which implements the bare essentials
 
     # The maximum number of sessions (== TCP connections, see below) we will open to this service endpoint. Keep this
     # low unless you have an agreement with the Exchange admin on the receiving end to hammer the server and
     # rate-limiting policies have been disabled for the connecting user.
-    # This pool is shared across all accounts using the same service account in a single process
+    # This pool is shared across all accounts using the same service account in a single process. Sessions are shared
+    # fairly between accounts, see SessionPool.
     SESSION_POOLSIZE = 4
+    # The session pool adapts to the load on the server, within the bounds of 'min_pool_size' and 'max_pool_size'. It
+    # grows by one session when requests are waiting for a session and responses are fast, and is halved when the
+    # server is slow, asks us to back off, or complains about too many open connections. By default, the pool may
+    # shrink to SESSION_POOLSIZE_MIN sessions but will not grow beyond its initial size.
+    SESSION_POOLSIZE_MIN = 1
+    # Responses slower than this number of seconds are taken as a sign that the server is overloaded
+    SESSION_POOL_SLOW_RESPONSE = 30
+    # Don't shrink the pool more often than this number of seconds. Requests that were in flight when the server started
+    # struggling will report errors too, but should only count once.
+    SESSION_POOL_DECREASE_INTERVAL = 10
     # We want only 1 TCP connection per Session object. We may have lots of different credentials hitting the server and
     # each credential needs its own session (NTLM auth will only send credentials once and then secure the connection,
     # so a connection can only handle requests for one credential). Having multiple connections ser Session could
@@ -48,24 +285,52 @@ class BaseProtocol(object):
     CONNECTIONS_PER_SESSION = 1
     # Timeout for HTTP requests
     TIMEOUT = 120
+    # Close sessions that have been idle for longer than this number of seconds. The server closes idle connections
+    # after a while (IIS defaults to 120 seconds), and the first request on such a connection would fail. Closed
+    # sessions are re-created when needed.
+    SESSION_IDLE_TIMEOUT = 100
+    # The max number of retries of failed requests that may be in progress, and the number of retries earned by each
+    # successful request, across all requests to this endpoint. See RetryBudget.
+    RETRY_BUDGET = 50
+    RETRY_BUDGET_RATIO = 0.1
     # The User-Agent header to use for HTTP requests. Override this to set an app-specific one
     USERAGENT = None
 
     # The adapter class to use for HTTP requests. Override this if you need e.g. proxy support or specific TLS versions
     HTTP_ADAPTER_CLS = requests.adapters.HTTPAdapter
+    # An EndpointCache that persists the auth type and versions learned from the server, or None to disable
+    ENDPOINT_CACHE = None
 
-    def __init__(self, service_endpoint, credentials, auth_type, pool_size=None):
+    def __init__(self, service_endpoint, credentials, auth_type, pool_size=None, min_pool_size=None,
+                 max_pool_size=None, max_sessions_per_mailbox=None):
         if not isinstance(credentials, Credentials):
             raise ValueError("'credentials' %r must be a Credentials instance" % credentials)
         if auth_type is not None:
             if auth_type not in AUTH_TYPE_MAP:
                 raise ValueError("'auth_type' %s must be one if %s" % (auth_type, AUTH_TYPE_MAP.keys()))
+        initial_pool_size = pool_size or self.SESSION_POOLSIZE
+        min_pool_size = min_pool_size or min(self.SESSION_POOLSIZE_MIN, initial_pool_size)
+        max_pool_size = max_pool_size or initial_pool_size
+        if not 1 <= min_pool_size <= initial_pool_size <= max_pool_size:
+            raise ValueError("Pool sizes must satisfy 1 <= 'min_pool_size' (%s) <= 'pool_size' (%s) <= 'max_pool_size' "
+                             "(%s)" % (min_pool_size, initial_pool_size, max_pool_size))
         self.has_ssl, self.server, _ = split_url(service_endpoint)
         self.credentials = credentials
         self.service_endpoint = service_endpoint
         self.auth_type = auth_type
-        self._session_pool = None  # Consumers need to fill the session pool themselves
+        self._session_pool = None  # Consumers need to fill the session pool themselves, see _create_session_pool()
+        self._session_pool_lock = Lock()
+        self._session_pool_size = 0  # The number of sessions in existence, i.e. in the pool or in use
+        self._session_pool_target = initial_pool_size  # The number of sessions we want to have
+        self._session_pool_starved = False  # True if someone had to wait for a session since the pool last grew
+        self._session_pool_fast_responses = 0
+        self._session_pool_last_decrease = None
         self.pool_size = pool_size
+        self.min_pool_size = min_pool_size
+        self.max_pool_size = max_pool_size
+        self.max_sessions_per_mailbox = max_sessions_per_mailbox
+        self.retry_budget = RetryBudget(max_tokens=self.RETRY_BUDGET, ratio=self.RETRY_BUDGET_RATIO)
+        self.last_used = time.time()  # The last time a session was handed out or returned
 
     def __del__(self):
         # pylint: disable=bare-except
@@ -76,12 +341,63 @@ class BaseProtocol(object):
             pass
 
     def close(self):
+        # Close idle sessions. Sessions in use are closed when they are released. The protocol is still usable after
+        # this. New sessions are created when needed.
         log.debug('Server %s: Closing sessions', self.server)
         while True:
             try:
-                self._session_pool.get(block=False).close()
+                session = self._session_pool.pop_idle()
             except Empty:
                 break
+            self._close_session(session)
+
+    def close_idle_sessions(self):
+        """Close sessions that have been idle for more than SESSION_IDLE_TIMEOUT seconds"""
+        for session in self._session_pool.pop_expired(self.SESSION_IDLE_TIMEOUT):
+            log.debug('Server %s: Closing idle session %s', self.server, session.session_id)
+            self._close_session(session)
+
+    def _close_session(self, session):
+        # Close a session that was removed from the pool, and make room for a new session
+        with self._session_pool_lock:
+            self._session_pool_size -= 1
+        session.close()
+
+    def _refill_session_pool(self):
+        # Create a new session if sessions were closed and the pool is smaller than we want. Returns True if a session
+        # was added to the pool.
+        with self._session_pool_lock:
+            if self._session_pool_size >= self._session_pool_target:
+                return False
+            self._session_pool_size += 1
+        self._session_pool.put(self.create_session(), block=False)
+        return True
+
+    def get_account_version(self, mailbox):
+        """Returns the cached version for 'mailbox' if its backend server has another version than the endpoint"""
+        if self.ENDPOINT_CACHE is None or not mailbox:
+            return None
+        return self.ENDPOINT_CACHE.get_mailbox_version(self.service_endpoint, mailbox)
+
+    def set_account_version(self, mailbox, version):
+        if self.ENDPOINT_CACHE is None or not mailbox:
+            return
+        self.ENDPOINT_CACHE.set_mailbox_version(self.service_endpoint, mailbox, version)
+
+    def set_version(self, version):
+        self.version = version
+        if self.ENDPOINT_CACHE is not None:
+            self.ENDPOINT_CACHE.set(self.service_endpoint, self.auth_type, version)
+
+    def invalidate_endpoint_cache(self):
+        # Forget what we learned about the endpoint. It will be learned again from the server by the next Protocol
+        if self.ENDPOINT_CACHE is not None:
+            self.ENDPOINT_CACHE.invalidate(self.service_endpoint)
+
+    @property
+    def governor(self):
+        # The ThrottlingGovernor pacing EWS requests to this endpoint, if any
+        return self.credentials.governor
 
     @classmethod
     def get_adapter(cls):
@@ -93,46 +409,188 @@ class BaseProtocol(object):
             max_retries=0,
         )
 
-    def get_session(self):
+    def _create_session_pool(self):
+        self._session_pool = SessionPool(maxsize=self.max_pool_size, max_per_mailbox=self.max_sessions_per_mailbox)
+        for _ in range(self._session_pool_target):
+            self._session_pool.put(self.create_session(), block=False)
+        self._session_pool_size = self._session_pool_target
+
+    @property
+    def session_pool_size(self):
+        return self._session_pool_size
+
+    def set_mailbox_weight(self, mailbox, weight):
+        """When sessions are scarce, give requests for 'mailbox' a 'weight' times larger share of the session pool than
+        other mailboxes"""
+        self._session_pool.set_weight(mailbox, weight)
+
+    def get_session(self, mailbox=None, priority=PRIORITY_NORMAL):
+        # 'mailbox' is the anchor mailbox of the request, used for fair queuing between mailboxes. Sessions are granted
+        # to waiters with a higher 'priority' first.
+        governor = self.governor
+        if governor is not None:
+            # Pace requests to stay within the throttling budget of the server. Do this before we take a session, so we
+            # don't hold on to a session that other requests could use while we wait. The session carries the slot we
+            # acquired until post_ratelimited() sends a request with it, or until the session is released.
+            governor.acquire()
         _timeout = 60  # Rate-limit messages about session starvation
         while True:
             try:
                 log.debug('Server %s: Waiting for session', self.server)
-                session = self._session_pool.get(timeout=_timeout)
+                try:
+                    session = self._session_pool.get(mailbox=mailbox, priority=priority, block=False)
+                except Empty:
+                    if not self._refill_session_pool():
+                        # There's demand for more sessions. This allows the pool to grow if responses are fast
+                        self._session_pool_starved = True
+                    session = self._session_pool.get(mailbox=mailbox, priority=priority, timeout=_timeout)
                 log.debug('Server %s: Got session %s', self.server, session.session_id)
+                self.last_used = time.time()
+                session.pool_args = dict(mailbox=mailbox, priority=priority)
+                session.governor_slot = governor is not None
+                if mailbox is not None and session.anchor_mailbox != mailbox:
+                    # The session last served another mailbox. Don't route this request to that mailbox' backend server
+                    self._clear_backend_cookie(session)
+                    session.anchor_mailbox = mailbox
                 return session
             except Empty:
                 # This is normal when we have many worker threads starving for available sessions
                 log.debug('Server %s: No sessions available for %s seconds', self.server, _timeout)
 
+    @staticmethod
+    def _clear_backend_cookie(session):
+        for cookie in [c for c in session.cookies if c.name == BACKEND_COOKIE]:
+            session.cookies.clear(cookie.domain, cookie.path, cookie.name)
+
+    def _discard_session_if_oversized(self):
+        # Returns True if the pool has more sessions than we want. In that case, the session count has been decremented
+        # and the caller must close the session instead of returning it to the pool.
+        with self._session_pool_lock:
+            if self._session_pool_size > self._session_pool_target:
+                self._session_pool_size -= 1
+                return True
+        return False
+
+    def _release_governor_slot(self, session):
+        # Give back the throttling budget slot of a session that was not used to send a request
+        if getattr(session, 'governor_slot', False):
+            session.governor_slot = False
+            self.governor.release(None)
+
     def release_session(self, session):
-        # This should never fail, as we don't have more sessions than the queue contains
         log.debug('Server %s: Releasing session %s', self.server, session.session_id)
+        self.last_used = time.time()
+        self._release_governor_slot(session)
+        if self._discard_session_if_oversized():
+            log.debug('Server %s: Session pool was shrunk. Closing session %s', self.server, session.session_id)
+            self._session_pool.discard(session)
+            session.close()
+            return
         try:
             self._session_pool.put(session, block=False)
         except Full:
             log.debug('Server %s: Session pool was already full %s', self.server, session.session_id)
 
     def retire_session(self, session):
-        # The session is useless. Close it completely and place a fresh session in the pool
+        # The session is useless. Close it completely and place a fresh session in the pool, unless the pool was shrunk
         log.debug('Server %s: Retiring session %s', self.server, session.session_id)
+        self._release_governor_slot(session)
+        self._session_pool.discard(session)
         session.close()
         del session
+        if self._discard_session_if_oversized():
+            return
         self.release_session(self.create_session())
 
+    def increase_poolsize(self):
+        """Add one session to the pool, unless the pool has reached 'max_pool_size'"""
+        with self._session_pool_lock:
+            if self._session_pool_target >= self.max_pool_size:
+                return
+            log.debug('Server %s: Increasing session pool size from %s to %s', self.server,
+                      self._session_pool_target, self._session_pool_target + 1)
+            self._session_pool_target += 1
+            if self._session_pool_size >= self._session_pool_target:
+                # Sessions that were about to be discarded will now be returned to the pool instead
+                return
+            self._session_pool_size += 1
+        self._session_pool.put(self.create_session(), block=False)
+
+    def decrease_poolsize(self):
+        """Halve the number of sessions in response to signs that the server is overloaded, but not below
+        'min_pool_size'. Sessions in use are closed when they are released.
+        """
+        with self._session_pool_lock:
+            now = time_func()
+            if self._session_pool_last_decrease is not None \
+                    and now - self._session_pool_last_decrease < self.SESSION_POOL_DECREASE_INTERVAL:
+                return
+            new_target = max(self.min_pool_size, self._session_pool_target // 2)
+            if new_target == self._session_pool_target:
+                return
+            log.warning('Server %s: Decreasing session pool size from %s to %s', self.server,
+                        self._session_pool_target, new_target)
+            self._session_pool_target = new_target
+            self._session_pool_fast_responses = 0
+            self._session_pool_last_decrease = now
+        # Close idle sessions right away
+        while self._session_pool_size > self._session_pool_target:
+            try:
+                session = self._session_pool.pop_idle()
+            except Empty:
+                break
+            if self._discard_session_if_oversized():
+                session.close()
+            else:
+                self._session_pool.put(session)
+                break
+
+    def register_response_time(self, seconds):
+        """Adjust the pool size based on the response time of a successful request"""
+        if seconds > self.SESSION_POOL_SLOW_RESPONSE:
+            log.debug('Server %s: Slow response (%s seconds)', self.server, seconds)
+            self.decrease_poolsize()
+            return
+        with self._session_pool_lock:
+            if not self._session_pool_starved:
+                # Nobody needed more sessions than we have
+                return
+            # Additive increase, by one session per round of fast responses across the pool
+            self._session_pool_fast_responses += 1
+            if self._session_pool_fast_responses < self._session_pool_target:
+                return
+            self._session_pool_fast_responses = 0
+            self._session_pool_starved = False
+        self.increase_poolsize()
+
+    def cool_down(self, session, seconds):
+        """Wait 'seconds' before retrying a failed request. The session is retired, so other requests can use its slot
+        in the pool while we wait. Returns a fresh session, acquired with the same arguments as 'session'.
+        """
+        pool_args = session.pool_args
+        self.retire_session(session)
+        time.sleep(seconds)
+        return self.get_session(**pool_args)
+
     def renew_session(self, session):
         # The session is useless. Close it completely and place a fresh session in the pool
         log.debug('Server %s: Renewing session %s', self.server, session.session_id)
         session.close()
+        new_session = self.create_session()
+        if self._session_pool is not None:
+            self._session_pool.replace(session, new_session)
         del session
-        return self.create_session()
+        return new_session
 
     def create_session(self):
         session = requests.sessions.Session()
         # Add some extra info
         session.session_id = sum(map(ord, str(os.urandom(100))))  # Used for debugging messages in services
         session.protocol = self
-        session.auth = get_auth_instance(credentials=self.credentials, auth_type=self.auth_type)
+        session.anchor_mailbox = None  # The mailbox this session last served, see get_session()
+        session.pool_args = {}  # The arguments to get_session() when this session was last acquired
+        session.governor_slot = False  # True if the session holds a throttling budget slot, see get_session()
+        session.auth = get_auth_instance(credentials=self.credentials, auth_type=self.auth_type, protocol=self)
         # Create a copy of the headers because headers are mutable and session users may modify headers
         session.headers.update(DEFAULT_HEADERS.copy())
         session.headers['User-Agent'] = self.USERAGENT
@@ -153,8 +611,17 @@ class BaseProtocol(object):
 
 
 class CachingProtocol(type):
-    _protocol_cache = {}
-    _protocol_cache_lock = Lock()
+    # The max number of cached protocols. The least recently used protocol is evicted when the cache is full.
+    PROTOCOL_CACHE_SIZE = 100
+    # The number of seconds a protocol may stay unused in the cache before it is evicted
+    PROTOCOL_CACHE_TTL = 3600
+    # The number of seconds between runs of the reaper thread that evicts expired protocols and closes idle sessions
+    REAPER_INTERVAL = 30
+
+    _protocol_cache = OrderedDict()  # Maps cache key to [protocol or exception, last used time]. Oldest first.
+    _protocol_cache_lock = Lock()  # Held while creating protocols
+    _protocol_cache_access_lock = Lock()  # Held while reading or modifying the cache. Never held for long.
+    _reaper = None
 
     def __call__(cls, *args, **kwargs):
         # Cache Protocol instances that point to the same endpoint and use the same credentials. This ensures that we
@@ -168,23 +635,25 @@ class CachingProtocol(type):
         # combination should be safe.
         _protocol_cache_key = kwargs['service_endpoint'], kwargs['credentials']
 
-        protocol = cls._protocol_cache.get(_protocol_cache_key)
+        protocol = cls._get_cached(_protocol_cache_key)
         if isinstance(protocol, Exception):
             # The input data leads to a TransportError. Re-throw
             raise protocol
         if protocol is not None:
+            cls._update_credentials(protocol, kwargs['credentials'])
             return protocol
 
         # Acquire lock to guard against multiple threads competing to cache information. Having a per-server lock is
         # probably overkill although it would reduce lock contention.
         log.debug('Waiting for _protocol_cache_lock')
         with cls._protocol_cache_lock:
-            protocol = cls._protocol_cache.get(_protocol_cache_key)
+            protocol = cls._get_cached(_protocol_cache_key)
             if isinstance(protocol, Exception):
                 # Someone got ahead of us while holding the lock, but the input data leads to a TransportError. Re-throw
                 raise protocol
             if protocol is not None:
                 # Someone got ahead of us while holding the lock
+                cls._update_credentials(protocol, kwargs['credentials'])
                 return protocol
             log.debug("Protocol __call__ cache miss. Adding key '%s'", str(_protocol_cache_key))
             try:
@@ -192,27 +661,131 @@ class CachingProtocol(type):
             except TransportError as e:
                 # This can happen if, for example, autodiscover supplies us with a bogus EWS endpoint
                 log.warning('Failed to create cached protocol with key %s: %s', _protocol_cache_key, e)
-                cls._protocol_cache[_protocol_cache_key] = e
+                cls._add_cached(_protocol_cache_key, e)
                 raise e
-            cls._protocol_cache[_protocol_cache_key] = protocol
+            cls._add_cached(_protocol_cache_key, protocol)
+        cls._start_reaper()
         return protocol
 
+    @staticmethod
+    def _update_credentials(protocol, credentials):
+        # OAuth credentials with the same identity are equal, even if they have different tokens. The caller may have
+        # created new credentials to rotate the token. Make the cached protocol use the new token from now on.
+        if isinstance(credentials, OAuthCredentials) and protocol.credentials is not credentials:
+            protocol.credentials = credentials
+
+    @classmethod
+    def _get_cached(mcs, key):
+        with mcs._protocol_cache_access_lock:
+            entry = mcs._protocol_cache.pop(key, None)
+            if entry is None:
+                return None
+            # Mark as most recently used
+            entry[1] = time.time()
+            mcs._protocol_cache[key] = entry
+            return entry[0]
+
+    @classmethod
+    def _add_cached(mcs, key, protocol):
+        with mcs._protocol_cache_access_lock:
+            mcs._protocol_cache.pop(key, None)
+            mcs._protocol_cache[key] = [protocol, time.time()]
+            evicted = mcs._pop_evicted()
+        mcs._close_evicted(evicted)
+
+    @classmethod
+    def _pop_evicted(mcs):
+        # Removes and returns entries that exceed the cache size or have expired, least recently used first. Must be
+        # called with the access lock held. A protocol counts as used when it hands out or takes back a session, not
+        # only when it's looked up in the cache. Protocols with sessions in use are never evicted.
+        evicted = []
+        expire_before = time.time() - mcs.PROTOCOL_CACHE_TTL
+        for key, (protocol, last_used) in list(mcs._protocol_cache.items()):
+            if not isinstance(protocol, Exception):
+                if protocol._session_pool is not None and protocol._session_pool.num_in_use():
+                    continue
+                last_used = max(last_used, protocol.last_used)
+            if len(mcs._protocol_cache) <= mcs.PROTOCOL_CACHE_SIZE and last_used >= expire_before:
+                continue
+            del mcs._protocol_cache[key]
+            evicted.append((key, protocol))
+        return evicted
+
+    @staticmethod
+    def _close_evicted(evicted):
+        # Close sessions and thread pools outside the lock. A protocol object that is still referenced by an account
+        # stays usable; it will open new sessions when needed.
+        for key, protocol in evicted:
+            log.debug("Service endpoint '%s': Evicting protocol from cache", key[0])
+            if isinstance(protocol, Exception):
+                continue
+            protocol.close()
+
+    @classmethod
+    def evict_expired(mcs):
+        """Removes expired protocols from the cache and closes their sessions"""
+        with mcs._protocol_cache_access_lock:
+            evicted = mcs._pop_evicted()
+        mcs._close_evicted(evicted)
+
+    @classmethod
+    def close_all_idle_sessions(mcs):
+        """Closes sessions in all cached protocols that have been idle for too long"""
+        with mcs._protocol_cache_access_lock:
+            protocols = [p for p, _ in mcs._protocol_cache.values() if not isinstance(p, Exception)]
+        for protocol in protocols:
+            protocol.close_idle_sessions()
+
+    @classmethod
+    def _start_reaper(mcs):
+        if mcs._reaper is not None:
+            return
+        with mcs._protocol_cache_access_lock:
+            if mcs._reaper is not None:
+                return
+            mcs._reaper = Thread(target=mcs._reap, name='exchangelib-protocol-reaper')
+            # Don't keep the interpreter alive just for the reaper
+            mcs._reaper.daemon = True
+            mcs._reaper.start()
+
+    @classmethod
+    def _reap(mcs):
+        while True:
+            time.sleep(mcs.REAPER_INTERVAL)
+            try:
+                mcs.evict_expired()
+                mcs.close_all_idle_sessions()
+            except Exception as e:
+                # Never let the reaper die
+                log.warning('Protocol reaper failed: %s', e)
+
     @classmethod
     def clear_cache(mcs):
-        for key, protocol in mcs._protocol_cache.items():
+        with mcs._protocol_cache_access_lock:
+            evicted = list(mcs._protocol_cache.items())
+            mcs._protocol_cache.clear()
+        for key, (protocol, _) in evicted:
             if isinstance(protocol, Exception):
                 continue
             service_endpoint = key[0]
             log.debug("Service endpoint '%s': Closing sessions", service_endpoint)
             protocol.close()
-        mcs._protocol_cache.clear()
 
 
 @python_2_unicode_compatible
 class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
+    ENDPOINT_CACHE = EndpointCache(ENDPOINT_PERSISTENT_STORAGE)
+    # The max number of chunks that a service call sends to the thread pool, or has waiting to be consumed by the
+    # caller, at any time. None means twice the max number of sessions. See EWSPooledMixIn._pool_requests()
+    MAX_IN_FLIGHT = None
+
     def __init__(self, *args, **kwargs):
         version = kwargs.pop('version', None)
         super(Protocol, self).__init__(*args, **kwargs)
+        if self.ENDPOINT_CACHE is not None:
+            cached_auth_type, cached_version = self.ENDPOINT_CACHE.get(self.service_endpoint)
+        else:
+            cached_auth_type, cached_version = None, None
 
         scheme = 'https' if self.has_ssl else 'http'
         self.wsdl_url = '%s://%s/EWS/Services.wsdl' % (scheme, self.server)
@@ -221,33 +794,72 @@ class Protocol(with_metaclass(CachingProtocol, BaseProtocol)):
 
         # Autodetect authentication type if necessary
         # pylint: disable=access-member-before-definition
+        learned = False
         if self.auth_type is None:
-            self.auth_type = get_service_authtype(service_endpoint=self.service_endpoint, versions=API_VERSIONS,
-                                                  name=self.credentials.username)
+            if cached_auth_type in AUTH_TYPE_MAP:
+                self.auth_type = cached_auth_type
+            else:
+                self.auth_type = get_service_authtype(service_endpoint=self.service_endpoint, versions=API_VERSIONS,
+                                                      name=self.credentials.username)
+                learned = True
 
         # Try to behave nicely with the Exchange server. We want to keep the connection open between requests.
         # We also want to re-use sessions, to avoid the NTLM auth handshake on every request.
-        pool_size = self.pool_size or self.SESSION_POOLSIZE
-        self._session_pool = LifoQueue(maxsize=pool_size)
-        for _ in range(pool_size):
-            self._session_pool.put(self.create_session(), block=False)
+        self._create_session_pool()
 
         if version:
             isinstance(version, Version)
             self.version = version
+        elif cached_version:
+            self.version = cached_version
         else:
             # Version.guess() needs auth objects and a working session pool
             self.version = Version.guess(self)
+            learned = True
+        if learned:
+            self.set_version(self.version)
+
+        # The thread pools are created when needed, see the 'thread_pool' and 'paging_thread_pool' properties
+        self._thread_pool = None
+        self._paging_thread_pool = None
+        self._thread_pool_lock = Lock()
 
+    @property
+    def thread_pool(self):
         # Used by services to process service requests that are able to run in parallel. Thread pool should be
         # larger than the connection pool so we have time to process data without idling the connection.
-        # Create the pool as the last thing here, since we may fail in the version or auth type guessing, which would
-        # leave open threads around to be garbage collected.
-        if self.pool_size:
-            thread_poolsize = 4 * self.pool_size
-        else:
-            thread_poolsize = 4 * self.SESSION_POOLSIZE
-        self.thread_pool = ThreadPool(processes=thread_poolsize)
+        if self._thread_pool is None:
+            with self._thread_pool_lock:
+                if self._thread_pool is None:
+                    thread_poolsize = 4 * self.max_pool_size
+                    self._thread_pool = ThreadPool(processes=thread_poolsize)
+        return self._thread_pool
+
+    @property
+    def paging_thread_pool(self):
+        # Used for the page requests of concurrent paging. A paged call may itself run in a worker of 'thread_pool' and
+        # block on its page requests, so they must not wait for a free worker in that pool. Page requests don't submit
+        # work to any pool, so this pool can always make progress.
+        if self._paging_thread_pool is None:
+            with self._thread_pool_lock:
+                if self._paging_thread_pool is None:
+                    self._paging_thread_pool = ThreadPool(processes=self.max_in_flight)
+        return self._paging_thread_pool
+
+    @property
+    def max_in_flight(self):
+        return self.MAX_IN_FLIGHT or 2 * self.max_pool_size
+
+    def close(self):
+        super(Protocol, self).close()
+        # Let the worker threads exit when they have finished their current tasks. A new thread pool is created if
+        # the protocol is used again.
+        with self._thread_pool_lock:
+            thread_pools = self._thread_pool, self._paging_thread_pool
+            self._thread_pool, self._paging_thread_pool = None, None
+        for thread_pool in thread_pools:
+            if thread_pool is not None:
+                thread_pool.close()
 
     def get_timezones(self, timezones=None, return_full_timezone_data=False):
         """ Get timezone definitions from the server
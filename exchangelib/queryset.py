@@ -4,13 +4,16 @@ from __future__ import unicode_literals
 from copy import deepcopy
 from itertools import islice
 import logging
+import threading
 import warnings
 
+from future.moves.queue import Full, Queue
 from future.utils import python_2_unicode_compatible
 
 from .items import CalendarItem, Item, Persona, ALL_OCCURRENCIES, ID_ONLY, SHALLOW
 from .fields import FieldPath, FieldOrder
 from .restriction import Q
+from .services import PRIORITIES
 from .version import EXCHANGE_2010
 
 log = logging.getLogger(__name__)
@@ -79,6 +82,8 @@ class QuerySet(SearchableMixIn):
         self.page_size = None
         self.max_items = None
         self._depth = SHALLOW
+        self._priority = None
+        self._concurrent_paging = False
 
         self._cache = None
 
@@ -110,6 +115,8 @@ class QuerySet(SearchableMixIn):
         new_qs.page_size = self.page_size
         new_qs.max_items = self.max_items
         new_qs._depth = self._depth
+        new_qs._priority = self._priority
+        new_qs._concurrent_paging = self._concurrent_paging
         return new_qs
 
     @property
@@ -221,6 +228,7 @@ class QuerySet(SearchableMixIn):
                 order_fields=order_fields,
                 page_size=self.page_size,
                 max_items=self.max_items,
+                priority=self._priority,
             )
         else:
             find_item_kwargs = dict(
@@ -231,6 +239,8 @@ class QuerySet(SearchableMixIn):
                 calendar_view=self.calendar_view,
                 page_size=self.page_size,
                 max_items=self.max_items,
+                priority=self._priority,
+                concurrent_paging=self._concurrent_paging,
             )
 
             if complex_fields_requested:
@@ -241,6 +251,7 @@ class QuerySet(SearchableMixIn):
                     ids=self.folder_collection.find_items(self.q, **find_item_kwargs),
                     only_fields=additional_fields,
                     chunk_size=self.page_size,
+                    priority=self._priority,
                 )
             else:
                 if not additional_fields:
@@ -294,6 +305,11 @@ class QuerySet(SearchableMixIn):
             yield val
         self._cache = _cache
 
+    def __aiter__(self):
+        # Support 'async for' on Python 3.6+. The query is run in worker threads. See exchangelib.aio
+        from .aio import aiter_queryset
+        return aiter_queryset(self)
+
     def __len__(self):
         if self.is_cached:
             return len(self._cache)
@@ -520,6 +536,24 @@ class QuerySet(SearchableMixIn):
         new_qs._depth = depth
         return new_qs
 
+    def priority(self, priority):
+        """Specify the priority of the requests when waiting for a session (one of PRIORITIES). Use PRIORITY_HIGH for
+        interactive queries and PRIORITY_LOW for batch work
+        """
+        if priority not in PRIORITIES:
+            raise ValueError("'priority' %r must be one of %s" % (priority, PRIORITIES))
+        new_qs = self.copy()
+        new_qs._priority = priority
+        return new_qs
+
+    def concurrent_paging(self, enabled=True):
+        """Request all pages after the first one concurrently instead of one after another. Pages are still returned in
+        order. Useful for large folders. Only applies to queries on a single folder without a calendar view
+        """
+        new_qs = self.copy()
+        new_qs._concurrent_paging = enabled
+        return new_qs
+
     ###########################
     #
     # Methods that end chaining
@@ -534,6 +568,54 @@ class QuerySet(SearchableMixIn):
         # Return an iterator that doesn't bother with caching
         return self._format_items(items=self._query(), return_format=self.return_format)
 
+    def split(self, field, partitions):
+        """Split the query into at most 'partitions' querysets on disjoint ranges of 'field', e.g. 'datetime_received'.
+        The field must support arithmetic, like datetimes and numbers, and should be indexed on the server. Together,
+        the querysets return the items of this queryset that have a value for the field. Each of them can be run, and
+        re-run after a failure, on its own. This sends two small requests to find the lowest and highest value.
+        """
+        if not isinstance(partitions, int) or partitions < 1:
+            raise ValueError("'partitions' %r must be a positive integer" % partitions)
+        if self.request_type != self.ITEM or self.calendar_view is not None:
+            raise ValueError('Only item queries without a calendar view can be split')
+        if self.max_items is not None:
+            raise ValueError('Queries with a maximum number of items cannot be split')
+        if self.q is None:
+            return []
+        values_qs = self.filter(**{'%s__exists' % field: True})
+        try:
+            lo = values_qs.order_by(field).values_list(field, flat=True)[0]
+            hi = values_qs.order_by('-%s' % field).values_list(field, flat=True)[0]
+        except IndexError:
+            # No items have a value for this field
+            return [values_qs]
+        boundaries = []
+        for i in range(1, partitions):
+            try:
+                b = lo + (hi - lo) * i // partitions
+            except TypeError:
+                raise ValueError("Field '%s' of type %s cannot be split" % (field, type(lo)))
+            if b > lo and (not boundaries or b > boundaries[-1]):
+                boundaries.append(b)
+        edges = [None] + boundaries + [None]
+        querysets = []
+        for start, end in zip(edges, edges[1:]):
+            kwargs = {'%s__exists' % field: True}
+            if start is not None:
+                kwargs['%s__gte' % field] = start
+            if end is not None:
+                kwargs['%s__lt' % field] = end
+            querysets.append(self.filter(**kwargs))
+        return querysets
+
+    def partitioned_scan(self, field='datetime_received', partitions=16, max_queued=1000):
+        """Split the query into disjoint ranges of 'field' (see split()) and run the ranges in parallel, each as an
+        independent stream of FindItem requests. Items are returned in the order they arrive, not in the order of the
+        query. 'max_queued' is the number of items we buffer before pausing the streams. Useful for full mailbox crawls
+        """
+        querysets = self.split(field=field, partitions=partitions)
+        return _merge_concurrently([qs.iterator() for qs in querysets], max_queued=max_queued)
+
     def get(self, *args, **kwargs):
         """ Assume the query will return exactly one item. Return that item """
         if 'item_id' in kwargs:
@@ -553,7 +635,7 @@ class QuerySet(SearchableMixIn):
                 only_fields = {FieldPath(field=f) for f in self.folder_collection.allowed_fields()}
             else:
                 only_fields = self.only_fields
-            items = list(account.fetch(ids=[(item_id, changekey)], only_fields=only_fields))
+            items = list(account.fetch(ids=[(item_id, changekey)], only_fields=only_fields, priority=self._priority))
         else:
             new_qs = self.filter(*args, **kwargs)
             items = list(new_qs.__iter__())
@@ -564,10 +646,17 @@ class QuerySet(SearchableMixIn):
         return items[0]
 
     def count(self, page_size=1000):
-        """ Get the query count, with as little effort as possible 'page_size' is the number of items to
-        fetch from the server per request. We're only fetching the IDs, so keep it high"""
+        """ Get the query count, with as little effort as possible. Usually, we can use the total number of items
+        reported by the server in a single request. Otherwise, we fetch the IDs of all items. 'page_size' is the number
+        of items to fetch from the server per request in that case. We're only fetching the IDs, so keep it high"""
         if self.is_cached:
             return len(self._cache)
+        if self.q is None:
+            return 0
+        if self.request_type == self.ITEM and self.calendar_view is None:
+            # Calendar views unfold recurring items, so the total reported by the server is not the number of results
+            count = self.folder_collection.count_items(self.q, depth=self._depth, priority=self._priority)
+            return count if self.max_items is None else min(count, self.max_items)
         new_qs = self.copy()
         new_qs.only_fields = tuple()
         new_qs.order_fields = None
@@ -591,6 +680,7 @@ class QuerySet(SearchableMixIn):
                 ids=self._cache,
                 affected_task_occurrences=ALL_OCCURRENCIES,
                 chunk_size=page_size,
+                priority=self._priority,
             )
             self._cache = None  # Invalidate the cache after delete, regardless of the results
             return res
@@ -603,6 +693,7 @@ class QuerySet(SearchableMixIn):
             ids=new_qs,
             affected_task_occurrences=ALL_OCCURRENCIES,
             chunk_size=page_size,
+            priority=self._priority,
         )
 
     def __str__(self):
@@ -612,6 +703,50 @@ class QuerySet(SearchableMixIn):
         return self.__class__.__name__ + '(%s)' % ', '.join('%s=%s' % (k, v) for k, v in fmt_args)
 
 
+def _merge_concurrently(iterables, max_queued):
+    # Consume each iterable in its own thread and yield the values in the order they arrive. We don't use the thread
+    # pool of the protocol because the iterables use it themselves. The threads stop when the consumer stops iterating.
+    results = Queue(maxsize=max_queued)
+    cancelled = threading.Event()
+    done = object()
+
+    def put(value):
+        while not cancelled.is_set():
+            try:
+                results.put(value, timeout=1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def consume(iterable):
+        try:
+            for value in iterable:
+                if not put((value, None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((done, None))
+
+    for iterable in iterables:
+        t = threading.Thread(target=consume, args=(iterable,))
+        t.daemon = True
+        t.start()
+    running = len(iterables)
+    try:
+        while running:
+            value, e = results.get()
+            if e is not None:
+                raise e
+            if value is done:
+                running -= 1
+                continue
+            yield value
+    finally:
+        cancelled.set()
+
+
 def _get_value_or_default(item, field_order):
     # Python can only sort values when <, > and = are implemented for the two types. Try as best we can to sort
     # items, even when the item may have a None value for the field in question, or when the item is an
@@ -14,6 +14,7 @@ from __future__ import unicode_literals
 
 import os
 import abc
+from collections import deque
 import datetime
 import time
 from itertools import chain
@@ -21,6 +22,7 @@ import logging
 from sys import stdout
 import traceback
 
+from future.moves.queue import Empty, Queue
 from six import ensure_text, text_type
 
 from . import errors
@@ -40,13 +42,21 @@ from .errors import EWSWarning, TransportError, SOAPError, ErrorTimeoutExpired,
 from .ewsdatetime import EWSDateTime, NaiveDateTimeNotAllowed
 from .transport import wrap, extra_headers
 from .util import chunkify, create_element, add_xml_child, get_xml_attr, to_xml, post_ratelimited, \
-    xml_to_str, set_xml_value, peek, xml_text_to_value, PrettyXmlHandler, SOAPNS, TNS, MNS, ENS, ParseError, \
-    RestrictedElement
+    xml_to_str, set_xml_value, peek, xml_text_to_value, iterparse_chunks, PullParser, PrettyXmlHandler, \
+    SOAPNS, TNS, MNS, ENS, BOM, BOM_LEN, ParseError, RestrictedElement
 from .version import EXCHANGE_2010, EXCHANGE_2010_SP2, EXCHANGE_2013, EXCHANGE_2013_SP1
 
 log = logging.getLogger(__name__)
 
 CHUNK_SIZE = 100  # A default chunk size for all services
+STREAMING_READ_SIZE = 64 * 1024  # The number of bytes to read from the socket at a time when streaming responses
+
+# Priority classes for service calls. When all sessions of a protocol are busy, requests with a higher priority get the
+# next free session. Use PRIORITY_HIGH for interactive requests and PRIORITY_LOW for batch work like backfills.
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
 req_id = 0
 
 class EWSService(object):
@@ -54,6 +64,9 @@ class EWSService(object):
 
     SERVICE_NAME = None  # The name of the SOAP service
     element_container_name = None  # The name of the XML element wrapping the collection of returned items
+    supports_streaming = False  # Whether responses can be parsed incrementally. See _get_streamed_elements()
+    supports_unordered = False  # Whether results can be returned in completion order. See EWSPooledMixIn
+    supports_concurrent_paging = False  # Whether pages can be fetched concurrently. See PagingEWSMixIn
     # Return exception instance instead of raising exceptions for the following errors when contained in an element
     ERRORS_TO_CATCH_IN_RESPONSE = (
         EWSWarning, ErrorCannotDeleteObject, ErrorInvalidChangeKey, ErrorItemNotFound, ErrorItemSave,
@@ -65,8 +78,6 @@ class EWSService(object):
     # Define the warnings we want to ignore, to let response processing proceed
     WARNINGS_TO_IGNORE_IN_RESPONSE = ()
     # These are known and understood, and don't require a backtrace.
-    # TODO: ErrorTooManyObjectsOpened means there are too many connections to the database.
-    # We should be able to act on this by lowering the self.protocol connection pool size.
     ERRORS_TO_CATCH_AND_RERAISE = (
         ErrorAccessDenied,
         ErrorADUnavailable,
@@ -95,13 +106,28 @@ class EWSService(object):
         UnauthorizedError,
     )
 
-    def __init__(self, protocol, chunk_size=None):
+    def __init__(self, protocol, chunk_size=None, streaming=False, priority=None, ordered=True,
+                 concurrent_paging=False):
         self.chunk_size = chunk_size or CHUNK_SIZE  # The number of items to send in a single request
         if not isinstance(self.chunk_size, int):
             raise ValueError("'chunk_size' %r must be an integer" % chunk_size)
         if self.chunk_size < 1:
             raise ValueError("'chunk_size' must be a positive number")
+        if streaming and not self.supports_streaming:
+            raise ValueError('%s does not support streaming' % self.__class__.__name__)
+        if not ordered and not self.supports_unordered:
+            raise ValueError('%s does not support unordered results' % self.__class__.__name__)
+        if concurrent_paging and not self.supports_concurrent_paging:
+            raise ValueError('%s does not support concurrent paging' % self.__class__.__name__)
+        self.priority = priority or PRIORITY_NORMAL  # The priority of our requests when waiting for a session
+        if self.priority not in PRIORITIES:
+            raise ValueError("'priority' %r must be one of %s" % (priority, PRIORITIES))
         self.protocol = protocol
+        self.streaming = streaming
+        # If False, results are returned as (input index, result) tuples, in the order the requests finish
+        self.ordered = ordered
+        # If True, pages after the first one are requested concurrently
+        self.concurrent_paging = concurrent_paging
 
     # The following two methods are the minimum required to be implemented by subclasses, but the name and number of
     # kwargs differs between services. Therefore, we cannot make these methods abstract.
@@ -114,22 +140,30 @@ class EWSService(object):
     # def get_payload(self, **kwargs):
     #     raise NotImplementedError()
 
-    def _get_elements(self, payload, headers=None):
+    def _get_elements(self, payload, headers=None, indexed=False):
+        # If 'indexed' is True, return (ResponseMessage index, element) tuples instead of bare elements
         if not isinstance(payload, RestrictedElement):
             raise ValueError("'payload' %r must be an RestrictedElement" % payload)
         while True:
             try:
+                if self.streaming:
+                    # Start reading the response here, so SOAP errors are raised before we leave the try-except
+                    _, elems = peek(self._get_streamed_elements(payload=payload, indexed=indexed))
+                    return elems
                 # Send the request, get the response and do basic sanity checking on the SOAP XML
                 response = self._get_response_xml(payload=payload)
                 # Read the XML and throw any general EWS error messages. Return a generator over the result elements
+                if indexed:
+                    return self._get_indexed_elements_in_response(response=response)
                 return self._get_elements_in_response(response=response)
             except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
+                self._handle_back_off(e)
                 # We'll warn about this if we actually need to sleep
                 continue
+            except ErrorTooManyObjectsOpened:
+                # There are too many connections to the mailbox database. Use fewer concurrent sessions from now on
+                self.protocol.decrease_poolsize()
+                raise
             except (
                     ErrorAccessDenied,
                     ErrorADUnavailable,
@@ -153,13 +187,10 @@ class EWSService(object):
                     ErrorNoRespondingCASInDestinationSite,
                     ErrorQuotaExceeded,
                     ErrorTimeoutExpired,
-                    ErrorTooManyObjectsOpened,
                     RateLimitError,
                     UnauthorizedError,
             ):
                 # These are known and understood, and don't require a backtrace
-                # TODO: ErrorTooManyObjectsOpened means there are too many connections to the database. We should be
-                # able to act on this by lowering the self.protocol connection pool size.
                 raise
             except Exception:
                 # This may run from a thread pool, which obfuscates the stack trace. Print trace immediately.
@@ -168,6 +199,19 @@ class EWSService(object):
                             account, traceback.format_exc(20))
                 raise
 
+    def _handle_back_off(self, e):
+        # Handle an ErrorServerBusy exception. Must be called from within the 'except' block handling the exception.
+        log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
+        # The server is overloaded. Use fewer concurrent sessions from now on
+        self.protocol.decrease_poolsize()
+        governor = self.protocol.governor
+        if governor is not None:
+            # Teach the governor about the throttling budget, so it can pace requests before we are throttled again
+            governor.register_back_off(e.back_off)
+        if self.protocol.credentials.fail_fast:
+            raise e
+        self.protocol.credentials.back_off(e.back_off)
+
     def _get_elements_from_xml_text(self, raw_text):
         """
         This is useful for testing.
@@ -190,6 +234,10 @@ class EWSService(object):
                 for elem in self._get_elements_in_response(response=response):
                     yield elem
 
+        except ErrorTooManyObjectsOpened:
+            # There are too many connections to the mailbox database. Use fewer concurrent sessions from now on
+            self.protocol.decrease_poolsize()
+            raise
         except self.ERRORS_TO_CATCH_AND_RERAISE:
             raise
         except Exception:
@@ -224,7 +272,7 @@ class EWSService(object):
 
         got_envelopes = False
         for api_version in api_versions:
-            session = self.protocol.get_session()
+            session = self._get_session(account)
             try:
                 req_id += 1
                 local_req_id = req_id
@@ -241,12 +289,10 @@ class EWSService(object):
                     timeout=timeout)
                 got_envelopes = False
                 for envelope in self._parse_envelopes(r):
-                    result = self._handle_xml_response(r, envelope, account, api_version, hint)
+                    self._write_xml('streaming-response', local_req_id, envelope)
+                    result = self._handle_xml_response(envelope, account, api_version, hint)
                     if result is None:
                         break
-                    for r in result:
-                        if r.text is not None:
-                            self._write_xml('streaming-response', local_req_id, r.text)
                     got_envelopes = True
                     yield result
             finally:
@@ -259,6 +305,11 @@ class EWSService(object):
             raise ErrorInvalidSchemaVersionForMailboxVersion(
                 'Tried versions %s but all were invalid for account %s' % (api_versions, account))
 
+    def _get_session(self, account):
+        # Queue for a session on behalf of the anchor mailbox of the request, so mailboxes share the pool fairly
+        return self.protocol.get_session(mailbox=account.primary_smtp_address if account else None,
+                                         priority=self.priority)
+
     def _write_xml(self, ftype, req_id, xml_str):
         if os.environ.get('TRACE_EWS') is None:
             return
@@ -272,25 +323,56 @@ class EWSService(object):
         elif ftype == 'streaming-response':
             stdout.write(u'STREAMING RESPONSE {} <<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< {}\n'.format(req_id, now))
 
+        if isinstance(xml_str, RestrictedElement):
+            xml_str = xml_to_str(xml_str, encoding='utf-8')
         stdout.write(ensure_text(PrettyXmlHandler.prettify_xml(xml_str) + b'\n'))
 
-    def _parse_envelopes(self, response):
+    @staticmethod
+    def _parse_envelopes(response):
+        # A streaming response is a series of complete SOAP documents. Feed the bytes to a push parser and yield each
+        # Envelope element as soon as it has been closed. A parser only accepts one document, so we must start a new
+        # one at each document boundary. Find candidate boundaries by searching for the end of a closing Envelope tag
+        # in new data only, and let the parser decide whether the document actually ended there.
+        marker = b'Envelope>'
+        envelope_tag = '{%s}Envelope' % SOAPNS
+
+        def feed(parser, data):
+            if parser is None:
+                # Skip whitespace and BOM between documents
+                data = data.lstrip()
+                if data[:BOM_LEN] == BOM:
+                    data = data[BOM_LEN:]
+                if not data:
+                    return None
+                parser = PullParser(events=('end',), tag=envelope_tag)
+            parser.feed(data)
+            return parser
+
+        parser = None
+        pending = b''  # Data that has not been fed to the parser yet
         try:
-            envelope_str = '</Envelope>'
-            curr_envelope = ''
-            for chunk in response.iter_content():
+            for chunk in response.iter_content(chunk_size=STREAMING_READ_SIZE):
                 if not chunk:
                     continue
-                chunk = ensure_text(chunk)
-                curr_envelope += chunk
-                index = curr_envelope.find(envelope_str)
-                if index == -1:
-                    continue
-                yield curr_envelope[0:index + len(envelope_str)]
-                curr_envelope = curr_envelope[index + len(envelope_str):]
-        except Exception as e:
-            print('Error parsing envelopes: {}'.format(e))
-            raise
+                pending += chunk
+                start = 0
+                while True:
+                    i = pending.find(marker, start)
+                    if i == -1:
+                        break
+                    end = i + len(marker)
+                    parser = feed(parser, pending[start:end])
+                    start = end
+                    if parser is not None and any(True for _ in parser.read_events()):
+                        yield parser.close()
+                        parser = None
+                # Hold back the last few bytes, in case they contain the beginning of a closing Envelope tag
+                feed_end = max(start, len(pending) - len(marker) + 1)
+                if feed_end > start:
+                    parser = feed(parser, pending[start:feed_end])
+                pending = pending[feed_end:]
+        except ParseError as e:
+            raise SOAPError('Bad SOAP response: %s' % e)
 
     def _get_response_xml(self, payload, headers=None):
         # Takes an XML tree and returns SOAP payload as an XML tree
@@ -311,10 +393,10 @@ class EWSService(object):
             self._write_xml('request', local_req_id, soap_payload)
             r, session = post_ratelimited(
                 protocol=self.protocol,
-                session=self.protocol.get_session(),
+                session=self._get_session(account),
                 url=self.protocol.service_endpoint,
-                headers=extra_headers(account=account),
-                data=wrap(content=payload, version=api_version, account=account),
+                headers=http_headers,
+                data=soap_payload,
                 allow_redirects=False,
                 stream=False)
             self.protocol.release_session(session)
@@ -351,14 +433,112 @@ class EWSService(object):
                                                              (api_versions, account))
         raise ErrorInvalidServerVersion('Tried versions %s but all were invalid' % api_versions)
 
-    def _handle_xml_response(self, response, text, account, api_version, hint):
-        log.debug('Trying API version %s for account %s', api_version, account)
+    def _get_streamed_elements(self, payload, indexed=False):
+        # Like _get_elements_in_response(self._get_response_xml(payload)), but reads and parses the HTTP response
+        # incrementally. The session is held until the generator is exhausted or closed. If 'indexed' is True, yields
+        # (ResponseMessage index, element) tuples instead of bare elements.
+        account, hint = self._get_account_and_version_hint()
+        api_versions = self._get_versions_to_try(hint)
+
+        global req_id
+
+        for api_version in api_versions:
+            log.debug('Trying API version %s for account %s', api_version, account)
+            soap_payload = wrap(content=payload, version=api_version, account=account)
+            req_id += 1
+            self._write_xml('streaming-request', req_id, soap_payload)
+            r, session = post_ratelimited(
+                protocol=self.protocol,
+                session=self._get_session(account),
+                url=self.protocol.service_endpoint,
+                headers=extra_headers(account=account),
+                data=soap_payload,
+                allow_redirects=False,
+                stream=True)
+            try:
+                elems = self._iterparse_elements(response=r, hint=hint, api_version=api_version)
+                try:
+                    # SOAP faults arrive before any elements, so we can still try the next version here
+                    _, elems = peek(elems)
+                except ErrorInvalidServerVersion:
+                    log.debug('API version %s was invalid', api_version)
+                    continue
+                except ErrorInvalidSchemaVersionForMailboxVersion:
+                    if not account:
+                        # This should never happen for non-account services
+                        raise ValueError("'account' should not be None")
+                    log.debug('API version %s was invalid for account %s', api_version, account)
+                    continue
+                for i, elem in elems:
+                    yield (i, elem) if indexed else elem
+                return
+            finally:
+                r.close()
+                self.protocol.release_session(session)
+        if account:
+            raise ErrorInvalidSchemaVersionForMailboxVersion('Tried versions %s but all were invalid for account %s' %
+                                                             (api_versions, account))
+        raise ErrorInvalidServerVersion('Tried versions %s but all were invalid' % api_versions)
+
+    def _iterparse_elements(self, response, hint, api_version):
+        # Yields each element in the container of a successful ResponseMessage as soon as it is complete, and detaches
+        # it from the tree afterwards. Peak memory usage is bounded by the size of one element, not the whole response.
+        # Other ResponseMessages are handled as a whole by _get_elements_in_response(). Elements are yielded as
+        # (ResponseMessage index, element) tuples.
+        body_tag = '{%s}Body' % SOAPNS
+        response_tag = '{%s}%sResponse' % (MNS, self.SERVICE_NAME)
+        message_tag = '{%s}%sResponseMessage' % (MNS, self.SERVICE_NAME)
+        header = None
+        got_response = False
+        container = None
+        msg_index = 0
         try:
-            soap_response_payload = to_xml(text)
+            for event, elem in iterparse_chunks(response.iter_content(chunk_size=STREAMING_READ_SIZE)):
+                parent = elem.getparent()
+                if event == 'start':
+                    if elem.tag == response_tag:
+                        got_response = True
+                        self._update_api_version(hint=hint, api_version=api_version, header=header)
+                    elif elem.tag == self.element_container_name and parent is not None \
+                            and parent.tag == message_tag and parent.get('ResponseClass') == 'Success' \
+                            and get_xml_attr(parent, '{%s}ResponseCode' % MNS) == 'NoError':
+                        container = elem
+                    continue
+                if elem.tag == '{%s}Header' % SOAPNS:
+                    header = elem
+                elif elem.tag == '{%s}Fault' % SOAPNS:
+                    try:
+                        self._raise_soap_errors(fault=elem)  # Will throw SOAPError or custom EWS error
+                    except (ErrorInvalidServerVersion, ErrorInvalidSchemaVersionForMailboxVersion):
+                        raise
+                    except ResponseMessageError:
+                        # We still want to get any new version info from the response
+                        try:
+                            self._update_api_version(hint=hint, api_version=api_version, header=header)
+                        except TransportError as te:
+                            log.debug('Failed to update version info (%s)', te)
+                        raise
+                elif container is not None and parent is container:
+                    for c in self._get_elements_in_container(container=[elem]):
+                        yield msg_index, c
+                    container.remove(elem)
+                elif elem.tag == message_tag:
+                    if container is None:
+                        for c in self._get_elements_in_response(response=[elem]):
+                            yield msg_index, c
+                    container = None
+                    msg_index += 1
+                    parent.remove(elem)
+                elif elem.tag == body_tag and not got_response:
+                    raise SOAPError('Unknown SOAP response: %s' % xml_to_str(elem))
         except ParseError as e:
             raise SOAPError('Bad SOAP response: %s' % e)
+
+    def _handle_xml_response(self, envelope, account, api_version, hint):
+        log.debug('Trying API version %s for account %s', api_version, account)
+        header = envelope.find('{%s}Header' % SOAPNS)
         try:
-            res = self._get_soap_payload(soap_response=soap_response_payload)
+            res = self._get_soap_payload(soap_response=envelope)
         except (ErrorInvalidSchemaVersionForMailboxVersion, ErrorInvalidServerVersion):
             if not account:
                 # This should never happen for non-account services
@@ -368,13 +548,13 @@ class EWSService(object):
             return None
         except ResponseMessageError:
             # We got an error message from Exchange, but we still want to get any new version info from the response
-            self._update_api_version(hint=hint, api_version=api_version, response=response)
+            self._update_api_version(hint=hint, api_version=api_version, header=header)
             raise
         else:
-            self._update_api_version(hint=hint, api_version=api_version, response=response)
+            self._update_api_version(hint=hint, api_version=api_version, header=header)
         return res
 
-    def _update_api_version(self, hint, api_version, response):
+    def _update_api_version(self, hint, api_version, response=None, header=None):
         if api_version == hint.api_version and hint.build is not None:
             # Nothing to do
             return
@@ -385,11 +565,15 @@ class EWSService(object):
             log.debug('Found new API version (%s -> %s)', hint.api_version, api_version)
         else:
             log.debug('Adding missing build number %s', api_version)
-        new_version = Version.from_response(requested_api_version=api_version, response=response.content)
+        if response is not None:
+            new_version = Version.from_response(requested_api_version=api_version, response=response.content)
+        else:
+            new_version = Version.from_soap_header(requested_api_version=api_version, header=header)
         if isinstance(self, EWSAccountService):
             self.account.version = new_version
+            self.protocol.set_account_version(self.account.primary_smtp_address, new_version)
         else:
-            self.protocol.version = new_version
+            self.protocol.set_version(new_version)
 
     @classmethod
     def _get_soap_payload(cls, soap_response):
@@ -497,14 +681,21 @@ class EWSService(object):
                     code, text, msg_xml))
 
     def _get_elements_in_response(self, response):
-        for msg in response:
+        for _, elem in self._get_indexed_elements_in_response(response=response):
+            yield elem
+
+    def _get_indexed_elements_in_response(self, response):
+        # Yields (ResponseMessage index, element) tuples. A ResponseMessage may contain zero elements (e.g. CreateItem
+        # with SEND_ONLY, or MoveItem to another mailbox), so the position of an element in the output does not
+        # necessarily match the position of the input item it belongs to. The ResponseMessage index does.
+        for i, msg in enumerate(response):
             try:
                 container_or_exc = self._get_element_container(message=msg, name=self.element_container_name)
                 if isinstance(container_or_exc, (bool, Exception)):
-                    yield container_or_exc
+                    yield i, container_or_exc
                 else:
                     for c in self._get_elements_in_container(container=container_or_exc):
-                        yield c
+                        yield i, c
             except ErrorInvalidIdMalformedEwsLegacyIdFormat as e:
                 msg_text = get_xml_attr(msg, '{%s}MessageText' % MNS)
                 log.error(
@@ -596,6 +787,8 @@ class EWSSubscriptionService(EWSAccountService):
 
 
 class PagingEWSMixIn(EWSService):
+    supports_concurrent_paging = True
+
     def _paged_call(self, payload_func, max_items, **kwargs):
         if isinstance(self, EWSAccountService):
             log_prefix = 'EWS %s, account %s, service %s' % (
@@ -606,6 +799,13 @@ class PagingEWSMixIn(EWSService):
             expected_message_count = len(self.folders)
         else:
             expected_message_count = 1
+        if self.concurrent_paging:
+            if expected_message_count == 1 and kwargs.get('calendar_view') is None:
+                for elem in self._concurrent_paged_call(payload_func=payload_func, max_items=max_items, **kwargs):
+                    yield elem
+                return
+            # Offsets are shared by all folders, and calendar views don't support offsets
+            log.debug('%s: Concurrent paging is only supported for one folder without a calendar view', log_prefix)
         paging_infos = [dict(item_count=0, next_offset=None) for _ in range(expected_message_count)]
         common_next_offset = 0
         total_item_count = 0
@@ -616,10 +816,7 @@ class PagingEWSMixIn(EWSService):
             try:
                 response = self._get_response_xml(payload=payload)
             except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
+                self._handle_back_off(e)
                 # We'll warn about this if we actually need to sleep
                 continue
             if len(response) != expected_message_count:
@@ -665,6 +862,93 @@ class PagingEWSMixIn(EWSService):
                 raise MalformedResponseError('Inconsistent next offsets: %s' % unique_item_counts)
             common_next_offset = unique_item_counts.pop()
 
+    def _concurrent_paged_call(self, payload_func, max_items, **kwargs):
+        # Gets the first page, and then requests the remaining pages concurrently via the paging thread pool of the
+        # protocol, since the first page tells us the total number of items and the page size. Pages are yielded in
+        # order, and the same in-flight window as in EWSPooledMixIn applies. If a page is short, e.g. because items were
+        # deleted while we were paging, or the view grew so the last page is not the last one anymore, the pages we
+        # requested don't line up with the offsets reported by the server. We then continue with ordinary paging.
+        def get_page(offset):
+            log.debug('%s: Getting items at offset %s (max_items %s)', self.SERVICE_NAME, offset, max_items)
+            payload = payload_func(offset=offset, **kwargs)
+            while True:
+                try:
+                    response = self._get_response_xml(payload=payload)
+                    break
+                except ErrorServerBusy as e:
+                    self._handle_back_off(e)
+            if len(response) != 1:
+                raise MalformedResponseError("Expected 1 item in 'response', got %s (%s)" % (len(response), response))
+            rootfolder, next_offset = self._get_page(response[0])
+            if rootfolder is None:
+                return [], next_offset, 0
+            container = rootfolder.find(self.element_container_name)
+            if container is None:
+                raise MalformedResponseError('No %s elements in ResponseMessage (%s)' % (
+                    self.element_container_name, xml_to_str(rootfolder)))
+            elems = list(self._get_elements_in_container(container=container))
+            if next_offset is not None and next_offset != offset + len(elems):
+                # Check paging offsets, like _paged_call() does
+                raise MalformedResponseError('Unexpected next offset: %s -> %s' % (offset + len(elems), next_offset))
+            return elems, next_offset, int(rootfolder.get('TotalItemsInView'))
+
+        elems, next_offset, total_item_count = get_page(0)
+        item_count = len(elems)
+        for elem in elems:
+            yield elem
+        if next_offset is None or (max_items and item_count >= max_items):
+            return
+        end = min(total_item_count, max_items) if max_items else total_item_count
+        max_in_flight = self.protocol.max_in_flight
+        in_flight = deque()  # (offset, AsyncResult) tuples, oldest first
+        # The first page tells us how many items the server returns per page
+        page_size = next_offset
+        offsets = iter(range(next_offset, end, page_size))
+        while True:
+            for offset in offsets:
+                in_flight.append((offset, self.protocol.paging_thread_pool.apply_async(get_page, (offset,))))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            offset, r = in_flight.popleft()
+            elems, next_offset, _ = r.get()
+            item_count += len(elems)
+            for elem in elems:
+                yield elem
+            if max_items and item_count >= max_items:
+                log.debug("'max_items' count reached")
+                return
+            if next_offset != offset + page_size:
+                # The pages we requested after this one don't start where this one ends. Ignore them.
+                log.debug('%s: Next offset %s does not match the requested pages. Continuing with ordinary paging',
+                          self.SERVICE_NAME, next_offset)
+                break
+        while next_offset is not None and not (max_items and item_count >= max_items):
+            elems, next_offset, _ = get_page(next_offset)
+            item_count += len(elems)
+            for elem in elems:
+                yield elem
+
+    def _get_total_count(self, payload_func, **kwargs):
+        # Requests the first page and returns the sum of the TotalItemsInView values of all folders. Callers should
+        # request a page size of 1 because we don't need the elements.
+        kwargs['offset'] = 0
+        payload = payload_func(**kwargs)
+        while True:
+            try:
+                response = self._get_response_xml(payload=payload)
+                break
+            except ErrorServerBusy as e:
+                self._handle_back_off(e)
+        total_item_count = 0
+        for message in response:
+            rootfolder = self._get_element_container(message=message, name='{%s}RootFolder' % MNS)
+            if isinstance(rootfolder, Exception):
+                raise rootfolder
+            total_item_count += int(rootfolder.get('TotalItemsInView'))
+        return total_item_count
+
     def _get_page(self, message):
         rootfolder = self._get_element_container(message=message, name='{%s}RootFolder' % MNS)
         is_last_page = rootfolder.get('IncludesLastItemInRange').lower() in ('true', '0')
@@ -826,42 +1110,110 @@ class GetRooms(EWSService):
 
 
 class EWSPooledMixIn(EWSService):
+    supports_unordered = True
+
     def _pool_requests(self, payload_func, items, **kwargs):
         log.debug('Processing items in chunks of %s', self.chunk_size)
+        if self.streaming:
+            # A streamed response holds on to its session until it has been consumed. Worker threads could grab all
+            # sessions for results that the caller isn't ready to consume yet, so process the chunks one at a time.
+            start = 0
+            for chunk in chunkify(items, self.chunk_size):
+                for i, elem in self._get_elements(payload=payload_func(chunk, **kwargs), indexed=True):
+                    yield elem if self.ordered else (start + i, elem)
+                start += len(chunk)
+            return
+        if not self.ordered:
+            for res in self._pool_requests_unordered(payload_func=payload_func, items=items, **kwargs):
+                yield res
+            return
         # Chop items list into suitable pieces and let worker threads chew on the work. The order of the output result
         # list must be the same as the input id list, so the caller knows which status message belongs to which ID.
         # Yield results as they become available.
-        results = []
-        n = 1
-        for chunk in chunkify(items, self.chunk_size):
+        #
+        # At most 'max_in_flight' chunks are sent or waiting to be consumed at any time. When the window is full, we
+        # wait for the oldest result and yield it before sending the next chunk. Since this is a generator, we don't
+        # send more chunks while the caller is busy with the elements we already yielded, so memory usage is bounded
+        # by the window size, not the size of 'items'.
+        max_in_flight = self.protocol.max_in_flight
+        in_flight = deque()  # (chunk number, AsyncResult) tuples, oldest first
+        for n, chunk in enumerate(chunkify(items, self.chunk_size), 1):
             log.debug('Starting %s._get_elements worker %s for %s items', self.__class__.__name__, n, len(chunk))
-            n += 1
-            results.append(self.protocol.thread_pool.apply_async(
+            in_flight.append((n, self.protocol.thread_pool.apply_async(
                 lambda c: self._get_elements(payload=payload_func(c, **kwargs)),
                 (chunk,)
-            ))
-            # Results will be available before iteration has finished if 'items' is a slow generator. Return early
-            for i, r in enumerate(results, 1):
-                if r is None:
-                    continue
-                if not r.ready():
-                    # First non-yielded result isn't ready yet. Yielding other ready results would mess up ordering
-                    break
+            )))
+            # Results will be available before iteration has finished if 'items' is a slow generator. Return early.
+            # Stop at the first result that isn't ready yet. Yielding later results would mess up ordering.
+            while in_flight and in_flight[0][1].ready():
+                i, r = in_flight.popleft()
                 log.debug('%s._get_elements result %s is ready early', self.__class__.__name__, i)
                 for elem in r.get():
                     yield elem
-                results[i-1] = None
+            while len(in_flight) >= max_in_flight:
+                i, r = in_flight.popleft()
+                log.debug('In-flight window is full. Waiting for %s._get_elements result %s',
+                          self.__class__.__name__, i)
+                for elem in r.get():
+                    yield elem
         # Yield remaining results in order, as they become available
-        for i, r in enumerate(results, 1):
-            if r is None:
-                log.debug('%s._get_elements result %s of %s already sent', self.__class__.__name__, i, len(results))
-                continue
-            log.debug('Waiting for %s._get_elements result %s of %s', self.__class__.__name__, i, len(results))
+        while in_flight:
+            i, r = in_flight.popleft()
+            log.debug('Waiting for %s._get_elements result %s', self.__class__.__name__, i)
             elems = r.get()
-            log.debug('%s._get_elements result %s of %s is ready', self.__class__.__name__, i, len(results))
+            log.debug('%s._get_elements result %s is ready', self.__class__.__name__, i)
             for elem in elems:
                 yield elem
 
+    def _pool_requests_unordered(self, payload_func, items, **kwargs):
+        # Like _pool_requests(), but yields (input index, element) tuples for each chunk as soon as it is done, so a
+        # slow request doesn't hold back results of requests that were sent later. Each input item has exactly one
+        # ResponseMessage, so the index of a result is the index of the first item in the chunk plus the index of the
+        # ResponseMessage it came from. The same in-flight window applies.
+        max_in_flight = self.protocol.max_in_flight
+        results = Queue()
+
+        def run(chunk, start):
+            try:
+                results.put((start, self._get_elements(payload=payload_func(chunk, **kwargs), indexed=True), None))
+            except Exception as e:
+                results.put((start, None, e))
+
+        def get_result(block):
+            start, elems, e = results.get(block=block)
+            if e is not None:
+                raise e
+            log.debug('%s._get_elements result for items %s+ is ready', self.__class__.__name__, start)
+            return ((start + i, elem) for i, elem in elems)
+
+        in_flight = 0
+        start = 0
+        for chunk in chunkify(items, self.chunk_size):
+            log.debug('Starting %s._get_elements worker for items %s+', self.__class__.__name__, start)
+            self.protocol.thread_pool.apply_async(run, (chunk, start))
+            start += len(chunk)
+            in_flight += 1
+            # Yield all results that are ready, without waiting for the rest
+            while in_flight:
+                try:
+                    elems = get_result(block=False)
+                except Empty:
+                    break
+                in_flight -= 1
+                for res in elems:
+                    yield res
+            while in_flight >= max_in_flight:
+                elems = get_result(block=True)
+                in_flight -= 1
+                for res in elems:
+                    yield res
+        # Yield remaining results as they become available
+        while in_flight:
+            elems = get_result(block=True)
+            in_flight -= 1
+            for res in elems:
+                yield res
+
 
 class GetItem(EWSAccountService, EWSPooledMixIn):
     """
@@ -869,6 +1221,7 @@ class GetItem(EWSAccountService, EWSPooledMixIn):
     """
     SERVICE_NAME = 'GetItem'
     element_container_name = '{%s}Items' % MNS
+    supports_streaming = True
 
     def call(self, items, additional_fields, shape):
         """
@@ -1168,6 +1521,27 @@ class FindItem(EWSFolderService, PagingEWSMixIn):
             page_size=self.chunk_size,
         ))
 
+    def count(self, restriction, query_string, depth):
+        """
+        Count the items matching a restriction, with a single request. Calendar views are not supported.
+
+        :param restriction: a Restriction object
+        :param query_string: a QueryString object
+        :param depth: How deep in the folder structure to search for items
+        :return: the total number of matching items, as reported by the server
+        """
+        from .items import ID_ONLY
+        return self._get_total_count(payload_func=self.get_payload, **dict(
+            additional_fields=None,
+            restriction=restriction,
+            order_fields=None,
+            query_string=query_string,
+            shape=ID_ONLY,
+            depth=depth,
+            calendar_view=None,
+            page_size=1,
+        ))
+
     def get_payload(self, additional_fields, restriction, order_fields, query_string, shape, depth, calendar_view,
                     page_size, offset=0):
         finditem = create_element('m:%s' % self.SERVICE_NAME, Traversal=depth)
@@ -1774,7 +2148,7 @@ class SendItem(EWSAccountService):
         return senditem
 
 
-class MoveItem(EWSAccountService):
+class MoveItem(EWSAccountService, EWSPooledMixIn):
     """
     MSDN: https://msdn.microsoft.com/en-us/library/office/aa565781(v=exchg.150).aspx
     """
@@ -1782,7 +2156,7 @@ class MoveItem(EWSAccountService):
     element_container_name = '{%s}Items' % MNS
 
     def call(self, items, to_folder):
-        return self._get_elements(payload=self.get_payload(
+        return self._pool_requests(payload_func=self.get_payload, **dict(
             items=items,
             to_folder=to_folder,
         ))
@@ -1805,7 +2179,7 @@ class MoveItem(EWSAccountService):
         return moveitem
 
 
-class CopyItem(EWSAccountService):
+class CopyItem(EWSAccountService, EWSPooledMixIn):
     """
     MSDN: https://msdn.microsoft.com/en-us/library/office/aa565012(v=exchg.150).aspx
     """
@@ -1813,7 +2187,7 @@ class CopyItem(EWSAccountService):
     element_container_name = '{%s}Items' % MNS
 
     def call(self, items, to_folder):
-        return self._get_elements(payload=self.get_payload(
+        return self._pool_requests(payload_func=self.get_payload, **dict(
             items=items,
             to_folder=to_folder,
         ))
@@ -1841,6 +2215,7 @@ class FindPeople(EWSAccountService, PagingEWSMixIn):
     """
     SERVICE_NAME = 'FindPeople'
     element_container_name = '{%s}People' % MNS
+    supports_concurrent_paging = False  # See _paged_call()
 
     def call(self, folder, additional_fields, restriction, order_fields, shape, query_string, depth, max_items):
         """
@@ -1920,10 +2295,7 @@ class FindPeople(EWSAccountService, PagingEWSMixIn):
             try:
                 response = self._get_response_xml(payload=payload)
             except ErrorServerBusy as e:
-                log.debug('Got ErrorServerBusy (back off %s seconds)', e.back_off)
-                if self.protocol.credentials.fail_fast:
-                    raise
-                self.protocol.credentials.back_off(e.back_off)
+                self._handle_back_off(e)
                 # We'll warn about this if we actually need to sleep
                 continue
             if len(response) != 1:
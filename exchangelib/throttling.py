@@ -0,0 +1,264 @@
+# coding=utf-8
+"""
+A client-side model of Exchange throttling policies. Exchange assigns each user a budget for the number of concurrent
+connections, the number of requests and the amount of time the Client Access Server (CAS) spends on requests. When a
+budget is exceeded, the server answers with ErrorServerBusy and a BackOffMilliseconds value, and the user is penalized
+for a while. Instead of reacting to this, a ThrottlingGovernor paces outgoing requests so we stay within the budget.
+
+Limits can be set explicitly if the throttling policy of the server is known. Limits that are not set are learned from
+ErrorServerBusy responses: when the server throttles us, we assume that the limit is a bit lower than what we used in
+the last window, and we slowly probe for a higher limit as long as the server doesn't complain.
+
+Budgets belong to a user, so the governor is attached to the credentials:
+
+    credentials = ServiceAccount(username='...', password='...', governor=ThrottlingGovernor(max_concurrency=10))
+
+When the server asks us to back off, ServiceAccount pauses all requests until the back off period has passed. The
+deadline is kept in a BackOffStore. The default store only pauses the current process. To pause all worker processes on
+a host that use the same service account, give them a FileBackOffStore pointing to the same file:
+
+    credentials = ServiceAccount(username='...', password='...', back_off_store=FileBackOffStore('/tmp/ews.backoff'))
+
+See also https://docs.microsoft.com/en-us/exchange/client-developer/exchange-web-services/ews-throttling-in-exchange
+"""
+from __future__ import unicode_literals
+
+from collections import deque
+from contextlib import contextmanager
+import logging
+import mmap
+import os
+import struct
+from threading import Condition, RLock
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+from .util import time_func
+
+log = logging.getLogger(__name__)
+
+
+class ThrottlingGovernor(object):
+    # The length of the sliding window, in seconds, that request and CAS time budgets are evaluated over
+    WINDOW = 60
+    # When throttled, assume the limit is this fraction of what we used in the last window
+    LEARN_FACTOR = 0.8
+    # For every window without throttling where we used most of a learned limit, raise the limit by this factor
+    PROBE_FACTOR = 1.1
+    # The number of seconds to pause if the server didn't tell us how long to back off
+    DEFAULT_BACK_OFF = 60
+
+    def __init__(self, max_concurrency=None, max_requests=None, max_cas_time=None):
+        """
+        :param max_concurrency: The max number of requests in flight at any time. Corresponds to EWSMaxConcurrency.
+        :param max_requests: The max number of requests to send per WINDOW seconds.
+        :param max_cas_time: The max number of seconds the server may spend on our requests per WINDOW seconds. We
+          estimate the time spent by the server from response times. Corresponds to EWSPercentTimeInCAS.
+
+        Request and CAS time limits that are None are learned from ErrorServerBusy responses. Explicit limits are upper
+        bounds for learned limits.
+        """
+        for name, value in (('max_concurrency', max_concurrency), ('max_requests', max_requests),
+                            ('max_cas_time', max_cas_time)):
+            if value is not None and value <= 0:
+                raise ValueError("'%s' %r must be a positive number" % (name, value))
+        self.max_concurrency = max_concurrency
+        self.max_requests = max_requests
+        self.max_cas_time = max_cas_time
+        self.requests_limit = max_requests  # The current limit for the number of requests per window
+        self.cas_time_limit = max_cas_time  # The current limit for CAS time per window
+        self._cond = Condition()
+        self._in_flight = 0
+        self._history = deque()  # (end time, CAS time) tuples for requests that finished within the last window
+        self._cas_time = 0.0  # Sum of CAS time in self._history
+        self._paused_until = None
+        self._last_adjust = time_func()
+
+    def acquire(self):
+        """Block until we can send a request without exceeding the budget, and register the request as in flight"""
+        with self._cond:
+            while True:
+                now = time_func()
+                self._expire(now)
+                wait = self._get_wait_time(now)
+                if wait == 0:
+                    if self.max_concurrency is None or self._in_flight < self.max_concurrency:
+                        self._in_flight += 1
+                        return
+                    wait = None
+                log.debug('Throttling budget exhausted. Waiting %s seconds', wait)
+                # A wait time of None means we need to wait for a request in flight to finish
+                self._cond.wait(timeout=wait)
+
+    def release(self, response_time):
+        """Register that a request finished, and charge its response time to the CAS time budget. If 'response_time' is
+        None, the request was never sent, and nothing is charged.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            if response_time is not None:
+                self._charge(time_func(), response_time)
+            self._cond.notify_all()
+
+    def charge(self, response_time):
+        """Charge a request that was sent without calling acquire() first, e.g. when following a redirect"""
+        with self._cond:
+            self._charge(time_func(), response_time)
+
+    def _charge(self, now, response_time):
+        self._history.append((now, response_time))
+        self._cas_time += response_time
+        self._expire(now)
+        self._probe(now)
+
+    def register_back_off(self, seconds):
+        """Learn from an ErrorServerBusy response. 'seconds' is the BackOffMilliseconds value, converted to seconds"""
+        with self._cond:
+            now = time_func()
+            self._expire(now)
+            used_requests = len(self._history) + self._in_flight
+            self.requests_limit = self._learn(self.requests_limit, max(1, int(used_requests * self.LEARN_FACTOR)))
+            if self._cas_time:
+                self.cas_time_limit = self._learn(self.cas_time_limit, self._cas_time * self.LEARN_FACTOR)
+            self._paused_until = max(self._paused_until or now, now + (seconds or self.DEFAULT_BACK_OFF))
+            self._last_adjust = now
+            log.warning('Server throttled us. New limits per %s seconds: %s requests, %s seconds CAS time. Pausing %s '
+                        'seconds', self.WINDOW, self.requests_limit, self.cas_time_limit, self._paused_until - now)
+
+    @staticmethod
+    def _learn(current_limit, observed_limit):
+        if current_limit is None:
+            return observed_limit
+        return min(current_limit, observed_limit)
+
+    def _expire(self, now):
+        while self._history and self._history[0][0] <= now - self.WINDOW:
+            _, cas_time = self._history.popleft()
+            self._cas_time -= cas_time
+        if not self._history:
+            self._cas_time = 0.0  # Avoid accumulating floating point errors
+
+    def _get_wait_time(self, now):
+        # Returns the number of seconds until the budget allows another request, or None if we need to wait for a
+        # request in flight to finish.
+        waits = [0]
+        if self._paused_until is not None:
+            if self._paused_until > now:
+                waits.append(self._paused_until - now)
+            else:
+                self._paused_until = None
+        if self.requests_limit is not None and len(self._history) + self._in_flight >= self.requests_limit:
+            if not self._history:
+                return None
+            # Wait until enough requests have left the window
+            n = min(len(self._history), len(self._history) + self._in_flight - self.requests_limit + 1)
+            waits.append(self._history[n - 1][0] + self.WINDOW - now)
+        if self.cas_time_limit is not None and self._cas_time >= self.cas_time_limit:
+            # Wait until enough CAS time has left the window
+            cas_time = self._cas_time
+            for end_time, t in self._history:
+                cas_time -= t
+                if cas_time < self.cas_time_limit:
+                    waits.append(end_time + self.WINDOW - now)
+                    break
+        return max(waits)
+
+    def _probe(self, now):
+        # Raise learned limits that we are close to, if we haven't been throttled or raised limits for a full window.
+        # Don't raise limits that we are far from, or they would grow without bounds while we are idle.
+        if now - self._last_adjust < self.WINDOW:
+            return
+        if self.requests_limit is not None and self.requests_limit != self.max_requests \
+                and len(self._history) >= self.requests_limit * self.LEARN_FACTOR:
+            self.requests_limit = int(self.requests_limit * self.PROBE_FACTOR) + 1
+            if self.max_requests is not None:
+                self.requests_limit = min(self.requests_limit, self.max_requests)
+            self._last_adjust = now
+        if self.cas_time_limit is not None and self.cas_time_limit != self.max_cas_time \
+                and self._cas_time >= self.cas_time_limit * self.LEARN_FACTOR:
+            self.cas_time_limit *= self.PROBE_FACTOR
+            if self.max_cas_time is not None:
+                self.cas_time_limit = min(self.cas_time_limit, self.max_cas_time)
+            self._last_adjust = now
+
+    def __repr__(self):
+        return self.__class__.__name__ + repr((self.max_concurrency, self.max_requests, self.max_cas_time))
+
+
+class BackOffStore(object):
+    """Keeps the time, in seconds since the epoch, until which requests must be paused. Shared by threads in this
+    process. Subclass this to share the back off value in other ways, e.g. via a network service. Subclasses shared
+    between processes must make extend() atomic across processes.
+    """
+    def __init__(self):
+        self._value = None
+        self._lock = RLock()
+
+    def get(self):
+        return self._value
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def extend(self, value):
+        """Sets the back off value to 'value', unless the stored value is later. A short back off reported by one
+        client must not shorten a longer back off reported by another client.
+        """
+        with self._lock:
+            current = self.get()
+            if current is None or value > current:
+                self.set(value)
+
+    def __repr__(self):
+        return self.__class__.__name__ + '()'
+
+
+class FileBackOffStore(BackOffStore):
+    """Keeps the back off value in a memory-mapped file, so it is shared by all processes using the same file. Updates
+    are serialized between processes with an exclusive lock on the file. File locks are not available on Windows, where
+    updates are only serialized between threads in this process.
+    """
+    FORMAT = str('<d')  # A timestamp as a little-endian double. 0.0 means 'no back off'
+    SIZE = struct.calcsize(FORMAT)
+
+    def __init__(self, path):
+        super(FileBackOffStore, self).__init__()
+        self.path = path
+        # Keep the file open. We need the file descriptor to lock the file.
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self.SIZE:
+            os.ftruncate(self._fd, self.SIZE)
+        self._mmap = mmap.mmap(self._fd, self.SIZE)
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def get(self):
+        return struct.unpack_from(self.FORMAT, self._mmap, 0)[0] or None
+
+    def set(self, value):
+        with self._file_lock():
+            struct.pack_into(self.FORMAT, self._mmap, 0, value or 0.0)
+
+    def extend(self, value):
+        with self._file_lock():
+            current = self.get()
+            if current is None or value > current:
+                struct.pack_into(self.FORMAT, self._mmap, 0, value)
+
+    def __repr__(self):
+        return self.__class__.__name__ + repr((self.path,))
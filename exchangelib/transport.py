@@ -1,7 +1,9 @@
 # coding=utf-8
 from __future__ import unicode_literals
 
+from collections import OrderedDict
 import logging
+from threading import Lock
 
 import requests.auth
 import requests_ntlm
@@ -9,7 +11,8 @@ import requests_kerberos
 
 from .credentials import IMPERSONATION
 from .errors import UnauthorizedError, TransportError, RedirectError, RelativeRedirect
-from .util import create_element, add_xml_child, get_redirect_url, xml_to_str, ns_translation, HTTPOAuthAuth
+from .util import create_element, add_xml_child, get_redirect_url, xml_to_str, ns_translation, HTTPOAuthAuth, \
+    tostring, SOAPNS
 
 log = logging.getLogger(__name__)
 
@@ -49,7 +52,63 @@ def wrap(content, version, account=None):
     """
     Generate the necessary boilerplate XML for a raw SOAP request. The XML is specific to the server version.
     ExchangeImpersonation allows to act as the user we want to impersonate.
+
+    The envelope is the same for all requests with the same version and account settings, so we cache the serialized
+    envelope and only serialize 'content' on each call.
     """
+    if account:
+        key = (version, account.primary_smtp_address, account.access_type, account.default_timezone.ms_id)
+    else:
+        key = (version, None, None, None)
+    envelope_start, envelope_end = _get_envelope_template(key, version, account)
+    body_content = _serialize_body_content(content)
+    if body_content is None:
+        # The Body was serialized in an unexpected way. Serialize the whole envelope without the template.
+        envelope = _create_envelope(version, account)
+        envelope.find('{%s}Body' % SOAPNS).append(content)
+        return xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True)
+    return envelope_start + body_content + envelope_end
+
+
+_BODY_START = tostring(create_element('s:Body', nsmap=ns_translation), encoding=DEFAULT_ENCODING)[:-2] + b'>'
+_BODY_END = b'</s:Body>'
+MAX_ENVELOPE_TEMPLATES = 10000  # The max number of cached envelope templates. Each entry is less than 1KB.
+_envelope_templates = OrderedDict()
+_envelope_templates_lock = Lock()
+
+
+def _serialize_body_content(content):
+    # Serialize the content inside a Body element that declares our namespaces, so the serialized content doesn't
+    # repeat the namespace declarations on every element. Then strip the Body tags. Returns None if the Body tags
+    # could not be stripped.
+    body = create_element('s:Body', nsmap=ns_translation)
+    body.append(content)
+    body_bytes = tostring(body, encoding=DEFAULT_ENCODING)
+    if body_bytes.startswith(_BODY_START) and body_bytes.endswith(_BODY_END):
+        return body_bytes[len(_BODY_START):-len(_BODY_END)]
+    return None
+
+
+def _get_envelope_template(key, version, account):
+    """Return the serialized envelope for 'key' as a (bytes before body content, bytes after body content) tuple"""
+    try:
+        return _envelope_templates[key]
+    except KeyError:
+        pass
+    envelope = _create_envelope(version, account)
+    envelope_start, envelope_end = xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True).split(
+        b'<s:Body/>'
+    )
+    template = envelope_start + b'<s:Body>', b'</s:Body>' + envelope_end
+    with _envelope_templates_lock:
+        _envelope_templates[key] = template
+        while len(_envelope_templates) > MAX_ENVELOPE_TEMPLATES:
+            _envelope_templates.popitem(last=False)
+    return template
+
+
+def _create_envelope(version, account):
+    """Return an envelope element with an empty Body element"""
     envelope = create_element('s:Envelope', nsmap=ns_translation)
     header = create_element('s:Header')
     requestserverversion = create_element('t:RequestServerVersion', Version=version)
@@ -66,22 +125,23 @@ def wrap(content, version, account=None):
         timezonecontext.append(timezonedefinition)
         header.append(timezonecontext)
     envelope.append(header)
-    body = create_element('s:Body')
-    body.append(content)
-    envelope.append(body)
-    return xml_to_str(envelope, encoding=DEFAULT_ENCODING, xml_declaration=True)
+    envelope.append(create_element('s:Body'))
+    return envelope
 
 
-def get_auth_instance(credentials, auth_type):
+def get_auth_instance(credentials, auth_type, protocol=None):
     """
-    Returns an *Auth instance suitable for the requests package
+    Returns an *Auth instance suitable for the requests package. If 'protocol' is set, OAuth tokens are read from the
+    current credentials of the protocol on every request.
     """
     model = AUTH_TYPE_MAP[auth_type]
     if model is None:
         return None
 
     if auth_type == OAUTH:
-        return model(token=credentials.token)
+        if protocol is not None:
+            return model(protocol=protocol)
+        return model(credentials=credentials)
 
     username = credentials.username
     if auth_type == NTLM and credentials.type == credentials.EMAIL:
@@ -278,6 +278,51 @@ def to_xml(text):
             raise ParseError('This is not XML: %s' % text, '<not from file>', -1, 0)
 
 
+class PullParser(_etree.XMLPullParser):
+    """
+    An lxml XMLPullParser with the same restrictions as the parser used by to_xml(). Data is pushed to the parser with
+    feed() and events are collected with read_events(). Raises our own ParseError on bad XML.
+    """
+    def __init__(self, events=('start', 'end'), tag=None):
+        super(PullParser, self).__init__(events=events, tag=tag, **GlobalParserTLS.parser_config)
+        self.set_element_class_lookup(_etree.ElementDefaultClassLookup(element=RestrictedElement))
+
+    def feed(self, data):
+        try:
+            return super(PullParser, self).feed(data)
+        except _etree.ParseError as e:
+            raise ParseError(text_type(e), '<not from file>', -1, 0)
+
+    def close(self):
+        try:
+            return super(PullParser, self).close()
+        except _etree.ParseError as e:
+            raise ParseError(text_type(e), '<not from file>', -1, 0)
+
+
+def iterparse_chunks(chunks, events=('start', 'end')):
+    """
+    Incrementally parse an XML document delivered as an iterable of byte strings, e.g. Response.iter_content(). Yields
+    (event, element) tuples as soon as they are available, like lxml.etree.iterparse(). Consumers are responsible for
+    removing elements they are done with from the tree, to keep memory usage down.
+    """
+    parser = PullParser(events=events)
+    is_first_chunk = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if is_first_chunk:
+            if chunk[:BOM_LEN] == BOM:
+                chunk = chunk[BOM_LEN:]
+            is_first_chunk = False
+        parser.feed(chunk)
+        for event_and_elem in parser.read_events():
+            yield event_and_elem
+    parser.close()
+    for event_and_elem in parser.read_events():
+        yield event_and_elem
+
+
 def is_xml(text):
     """
     Helper function. Lightweight test if response is an XML doc
@@ -502,23 +547,30 @@ Response data: %(xml_response)s
         xml_request=data,
         xml_response=None,
     )
+    if not isinstance(data, bytes):
+        # Payloads from wrap() are already bytes. Only convert other payloads, and only once for all retries.
+        try:
+            data = ensure_binary(data)
+        except UnicodeDecodeError:
+            try:
+                data = data.decode('utf-8').encode('utf-8')
+            except UnicodeDecodeError:
+                import chardet
+                encoding_info = chardet.detect(data)
+                data = data.decode('utf-8').encode(encoding_info['encoding'])
     try:
         while True:
             _back_off_if_needed(protocol.credentials.back_off_until)
             log.debug('Session %s thread %s: retry %s timeout %s POST\'ing to %s after %ss wait', session.session_id,
                       thread_id, retry, protocol.TIMEOUT, url, wait)
+            # The throttling budget slot for this request was acquired in Protocol.get_session(), before we got the
+            # session. Requests after a redirect reuse the session without a slot, and are only charged afterwards.
+            governor = protocol.governor
+            governor_slot = getattr(session, 'governor_slot', False)
+            session.governor_slot = False
             d_start = time_func()
             # Always create a dummy response for logging purposes, in case we fail in the following
             r = DummyResponse(url=url, headers={}, request_headers=headers)
-            try:
-                data = ensure_binary(data)
-            except UnicodeDecodeError:
-                try:
-                    data = data.decode('utf-8').encode('utf-8')
-                except UnicodeDecodeError:
-                    import chardet
-                    encoding_info = chardet.detect(data)
-                    data = data.decode('utf-8').encode(encoding_info['encoding'])
             try:
                 r = session.post(url=url,
                                  headers=headers,
@@ -530,6 +582,10 @@ Response data: %(xml_response)s
                 log.debug('Session %s thread %s: connection error POST\'ing to %s', session.session_id, thread_id, url)
                 r = DummyResponse(url=url, headers={'TimeoutException': e}, request_headers=headers)
             finally:
+                if governor_slot:
+                    governor.release(time_func() - d_start)
+                elif governor is not None:
+                    governor.charge(time_func() - d_start)
                 log_vals.update(
                     retry=retry,
                     wait=wait,
@@ -547,10 +603,13 @@ Response data: %(xml_response)s
             if _may_retry_on_error(r, protocol, wait):
                 log.info("Session %s thread %s: Connection error on URL %s (code %s). Cool down %s secs",
                          session.session_id, thread_id, r.url, r.status_code, wait)
-                time.sleep(wait)  # Increase delay for every retry
+                if r.status_code == 503:
+                    # The server is unavailable or the request timed out. Use fewer concurrent sessions from now on
+                    protocol.decrease_poolsize()
+                # Don't hold on to a session while we wait. Increase delay for every retry
+                session = protocol.cool_down(session, wait)
                 retry += 1
                 wait *= 2
-                session = protocol.renew_session(session)
                 continue
             if r.status_code in (301, 302):
                 url, redirects = _redirect_or_fail(r, redirects, allow_redirects)
@@ -572,6 +631,8 @@ Response data: %(xml_response)s
         protocol.retire_session(session)
         _raise_response_errors(r, protocol, log_msg, log_vals)  # Always raises an exception
     log.debug('Session %s thread %s: Useful response from %s', session.session_id, thread_id, url)
+    protocol.register_response_time(log_vals['response_time'])
+    protocol.retry_budget.deposit()
     return r, session
 
 
@@ -602,6 +663,10 @@ def _may_retry_on_error(response, protocol, wait):
             # We lost patience. Session is cleaned up in outer loop
             raise RateLimitError(
                 'Max timeout reached', url=response.url, status_code=response.status_code, total_wait=wait)
+        if not protocol.retry_budget.withdraw():
+            # Too many requests are failing. Don't add to the load on the server by retrying all of them
+            raise RateLimitError(
+                'Retry budget exhausted', url=response.url, status_code=response.status_code, total_wait=wait)
         return True
     return False
 
@@ -665,6 +730,8 @@ def _raise_response_errors(response, protocol, log_msg, log_vals):
         raise TransportError('The service account is currently locked out')
 
     if response.status_code == 401:
+        # The cached auth type may no longer be valid
+        protocol.invalidate_endpoint_cache()
         if www_authenticate is not None:
             error = extract_oauth_error(www_authenticate)
             if error == 'invalid_token':
@@ -682,10 +749,23 @@ def _raise_response_errors(response, protocol, log_msg, log_vals):
 
 
 class HTTPOAuthAuth(requests.auth.AuthBase):  # type: ignore
-    """Helper class for setting the Authorization header on HTTP requests."""
+    """Helper class for setting the Authorization header on HTTP requests. If 'credentials' is set, the current token
+    is read from the credentials on every request, so a refreshed token is used by existing sessions. If 'protocol' is
+    set, the token is read from the current credentials of the protocol, which may be replaced by newer credentials.
+    """
 
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, token=None, credentials=None, protocol=None):
+        self._token = token
+        self.credentials = credentials
+        self.protocol = protocol
+
+    @property
+    def token(self):
+        if self.protocol is not None:
+            return self.protocol.credentials.token
+        if self.credentials is not None:
+            return self.credentials.token
+        return self._token
 
     def __call__(self, r):
         r.headers[b'Authorization'] = ensure_binary('Bearer {}'.format(self.token))
@@ -10,7 +10,7 @@ from six import text_type
 from .errors import TransportError, ErrorInvalidSchemaVersionForMailboxVersion, ErrorInvalidServerVersion, \
     ResponseMessageError
 from .transport import get_auth_instance
-from .util import is_xml, to_xml, TNS, SOAPNS, ParseError
+from .util import is_xml, to_xml, xml_to_str, TNS, SOAPNS, ParseError
 
 log = logging.getLogger(__name__)
 
@@ -227,14 +227,19 @@ class Version(object):
                 raise TransportError('No header in XML response (%s)' % response)
         except ParseError:
             raise TransportError('Unknown XML response (%s)' % response)
+        return cls.from_soap_header(requested_api_version=requested_api_version, header=header)
 
+    @classmethod
+    def from_soap_header(cls, requested_api_version, header):
+        if header is None:
+            raise TransportError('No header in XML response')
         info = header.find('{%s}ServerVersionInfo' % TNS)
         if info is None:
-            raise TransportError('No ServerVersionInfo in response: %s' % response)
+            raise TransportError('No ServerVersionInfo in header: %s' % xml_to_str(header))
         try:
             build = Build.from_xml(elem=info)
         except ValueError:
-            raise TransportError('Bad ServerVersionInfo in response: %s' % response)
+            raise TransportError('Bad ServerVersionInfo in header: %s' % xml_to_str(header))
         # Not all Exchange servers send the Version element
         api_version_from_server = info.get('Version') or build.api_version()
         if api_version_from_server != requested_api_version:
@@ -1,5 +1,5 @@
 # coding=utf-8
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import datetime
 from decimal import Decimal
 from email.mime.multipart import MIMEMultipart
@@ -11,9 +11,12 @@ from keyword import kwlist
 import logging
 import os
 import random
+import re
 import socket
 import string
+import sys
 import tempfile
+import threading
 import time
 import unittest
 import unittest.util
@@ -21,6 +24,7 @@ import warnings
 
 from dateutil.relativedelta import relativedelta
 import dns.resolver
+from future.moves.queue import Empty, Full
 import psutil
 import pytz
 import requests
@@ -29,12 +33,13 @@ from six import PY2
 from yaml import safe_load
 
 from exchangelib import close_connections
-from exchangelib.account import Account, SAVE_ONLY, SEND_ONLY, SEND_AND_SAVE_COPY
+from exchangelib.account import Account, SAVE_ONLY, SEND_ONLY, SEND_AND_SAVE_COPY, warm_up
 from exchangelib.attachments import FileAttachment, ItemAttachment
 from exchangelib.autodiscover import AutodiscoverProtocol, discover
-from exchangelib.changes import Change, ItemChange, FolderChange
+from exchangelib.changes import Change, ItemChange, FolderChange, CreateFolderChange, UpdateFolderChange, \
+    DeleteFolderChange
 from exchangelib.configuration import Configuration
-from exchangelib.credentials import DELEGATE, IMPERSONATION, Credentials, ServiceAccount
+from exchangelib.credentials import DELEGATE, IMPERSONATION, Credentials, OAuthCredentials, ServiceAccount
 from exchangelib.errors import RelativeRedirect, ErrorItemNotFound, ErrorInvalidOperation, AutoDiscoverRedirect, \
     AutoDiscoverCircularRedirect, AutoDiscoverFailed, ErrorNonExistentMailbox, UnknownTimeZone, \
     ErrorNameResolutionNoResults, TransportError, RedirectError, CASError, RateLimitError, UnauthorizedError, \
@@ -42,7 +47,8 @@ from exchangelib.errors import RelativeRedirect, ErrorItemNotFound, ErrorInvalid
     ErrorFolderNotFound, ErrorInvalidRequest, SOAPError, ErrorInvalidServerVersion, NaiveDateTimeNotAllowed, \
     AmbiguousTimeError, NonExistentTimeError, ErrorUnsupportedPathForQuery, ErrorInvalidPropertyForOperation, \
     ErrorInvalidValueForProperty, ErrorPropertyUpdate, ErrorDeleteDistinguishedFolder, \
-    ErrorNoPublicFolderReplicaAvailable, ErrorSubscriptionNotFound, ErrorServerBusy, ErrorInvalidPropertySet
+    ErrorNoPublicFolderReplicaAvailable, ErrorSubscriptionNotFound, ErrorServerBusy, ErrorInvalidPropertySet, \
+    MalformedResponseError
 from exchangelib.events import CONCRETE_EVENT_TYPES
 from exchangelib.ewsdatetime import EWSDateTime, EWSDate, EWSTimeZone, UTC, UTC_NOW
 from exchangelib.extended_properties import ExtendedProperty, ExternId
@@ -54,25 +60,30 @@ from exchangelib.fields import BooleanField, IntegerField, DecimalField, TextFie
 from exchangelib.folders import Calendar, DeletedItems, Drafts, Inbox, Outbox, SentItems, JunkEmail, Messages, Tasks, \
     Contacts, Folder, RecipientCache, GALContacts, System, AllContacts, MyContactsExtended, Reminders, Favorites, \
     AllItems, ConversationSettings, Friends, RSSFeeds, Sharing, IMContactList, QuickContacts, Journal, Notes, \
-    SyncIssues, MyContacts, ToDoSearch, FolderCollection, DistinguishedFolderId
+    SyncIssues, MyContacts, ToDoSearch, FolderCollection, DistinguishedFolderId, Root
 from exchangelib.indexed_properties import EmailAddress, PhysicalAddress, PhoneNumber, \
     SingleFieldIndexedElement, MultiFieldIndexedElement
 from exchangelib.items import Item, CalendarItem, Message, Contact, Task, DistributionList, Persona
 from exchangelib.notifications import ConnectionStatus
 from exchangelib.properties import Attendee, Mailbox, RoomList, MessageHeader, Room, ItemId, Member, EWSElement, Body, \
-    HTMLBody, TimeZone, FreeBusyView, PersonaId, UID
-from exchangelib.protocol import BaseProtocol, Protocol, NoVerifyHTTPAdapter
+    HTMLBody, TimeZone, FreeBusyView, PersonaId, UID, ParentFolderId
+from exchangelib.endpoint_cache import EndpointCache
+from exchangelib.folder_cache import FolderHierarchyCache
+from exchangelib.protocol import BaseProtocol, Protocol, CachingProtocol, NoVerifyHTTPAdapter, SessionPool, \
+    RetryBudget, BACKEND_COOKIE
 from exchangelib.queryset import QuerySet, DoesNotExist, MultipleObjectsReturned
 from exchangelib.recurrence import Recurrence, AbsoluteYearlyPattern, RelativeYearlyPattern, AbsoluteMonthlyPattern, \
     RelativeMonthlyPattern, WeeklyPattern, DailyPattern, FirstOccurrence, LastOccurrence, Occurrence, \
     NoEndPattern, EndDatePattern, NumberedPattern, ExtraWeekdaysField
 from exchangelib.restriction import Restriction, Q
 from exchangelib.settings import OofSettings
+from exchangelib.throttling import ThrottlingGovernor, FileBackOffStore
 from exchangelib.services import GetServerTimeZones, GetRoomLists, GetRooms, GetAttachment, ResolveNames, GetPersona, \
-    TNS
-from exchangelib.transport import NOAUTH, BASIC, DIGEST, NTLM, wrap, _get_auth_method_from_response
+    GetItem, TNS, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, EWSPooledMixIn
+from exchangelib.transport import NOAUTH, BASIC, DIGEST, NTLM, OAUTH, wrap, _get_auth_method_from_response
 from exchangelib.util import chunkify, peek, get_redirect_url, to_xml, BOM, get_domain, value_to_xml_text, \
-    post_ratelimited, create_element, CONNECTION_ERRORS, PrettyXmlHandler, xml_to_str, ParseError
+    post_ratelimited, create_element, CONNECTION_ERRORS, PrettyXmlHandler, xml_to_str, ParseError, \
+    SOAPNS, MNS
 from exchangelib.version import Build, Version, EXCHANGE_2007, EXCHANGE_2010, EXCHANGE_2013
 from exchangelib.winzone import generate_map, CLDR_TO_MS_TIMEZONE_MAP
 
@@ -299,6 +310,366 @@ class ProtocolTest(unittest.TestCase):
             self.assertEqual(id(base_p.thread_pool), id(p.thread_pool))
             self.assertEqual(id(base_p._session_pool), id(p._session_pool))
 
+    def test_adaptive_pool_size(self):
+        with self.assertRaises(ValueError):
+            Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('pool', 'B'),
+                     auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=5, max_pool_size=4)
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('pool', 'B'),
+                            auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=2, max_pool_size=4)
+        self.assertEqual((protocol.min_pool_size, protocol.max_pool_size), (1, 4))
+        self.assertEqual(protocol.session_pool_size, 2)
+
+        # Fast responses don't grow the pool unless someone had to wait for a session
+        for _ in range(10):
+            protocol.register_response_time(0.1)
+        self.assertEqual(protocol.session_pool_size, 2)
+        protocol._session_pool_starved = True
+        for _ in range(2):
+            protocol.register_response_time(0.1)
+        self.assertEqual(protocol.session_pool_size, 3)
+        self.assertEqual(protocol._session_pool.qsize(), 3)
+
+        # Shrinking closes idle sessions right away and sessions in use when they are released
+        session = protocol.get_session()
+        protocol.decrease_poolsize()
+        self.assertEqual(protocol.session_pool_size, 1)
+        self.assertEqual(protocol._session_pool.qsize(), 0)
+        protocol.release_session(session)
+        self.assertEqual(protocol._session_pool.qsize(), 1)
+
+        # Growing is bounded by max_pool_size, and only one decrease counts within SESSION_POOL_DECREASE_INTERVAL
+        for _ in range(5):
+            protocol.increase_poolsize()
+        self.assertEqual(protocol.session_pool_size, 4)
+        protocol.register_response_time(protocol.SESSION_POOL_SLOW_RESPONSE + 1)
+        self.assertEqual(protocol.session_pool_size, 4)
+        protocol._session_pool_last_decrease = None
+        protocol.register_response_time(protocol.SESSION_POOL_SLOW_RESPONSE + 1)
+        self.assertEqual(protocol.session_pool_size, 2)
+
+    def test_session_pool_fairness(self):
+        pool = SessionPool(maxsize=2, max_per_mailbox=2)
+        session, other_session = object(), object()
+        pool.put(session)
+        pool.put(other_session)
+        with self.assertRaises(Full):
+            pool.put(object())
+        self.assertEqual(pool.get(mailbox='a@example.com'), other_session)  # LIFO
+        self.assertEqual(pool.get(mailbox='a@example.com'), session)
+        with self.assertRaises(Empty):
+            pool.get(mailbox='b@example.com', block=False)
+        with self.assertRaises(Empty):
+            pool.get(mailbox='b@example.com', timeout=0.01)
+
+        # Queue two requests for 'a' before one request for 'b'. 'b' gets the next session anyway.
+        grants = []
+
+        def wait_for_session(mailbox):
+            grants.append((mailbox, pool.get(mailbox=mailbox, timeout=10)))
+
+        threads = []
+        for mailbox in ('a@example.com', 'a@example.com', 'b@example.com'):
+            t = threading.Thread(target=wait_for_session, args=(mailbox,))
+            t.start()
+            threads.append(t)
+            while sum(len(w) for w in pool._waiters.values()) < len(threads):
+                time.sleep(0.001)
+        pool.put(session)
+        threads[2].join(10)
+        self.assertEqual([m for m, _ in grants], ['b@example.com'])
+        pool.put(other_session)
+        threads[0].join(10)
+        self.assertEqual([m for m, _ in grants], ['b@example.com', 'a@example.com'])
+        pool.put(grants[0][1])
+        for t in threads:
+            t.join(10)
+        self.assertEqual([m for m, _ in grants], ['b@example.com', 'a@example.com', 'a@example.com'])
+
+        # The per-mailbox cap holds even when there are idle sessions
+        for _, s in grants[1:]:
+            pool.put(s)
+        pool.maxsize = 3
+        pool.put(object())
+        pool.get(mailbox='c@example.com')
+        pool.get(mailbox='c@example.com')
+        with self.assertRaises(Empty):
+            pool.get(mailbox='c@example.com', block=False)
+        self.assertEqual(pool.qsize(), 1)
+        pool.get(mailbox='d@example.com', block=False)
+
+    def test_session_pool_priorities(self):
+        pool = SessionPool(maxsize=1)
+        session = object()
+        pool.put(session)
+        self.assertEqual(pool.get(), session)
+        with self.assertRaises(ValueError):
+            pool.get(priority='XXX')
+        grants = []
+
+        def wait_for_session(mailbox, priority):
+            s = pool.get(mailbox=mailbox, priority=priority, timeout=10)
+            grants.append(mailbox)
+            pool.put(s)
+
+        threads = []
+        for mailbox, priority in (('a@example.com', PRIORITY_LOW), ('b@example.com', PRIORITY_NORMAL),
+                                  ('c@example.com', PRIORITY_HIGH), ('d@example.com', PRIORITY_LOW)):
+            t = threading.Thread(target=wait_for_session, args=(mailbox, priority))
+            t.start()
+            threads.append(t)
+            while sum(len(w) for w in pool._waiters.values()) < len(threads):
+                time.sleep(0.001)
+        # 'd' has waited long enough to be promoted to the highest priority class, but 'c' has waited longer
+        pool._waiters['d@example.com'][0]['since'] -= 2 * pool.PRIORITY_AGING
+        pool._waiters['c@example.com'][0]['since'] -= 3 * pool.PRIORITY_AGING
+        pool.put(session)
+        for t in threads:
+            t.join(10)
+        self.assertEqual(grants, ['c@example.com', 'd@example.com', 'b@example.com', 'a@example.com'])
+
+    def test_session_pool_pop_idle(self):
+        # Draining idle sessions doesn't touch the scheduling state, and isn't limited by 'max_per_mailbox'
+        pool = SessionPool(maxsize=3, max_per_mailbox=1)
+        sessions = [object(), object(), object()]
+        for s in sessions:
+            pool.put(s)
+        self.assertEqual([pool.pop_idle() for _ in range(3)], sessions)
+        with self.assertRaises(Empty):
+            pool.pop_idle()
+        self.assertEqual(pool.num_in_use(), 0)
+        self.assertEqual(dict(pool._in_use), {})
+        self.assertEqual(pool._pass, {})
+        self.assertEqual(pool._virtual_time, 0.0)
+
+    def test_session_affinity(self):
+        pool = SessionPool(maxsize=2)
+        session, other_session = object(), object()
+        pool.put(session)
+        pool.put(other_session)
+        self.assertEqual(pool.get(mailbox='a@example.com'), other_session)
+        self.assertEqual(pool.get(mailbox='b@example.com'), session)
+        pool.put(other_session)
+        pool.put(session)
+        # Prefer the session that last served the mailbox, otherwise the most recently used session
+        self.assertEqual(pool.get(mailbox='a@example.com'), other_session)
+        pool.put(other_session)
+        self.assertEqual(pool.get(mailbox='c@example.com'), other_session)
+
+        # The backend cookie of another mailbox is dropped
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('affinity', 'B'),
+                            auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=1)
+        session = protocol.get_session(mailbox='a@example.com')
+        session.cookies.set(BACKEND_COOKIE, 'XXX', domain='example.com')
+        protocol.release_session(session)
+        session = protocol.get_session(mailbox='a@example.com')
+        self.assertEqual(session.cookies.get(BACKEND_COOKIE), 'XXX')
+        protocol.release_session(session)
+        session = protocol.get_session(mailbox='b@example.com')
+        self.assertIsNone(session.cookies.get(BACKEND_COOKIE))
+        protocol.release_session(session)
+
+    def test_cool_down(self):
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('cool', 'B'),
+                            auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=1)
+        session = protocol.get_session(mailbox='a@example.com', priority=PRIORITY_HIGH)
+        new_sessions = []
+        t = threading.Thread(target=lambda: new_sessions.append(protocol.cool_down(session, 0.1)))
+        t.start()
+        # The slot is available to others while we cool down
+        other_session = protocol.get_session()
+        protocol.release_session(other_session)
+        t.join(10)
+        self.assertNotEqual(id(new_sessions[0]), id(session))
+        self.assertEqual(new_sessions[0].pool_args, dict(mailbox='a@example.com', priority=PRIORITY_HIGH))
+        protocol.release_session(new_sessions[0])
+
+    def test_governor_pacing(self):
+        # The throttling budget is acquired before we take a session, so a paced request doesn't hold on to a session
+        governor = ThrottlingGovernor(max_concurrency=1)
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx',
+                            credentials=ServiceAccount('governor', 'B', governor=governor),
+                            auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=2)
+        session = protocol.get_session()
+        self.assertEqual(governor._in_flight, 1)
+        other_sessions = []
+        t = threading.Thread(target=lambda: other_sessions.append(protocol.get_session()))
+        t.start()
+        t.join(0.1)
+        self.assertEqual(other_sessions, [])
+        self.assertEqual(protocol._session_pool.qsize(), 1)  # The waiting thread doesn't hold a session
+        # Sending the request uses up the slot
+        session.post = mock_post('https://example.com', 200, {}, 'foo')
+        r, session = post_ratelimited(protocol=protocol, session=session, url='https://example.com', headers=None,
+                                      data='')
+        self.assertEqual(len(governor._history), 1)
+        protocol.release_session(session)
+        t.join(10)
+        self.assertEqual(len(other_sessions), 1)
+        self.assertEqual(governor._in_flight, 1)
+        # Releasing an unused session gives back the slot without charging the budget
+        protocol.release_session(other_sessions[0])
+        self.assertEqual(governor._in_flight, 0)
+        self.assertEqual(len(governor._history), 1)
+
+    def test_retry_budget(self):
+        budget = RetryBudget(max_tokens=2, ratio=0.5)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 2)
+
+    def test_close_idle_sessions(self):
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('idle', 'B'),
+                            auth_type=NOAUTH, version=Version(Build(15, 1)), pool_size=2)
+        session = protocol.get_session()
+        protocol.close_idle_sessions()
+        self.assertEqual(protocol.session_pool_size, 2)
+        protocol.SESSION_IDLE_TIMEOUT = -1
+        protocol.close_idle_sessions()
+        self.assertEqual(protocol.session_pool_size, 1)
+        self.assertEqual(protocol._session_pool.qsize(), 0)
+        protocol.release_session(session)
+        # Closed sessions are re-created when needed
+        sessions = [protocol.get_session(), protocol.get_session()]
+        self.assertEqual(protocol.session_pool_size, 2)
+        for s in sessions:
+            protocol.release_session(s)
+
+    def test_protocol_cache_eviction(self):
+        orig_size, orig_ttl = CachingProtocol.PROTOCOL_CACHE_SIZE, CachingProtocol.PROTOCOL_CACHE_TTL
+        try:
+            CachingProtocol.clear_cache()
+            CachingProtocol.PROTOCOL_CACHE_SIZE = 2
+            protocols = [
+                Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('evict%s' % i, 'B'),
+                         auth_type=NOAUTH, version=Version(Build(15, 1)))
+                for i in range(2)
+            ]
+            self.assertIsNotNone(protocols[1].thread_pool)
+            # Looking up a protocol makes it the most recently used
+            p = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('evict0', 'B'),
+                         auth_type=NOAUTH, version=Version(Build(15, 1)))
+            self.assertEqual(id(p), id(protocols[0]))
+
+            # Creating a new protocol evicts the least recently used one and closes its sessions and thread pool
+            Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('evict2', 'B'),
+                     auth_type=NOAUTH, version=Version(Build(15, 1)))
+            self.assertEqual(len(CachingProtocol._protocol_cache), 2)
+            self.assertNotIn(('https://example.com/Foo.asmx', Credentials('evict1', 'B')),
+                             CachingProtocol._protocol_cache)
+            self.assertEqual(protocols[1]._session_pool.qsize(), 0)
+            self.assertIsNone(protocols[1]._thread_pool)
+
+            # Evicted protocols are still usable
+            session = protocols[1].get_session()
+            protocols[1].release_session(session)
+
+            # Using a protocol keeps it in the cache, even if it isn't looked up
+            CachingProtocol.PROTOCOL_CACHE_TTL = 60
+            for entry in CachingProtocol._protocol_cache.values():
+                entry[1] -= 120
+                entry[0].last_used -= 120
+            session = protocols[0].get_session()
+            protocols[0].release_session(session)
+            CachingProtocol.evict_expired()
+            self.assertEqual(len(CachingProtocol._protocol_cache), 1)
+            self.assertIn(('https://example.com/Foo.asmx', Credentials('evict0', 'B')), CachingProtocol._protocol_cache)
+
+            # Protocols with sessions in use are never evicted
+            CachingProtocol.PROTOCOL_CACHE_TTL = -1
+            session = protocols[0].get_session()
+            CachingProtocol.evict_expired()
+            self.assertEqual(len(CachingProtocol._protocol_cache), 1)
+            protocols[0].release_session(session)
+            CachingProtocol.evict_expired()
+            self.assertEqual(len(CachingProtocol._protocol_cache), 0)
+        finally:
+            CachingProtocol.PROTOCOL_CACHE_SIZE, CachingProtocol.PROTOCOL_CACHE_TTL = orig_size, orig_ttl
+
+    def test_oauth_token_rotation(self):
+        tokens = ['token1']
+        credentials = OAuthCredentials(identity='rotation@example.com', token_provider=lambda: tokens[0])
+        protocol = Protocol(service_endpoint='https://example.com/Foo.asmx', credentials=credentials,
+                            auth_type=OAUTH, version=Version(Build(15, 1)))
+        session = protocol.get_session()
+        request = session.auth(requests.Request('POST', 'https://example.com/Foo.asmx').prepare())
+        self.assertEqual(request.headers[b'Authorization'], b'Bearer token1')
+        # A new token is used by existing sessions, and the cached protocol is re-used
+        tokens[0] = 'token2'
+        request = session.auth(requests.Request('POST', 'https://example.com/Foo.asmx').prepare())
+        self.assertEqual(request.headers[b'Authorization'], b'Bearer token2')
+        protocol.release_session(session)
+        p = Protocol(service_endpoint='https://example.com/Foo.asmx',
+                     credentials=OAuthCredentials('token3', identity='rotation@example.com'),
+                     auth_type=OAUTH, version=Version(Build(15, 1)))
+        self.assertEqual(id(p), id(protocol))
+        # Rotating the token by creating new credentials makes the cached protocol use the new token
+        session = protocol.get_session()
+        self.assertEqual(session.auth.token, 'token3')
+        request = session.auth(requests.Request('POST', 'https://example.com/Foo.asmx').prepare())
+        self.assertEqual(request.headers[b'Authorization'], b'Bearer token3')
+        protocol.release_session(session)
+
+    def test_endpoint_cache(self):
+        cache = EndpointCache(tempfile.mkdtemp())
+        endpoint = 'https://example.com/Foo.asmx'
+        self.assertEqual(cache.get(endpoint), (None, None))
+        cache.set(endpoint, NTLM, Version(build=None, api_version='Exchange2016'))
+        self.assertEqual(cache.get(endpoint), (NTLM, None))
+        cache.set(endpoint, NTLM, Version(Build(15, 1, 2, 3)))
+        auth_type, version = cache.get(endpoint)
+        self.assertEqual((auth_type, version.build, version.api_version), (NTLM, Build(15, 1, 2, 3), 'Exchange2016'))
+        self.assertIsNone(cache.get_mailbox_version(endpoint, 'foo@example.com'))
+        cache.set_mailbox_version(endpoint, 'Foo@example.com', Version(Build(14, 3)))
+        self.assertEqual(cache.get_mailbox_version(endpoint, 'foo@example.com').api_version, 'Exchange2010_SP2')
+        self.assertEqual(cache.get(endpoint)[0], NTLM)
+        cache.invalidate(endpoint)
+        self.assertEqual(cache.get(endpoint), (None, None))
+        self.assertIsNone(cache.get_mailbox_version(endpoint, 'foo@example.com'))
+
+    def test_endpoint_cache_unsafe_path(self):
+        # Directories that other users could have planted entries in are ignored
+        endpoint = 'https://example.com/Foo.asmx'
+        path = tempfile.mkdtemp()
+        EndpointCache(path).set(endpoint, NTLM, Version(Build(15, 1, 2, 3)))
+        os.chmod(path, 0o777)
+        cache = EndpointCache(path)
+        self.assertEqual(cache.get(endpoint), (None, None))
+        cache.set(endpoint, BASIC, Version(Build(15, 1, 2, 3)))
+        os.chmod(path, 0o700)
+        self.assertEqual(cache.get(endpoint)[0], NTLM)
+        link = path + '.link'
+        os.symlink(path, link)
+        try:
+            self.assertEqual(EndpointCache(link).get(endpoint), (None, None))
+        finally:
+            os.unlink(link)
+
+    def test_protocol_endpoint_cache(self):
+        orig_cache = Protocol.ENDPOINT_CACHE
+        Protocol.ENDPOINT_CACHE = EndpointCache(tempfile.mkdtemp())
+        try:
+            Protocol.ENDPOINT_CACHE.set('https://warm.example.com/Foo.asmx', NTLM, Version(Build(15, 1, 2, 3)))
+            with requests_mock.mock():
+                # A warm protocol doesn't send any requests to guess the auth type and version
+                protocol = Protocol(service_endpoint='https://warm.example.com/Foo.asmx',
+                                    credentials=Credentials('warm', 'B'), auth_type=None)
+            self.assertEqual(protocol.auth_type, NTLM)
+            self.assertEqual(protocol.version.build, Build(15, 1, 2, 3))
+            self.assertIsNone(protocol.get_account_version('foo@example.com'))
+            protocol.set_account_version('foo@example.com', Version(Build(14, 3)))
+            self.assertEqual(protocol.get_account_version('foo@example.com').build, Build(14, 3))
+            protocol.invalidate_endpoint_cache()
+            self.assertEqual(Protocol.ENDPOINT_CACHE.get('https://warm.example.com/Foo.asmx'), (None, None))
+        finally:
+            Protocol.ENDPOINT_CACHE = orig_cache
+
     def test_close(self):
         proc = psutil.Process()
         ip_addresses = {info[4][0] for info in socket.getaddrinfo(
@@ -332,6 +703,109 @@ class CredentialsTest(unittest.TestCase):
         self.assertEqual(Credentials('a@example.com', 'b').type, Credentials.EMAIL)
         self.assertEqual(Credentials('a\\n', 'b').type, Credentials.DOMAIN)
 
+    def test_oauth_identity(self):
+        with self.assertRaises(ValueError):
+            OAuthCredentials()
+        with self.assertRaises(ValueError):
+            OAuthCredentials(token_provider=lambda: 'a')
+        # Without an identity, credentials are compared by token
+        self.assertEqual(OAuthCredentials('a'), OAuthCredentials('a'))
+        self.assertNotEqual(OAuthCredentials('a'), OAuthCredentials('b'))
+        # With an identity, refreshing the token doesn't change the credentials
+        credentials = OAuthCredentials('a', identity='app')
+        old_hash = hash(credentials)
+        credentials.token = 'b'
+        self.assertEqual(hash(credentials), old_hash)
+        self.assertEqual(credentials, OAuthCredentials('c', identity='app'))
+        tokens = ['x']
+        credentials = OAuthCredentials(identity='app', token_provider=lambda: tokens[0])
+        self.assertEqual(credentials.token, 'x')
+        tokens[0] = 'y'
+        self.assertEqual(credentials.token, 'y')
+
+    def test_back_off(self):
+        credentials = ServiceAccount('a', 'b')
+        self.assertIsNone(credentials.back_off_until)
+        credentials.back_off(10)
+        self.assertGreater(credentials.back_off_until, datetime.datetime.now() + datetime.timedelta(seconds=9))
+        credentials.back_off_until = None
+        self.assertIsNone(credentials.back_off_until)
+        value = datetime.datetime.now() + datetime.timedelta(seconds=10)
+        credentials.back_off_until = value
+        self.assertEqual(credentials.back_off_until, value)
+        # A shorter back off doesn't replace a longer one
+        credentials.back_off(1)
+        self.assertEqual(credentials.back_off_until, value)
+        credentials.back_off_until = datetime.datetime.now() + datetime.timedelta(seconds=1)
+        self.assertEqual(credentials.back_off_until, value)
+        credentials.back_off_until = None
+        credentials.back_off_until = datetime.datetime.now() - datetime.timedelta(seconds=1)
+        self.assertIsNone(credentials.back_off_until)
+
+        # A FileBackOffStore shares the back off value with everyone using the same file
+        with tempfile.NamedTemporaryFile() as f:
+            credentials = ServiceAccount('a', 'b', back_off_store=FileBackOffStore(f.name))
+            other_credentials = ServiceAccount('a', 'b', back_off_store=FileBackOffStore(f.name))
+            self.assertIsNone(other_credentials.back_off_until)
+            credentials.back_off(10)
+            self.assertEqual(other_credentials.back_off_until, credentials.back_off_until)
+            # A shorter back off reported by another process doesn't replace the longer one
+            other_credentials.back_off(1)
+            self.assertGreater(credentials.back_off_until, datetime.datetime.now() + datetime.timedelta(seconds=8))
+            other_credentials.back_off_until = None
+            self.assertIsNone(credentials.back_off_until)
+
+
+class ThrottlingTest(unittest.TestCase):
+    def test_governor(self):
+        import exchangelib.throttling
+        now = [1000.0]
+        orig_time_func = exchangelib.throttling.time_func
+        exchangelib.throttling.time_func = lambda: now[0]
+        try:
+            with self.assertRaises(ValueError):
+                ThrottlingGovernor(max_concurrency=0)
+            governor = ThrottlingGovernor(max_concurrency=2, max_requests=100)
+            for _ in range(10):
+                governor.acquire()
+                now[0] += 1
+                governor.release(0.5)
+            self.assertEqual(governor._get_wait_time(now[0]), 0)
+            # Learn limits from the back off
+            governor.register_back_off(5)
+            self.assertEqual(governor.requests_limit, 8)
+            self.assertAlmostEqual(governor.cas_time_limit, 4.0)
+            # We're over the learned limits until the three oldest requests leave the window
+            self.assertEqual(governor._get_wait_time(now[0]), 53)
+            now[0] += 53
+            governor._expire(now[0])
+            self.assertEqual(governor._get_wait_time(now[0]), 0)
+            governor.acquire()
+            self.assertEqual(governor._in_flight, 1)
+            # In-flight requests count towards the requests limit
+            self.assertEqual(governor._get_wait_time(now[0]), 1)
+            governor.release(0.5)
+            # Learned limits are raised after a window without throttling, when we use most of the limit
+            now[0] += 100
+            for _ in range(6):
+                governor.acquire()
+                governor.release(0.1)
+            self.assertEqual(governor.requests_limit, 8)
+            governor.acquire()
+            governor.release(0.1)
+            self.assertEqual(governor.requests_limit, 9)
+            self.assertAlmostEqual(governor.cas_time_limit, 4.0)
+            # Limits are also learned when explicit limits are set
+            governor = ThrottlingGovernor(max_requests=5)
+            for _ in range(5):
+                governor.acquire()
+                governor.release(0.5)
+            governor.register_back_off(None)
+            self.assertEqual(governor.requests_limit, 4)
+            self.assertEqual(governor._paused_until, now[0] + governor.DEFAULT_BACK_OFF)
+        finally:
+            exchangelib.throttling.time_func = orig_time_func
+
 
 class EWSDateTimeTest(unittest.TestCase):
     def setUp(self):
@@ -1029,6 +1503,63 @@ class QuerySetTest(unittest.TestCase):
         self.assertIsInstance(folder.filter(subject='foo'), QuerySet)
         self.assertIsInstance(folder.exclude(subject='foo'), QuerySet)
 
+    def test_count(self):
+        class MockFolderCollection(FolderCollection):
+            def count_items(self, q, **kwargs):
+                return 42
+
+        qs = QuerySet(folder_collection=MockFolderCollection(account=None, folders=[Inbox(account='XXX')]))
+        # The total reported by the server is used without fetching any items
+        self.assertEqual(qs.count(), 42)
+        self.assertEqual(qs.filter(subject='foo').count(), 42)
+        self.assertEqual(qs.none().count(), 0)
+        self.assertTrue(qs.exists())
+        qs.max_items = 10
+        self.assertEqual(qs.count(), 10)
+        qs._cache = [1, 2, 3]
+        self.assertEqual(qs.count(), 3)
+
+    def test_partitioned_scan(self):
+        def bounds(q):
+            # Returns the (gte, lt) values of a restriction
+            if q.field_path is not None:
+                return {q.op: q.value}
+            res = {}
+            for c in q.children:
+                res.update(bounds(c))
+            return res
+
+        class MockQuerySet(QuerySet):
+            # Emulates a folder containing the integers in 'values'
+            values = []
+
+            def _getitem_idx(self, idx):
+                return sorted(self.values, reverse=self.order_fields[0].reverse)[idx]
+
+            def iterator(self):
+                b = bounds(self.q)
+                return [v for v in self.values if b.get(Q.GTE, -1) <= v < b.get(Q.LT, 1000)]
+
+        qs = MockQuerySet(folder_collection=FolderCollection(account=None, folders=[Inbox(account='XXX')]))
+        with self.assertRaises(ValueError):
+            qs.split(field='size', partitions=0)
+        MockQuerySet.values = list(range(100, 200))
+        partitions = qs.split(field='size', partitions=4)
+        self.assertEqual(
+            [(b.get(Q.GTE), b.get(Q.LT)) for b in (bounds(p.q) for p in partitions)],
+            [(None, 124), (124, 149), (149, 174), (174, None)]
+        )
+        self.assertEqual(sorted(qs.partitioned_scan(field='size', partitions=4)), MockQuerySet.values)
+        # Don't create empty partitions when the range of values is small
+        MockQuerySet.values = [5, 6, 7]
+        self.assertEqual(len(qs.split(field='size', partitions=16)), 2)
+        self.assertEqual(sorted(qs.partitioned_scan(field='size', partitions=16)), MockQuerySet.values)
+        # Empty query
+        MockQuerySet.values = []
+        self.assertEqual(len(qs.split(field='size', partitions=16)), 1)
+        self.assertEqual(list(qs.partitioned_scan(field='size', partitions=16)), [])
+        self.assertEqual(qs.none().split(field='size', partitions=16), [])
+
     def test_queryset_copy(self):
         qs = QuerySet(folder_collection=FolderCollection(account=None, folders=[Inbox(account='XXX')]))
         qs.q = Q()
@@ -1086,6 +1617,16 @@ class QuerySetTest(unittest.TestCase):
         self.assertNotEqual(id(qs.return_format), id(new_qs.return_format))
         self.assertNotEqual(qs.return_format, new_qs.return_format)
 
+    def test_priority(self):
+        qs = QuerySet(folder_collection=FolderCollection(account=None, folders=[Inbox(account='XXX')]))
+        self.assertIsNone(qs._priority)
+        new_qs = qs.priority(PRIORITY_LOW)
+        self.assertIsNone(qs._priority)
+        self.assertEqual(new_qs._priority, PRIORITY_LOW)
+        self.assertEqual(new_qs.filter(subject='foo')._priority, PRIORITY_LOW)
+        with self.assertRaises(ValueError):
+            qs.priority('XXX')
+
 
 class ServicesTest(unittest.TestCase):
     def test_invalid_server_version(self):
@@ -1099,6 +1640,325 @@ class ServicesTest(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             GetRooms(protocol=account.protocol).call('XXX')
 
+    def test_pool_requests_window(self):
+        from multiprocessing.pool import ThreadPool
+
+        class MockProtocol(object):
+            max_in_flight = 3
+            thread_pool = ThreadPool(processes=4)
+
+        class MockService(EWSPooledMixIn):
+            def _get_elements(self, payload, headers=None, indexed=False):
+                return [i * 10 for i in payload]
+
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        service = MockService(protocol=MockProtocol(), chunk_size=2)
+        try:
+            res = service._pool_requests(payload_func=lambda chunk: chunk, items=items())
+            for n, elem in enumerate(res, 1):
+                # We never read further ahead than the in-flight window allows
+                self.assertLessEqual(len(consumed), 2 * (((n + 1) // 2) + MockProtocol.max_in_flight))
+                self.assertEqual(elem, (n - 1) * 10)
+            self.assertEqual(n, 100)
+        finally:
+            MockProtocol.thread_pool.close()
+
+    def test_pool_requests_unordered(self):
+        from multiprocessing.pool import ThreadPool
+        first_chunk_done = threading.Event()
+
+        class MockProtocol(object):
+            max_in_flight = 3
+            thread_pool = ThreadPool(processes=4)
+
+        class MockService(EWSPooledMixIn):
+            def _get_elements(self, payload, headers=None, indexed=False):
+                if payload[0] == 0:
+                    # The first chunk is slow. It must not hold back the other chunks.
+                    first_chunk_done.wait(10)
+                return list(enumerate(i * 10 for i in payload))
+
+        version = Version(build=EXCHANGE_2010)
+        with self.assertRaises(ValueError):
+            GetRooms(protocol=mock_protocol(version=version, service_endpoint='example.com'), ordered=False)
+        service = MockService(protocol=MockProtocol(), chunk_size=2, ordered=False)
+        try:
+            res = []
+            for i, elem in service._pool_requests(payload_func=lambda chunk: chunk, items=(i for i in range(20))):
+                if not res:
+                    self.assertNotIn(i, (0, 1))
+                    first_chunk_done.set()
+                res.append((i, elem))
+            self.assertEqual(sorted(res), [(i, i * 10) for i in range(20)])
+        finally:
+            MockProtocol.thread_pool.close()
+
+    def test_pool_requests_unordered_empty_message(self):
+        # A ResponseMessage may contain zero elements. Results must still be attributed to the right input item.
+        from multiprocessing.pool import ThreadPool
+        from exchangelib.util import MNS
+
+        class MockProtocol(object):
+            max_in_flight = 3
+            thread_pool = ThreadPool(processes=2)
+
+        class MockService(EWSPooledMixIn):
+            SERVICE_NAME = 'MoveItem'
+            element_container_name = '{%s}Items' % MNS
+
+            def _get_response_xml(self, payload, headers=None):
+                # The first item was moved to another mailbox, which returns an empty Items element. The second item
+                # was not found.
+                return [to_xml(("""\
+<m:MoveItemResponseMessage ResponseClass="Success" xmlns:m="%s">
+  <m:ResponseCode>NoError</m:ResponseCode>
+  <m:Items />
+</m:MoveItemResponseMessage>""" % MNS).encode('utf-8')), to_xml(("""\
+<m:MoveItemResponseMessage ResponseClass="Error" xmlns:m="%s">
+  <m:MessageText>Not found</m:MessageText>
+  <m:ResponseCode>ErrorItemNotFound</m:ResponseCode>
+  <m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>
+  <m:Items />
+</m:MoveItemResponseMessage>""" % MNS).encode('utf-8'))]
+
+        service = MockService(protocol=MockProtocol(), chunk_size=2, ordered=False)
+        try:
+            res = list(service._pool_requests(payload_func=lambda chunk: create_element('m:MoveItem'),
+                                              items=['XXX', 'YYY']))
+            self.assertEqual(len(res), 1)
+            self.assertEqual(res[0][0], 1)
+            self.assertIsInstance(res[0][1], ErrorItemNotFound)
+        finally:
+            MockProtocol.thread_pool.close()
+
+    def test_concurrent_paging(self):
+        from multiprocessing.pool import ThreadPool
+        from exchangelib.services import PagingEWSMixIn
+        from exchangelib.util import MNS
+
+        class MockProtocol(object):
+            service_endpoint = 'example.com'
+            max_in_flight = 2
+            thread_pool = ThreadPool(processes=1)
+            paging_thread_pool = ThreadPool(processes=2)
+
+        class MockService(PagingEWSMixIn):
+            SERVICE_NAME = 'FindFolder'
+            element_container_name = '{%s}Folders' % TNS
+            num_folders = 0
+            reported_total = 0
+            requested_offsets = []
+            short_pages = {}  # Maps offset to the number of folders returned at that offset
+            offset_skew = 0  # Added to the offset reported by the server
+
+            def _get_response_xml(self, payload, headers=None):
+                # 'payload' is the requested offset. Return 10 folders per page.
+                self.requested_offsets.append(payload)
+                names = range(payload, min(payload + self.short_pages.get(payload, 10), self.num_folders))
+                is_last = payload + len(names) >= self.num_folders
+                return [to_xml(("""\
+<m:FindFolderResponseMessage ResponseClass="Success" xmlns:m="%s" xmlns:t="%s">
+  <m:ResponseCode>NoError</m:ResponseCode>
+  <m:RootFolder IndexedPagingOffset="%s" TotalItemsInView="%s" IncludesLastItemInRange="%s">
+    <t:Folders>%s</t:Folders>
+  </m:RootFolder>
+</m:FindFolderResponseMessage>""" % (
+                    MNS, TNS, payload + len(names) + self.offset_skew, self.reported_total,
+                    'true' if is_last else 'false',
+                    ''.join('<t:Folder><t:DisplayName>%s</t:DisplayName></t:Folder>' % i for i in names)
+                )).encode('utf-8'))]
+
+        def get_names(max_items=None):
+            MockService.requested_offsets = []
+            return [int(e.find('{%s}DisplayName' % TNS).text) for e in service._paged_call(
+                payload_func=lambda offset: offset, max_items=max_items
+            )]
+
+        with self.assertRaises(ValueError):
+            GetRooms(protocol=MockProtocol(), concurrent_paging=True)
+        service = MockService(protocol=MockProtocol(), concurrent_paging=True)
+        try:
+            # Pages are returned in order
+            MockService.num_folders = MockService.reported_total = 95
+            self.assertEqual(get_names(), list(range(95)))
+            self.assertEqual(sorted(MockService.requested_offsets), list(range(0, 100, 10)))
+            # Don't request more pages than needed for 'max_items'
+            self.assertEqual(get_names(max_items=15), list(range(20)))
+            self.assertEqual(sorted(MockService.requested_offsets), [0, 10])
+            # The view grew while we were paging. Get the rest of the items.
+            MockService.reported_total = 20
+            MockService.num_folders = 27
+            self.assertEqual(get_names(), list(range(27)))
+            self.assertEqual(sorted(MockService.requested_offsets), [0, 10, 20])
+            # Single page
+            MockService.num_folders = MockService.reported_total = 5
+            self.assertEqual(get_names(), list(range(5)))
+            # A short page doesn't line up with the pages requested after it. Continue where the short page ends.
+            MockService.num_folders = MockService.reported_total = 45
+            MockService.short_pages = {10: 7}
+            self.assertEqual(get_names(), list(range(45)))
+            self.assertEqual([o for o in MockService.requested_offsets if o % 10], [17, 27, 37])
+            MockService.short_pages = {}
+            # Offsets are checked
+            MockService.offset_skew = 1
+            with self.assertRaises(MalformedResponseError):
+                get_names()
+            MockService.offset_skew = 0
+            # Paged calls may run in a worker of the thread pool, e.g. in EWSPooledMixIn. Page requests must not wait
+            # for a free worker in that pool.
+            self.assertEqual(MockProtocol.thread_pool.apply_async(get_names).get(timeout=10), list(range(45)))
+        finally:
+            MockProtocol.thread_pool.close()
+            MockProtocol.paging_thread_pool.close()
+
+    def test_total_count(self):
+        from exchangelib.services import PagingEWSMixIn
+        from exchangelib.util import MNS
+
+        class MockService(PagingEWSMixIn):
+            SERVICE_NAME = 'FindItem'
+            element_container_name = '{%s}Items' % TNS
+            responses = []
+            payloads = []
+
+            def _get_response_xml(self, payload, headers=None):
+                # One response message per folder
+                self.payloads.append(payload)
+                return [to_xml(("""\
+<m:FindItemResponseMessage ResponseClass="%s" xmlns:m="%s" xmlns:t="%s">
+  <m:ResponseCode>%s</m:ResponseCode>
+  <m:RootFolder IndexedPagingOffset="1" TotalItemsInView="%s" IncludesLastItemInRange="false">
+    <t:Items><t:Message/></t:Items>
+  </m:RootFolder>
+</m:FindItemResponseMessage>""" % (
+                    'Success' if code == 'NoError' else 'Error', MNS, TNS, code, total
+                )).encode('utf-8')) for code, total in self.responses]
+
+        version = Version(build=EXCHANGE_2010)
+        service = MockService(protocol=mock_protocol(version=version, service_endpoint='example.com'))
+        # The totals of all folders are added up, with only one request
+        MockService.responses = [('NoError', 500000), ('NoError', 7)]
+        self.assertEqual(service._get_total_count(payload_func=lambda offset: offset), 500007)
+        self.assertEqual(service.payloads, [0])
+        MockService.responses = [('NoError', 5), ('ErrorFolderNotFound', 0)]
+        with self.assertRaises(ErrorFolderNotFound):
+            service._get_total_count(payload_func=lambda offset: offset)
+
+    def test_streamed_elements(self):
+        # Test that elements are yielded one at a time and detached from the tree afterwards
+        version = Version(build=EXCHANGE_2010)
+        account = mock_account(version=version, protocol=mock_protocol(version=version, service_endpoint='example.com'))
+        with self.assertRaises(ValueError):
+            GetRooms(protocol=account.protocol, streaming=True)
+        svc = GetItem(account=account, streaming=True)
+        soap_xml = b"""\
+<?xml version="1.0" encoding="utf-8" ?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Header>
+    <h:ServerVersionInfo xmlns:h="http://schemas.microsoft.com/exchange/services/2006/types" MajorVersion="14"
+        MinorVersion="0" MajorBuildNumber="639" MinorBuildNumber="21" Version="Exchange2010" />
+  </s:Header>
+  <s:Body>
+    <m:GetItemResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages"
+        xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">
+      <m:ResponseMessages>
+        <m:GetItemResponseMessage ResponseClass="Success">
+          <m:ResponseCode>NoError</m:ResponseCode>
+          <m:Items>
+            <t:Message><t:Subject>foo</t:Subject></t:Message>
+            <t:Message><t:Subject>bar</t:Subject></t:Message>
+          </m:Items>
+        </m:GetItemResponseMessage>
+        <m:GetItemResponseMessage ResponseClass="Error">
+          <m:MessageText>Not found</m:MessageText>
+          <m:ResponseCode>ErrorItemNotFound</m:ResponseCode>
+          <m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>
+          <m:Items />
+        </m:GetItemResponseMessage>
+      </m:ResponseMessages>
+    </m:GetItemResponse>
+  </s:Body>
+</s:Envelope>"""
+
+        class MockResponse(object):
+            @staticmethod
+            def iter_content(chunk_size):
+                # Deliver the response in small pieces to exercise the incremental parser
+                for i in range(0, len(soap_xml), 7):
+                    yield soap_xml[i:i + 7]
+
+        elems = svc._iterparse_elements(response=MockResponse(), hint=version, api_version=version.api_version)
+        i, first = next(elems)
+        self.assertEqual(i, 0)
+        self.assertEqual(first.tag, '{%s}Message' % TNS)
+        self.assertEqual(first.find('{%s}Subject' % TNS).text, 'foo')
+        i, second = next(elems)
+        self.assertEqual(i, 0)
+        self.assertIsNone(first.getparent())  # The first element was detached when we asked for the next one
+        self.assertEqual(second.find('{%s}Subject' % TNS).text, 'bar')
+        i, err = next(elems)
+        self.assertEqual(i, 1)  # Elements are tagged with the index of the ResponseMessage they came from
+        self.assertIsInstance(err, ErrorItemNotFound)
+        with self.assertRaises(StopIteration):
+            next(elems)
+
+        # Test that SOAP faults are raised
+        soap_xml = b"""\
+<?xml version="1.0" encoding="utf-8" ?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+  <s:Body>
+    <s:Fault xmlns:a="http://schemas.microsoft.com/exchange/services/2006/types">
+      <faultcode>a:ErrorInvalidServerVersion</faultcode>
+      <faultstring xml:lang="en-US">The specified server version is invalid.</faultstring>
+      <detail xmlns:e="http://schemas.microsoft.com/exchange/services/2006/errors">
+        <e:ResponseCode>ErrorInvalidServerVersion</e:ResponseCode>
+        <e:Message>Invalid version</e:Message>
+      </detail>
+    </s:Fault>
+  </s:Body>
+</s:Envelope>"""
+        with self.assertRaises(ErrorInvalidServerVersion):
+            list(svc._iterparse_elements(response=MockResponse(), hint=version, api_version=version.api_version))
+
+    def test_parse_envelopes(self):
+        # Test that we can split a stream of SOAP documents, regardless of where the chunk boundaries are
+        envelope = """\
+<?xml version="1.0" encoding="utf-8"?>
+<%(p)sEnvelope xmlns%(c)s%(p2)s="http://schemas.xmlsoap.org/soap/envelope/">
+  <%(p)sBody><m:GetStreamingEventsResponse xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">\
+%(n)s</m:GetStreamingEventsResponse></%(p)sBody>
+</%(p)sEnvelope>"""
+        stream = BOM + ''.join(
+            envelope % dict(p=p, p2=p[:-1], c=':' if p else '', n=n) + '\r\n'
+            for n, p in enumerate(['', 's:', 'Envelope:'])
+        ).encode('utf-8')
+        for chunk_size in (1, 2, 5, 8, 9, 64, len(stream)):
+            class MockResponse(object):
+                @staticmethod
+                def iter_content(chunk_size=chunk_size):
+                    for i in range(0, len(stream), chunk_size):
+                        yield stream[i:i + chunk_size]
+
+            envelopes = list(GetItem._parse_envelopes(MockResponse()))
+            self.assertEqual(len(envelopes), 3)
+            for n, e in enumerate(envelopes):
+                self.assertEqual(e.tag, '{http://schemas.xmlsoap.org/soap/envelope/}Envelope')
+                self.assertEqual(e[0][0].text, str(n))
+
+        class MockResponse(object):
+            @staticmethod
+            def iter_content(chunk_size):
+                return [b'<Envelope><Body></Envelope>']
+
+        with self.assertRaises(SOAPError):
+            list(GetItem._parse_envelopes(MockResponse()))
+
 
 class TransportTest(unittest.TestCase):
     @requests_mock.mock()
@@ -1171,6 +2031,49 @@ class TransportTest(unittest.TestCase):
         r = requests.get(url)
         self.assertEqual(_get_auth_method_from_response(r), DIGEST)
 
+    def test_wrap_cache(self):
+        # Test that envelopes are cached per version and account settings, and that body content is spliced in without
+        # redundant namespace declarations.
+        MockTZ = namedtuple('EWSTimeZone', ['ms_id'])
+        MockAccount = namedtuple('Account', ['access_type', 'primary_smtp_address', 'default_timezone'])
+        content = create_element('m:GetItem')
+        item_ids = create_element('m:ItemIds')
+        item_ids.append(create_element('t:ItemId', Id='XXX'))
+        content.append(item_ids)
+        account = MockAccount(IMPERSONATION, 'foo@example.com', MockTZ('YYY'))
+        wrapped = wrap(content=content, version='BBB', account=account)
+        self.assertIn(b'<s:Body><m:GetItem><m:ItemIds><t:ItemId Id="XXX"/></m:ItemIds></m:GetItem></s:Body>', wrapped)
+        self.assertIn(b'<t:PrimarySmtpAddress>foo@example.com</t:PrimarySmtpAddress>', wrapped)
+        self.assertEqual(to_xml(wrapped).find('{%s}Body/{%s}GetItem' % (SOAPNS, MNS)).tag, '{%s}GetItem' % MNS)
+        self.assertEqual(wrap(content=content, version='BBB', account=account), wrapped)
+        for other_account, other_version in (
+                (MockAccount(DELEGATE, 'foo@example.com', MockTZ('YYY')), 'BBB'),
+                (MockAccount(IMPERSONATION, 'bar@example.com', MockTZ('YYY')), 'BBB'),
+                (MockAccount(IMPERSONATION, 'foo@example.com', MockTZ('ZZZ')), 'BBB'),
+                (account, 'CCC'),
+                (None, 'BBB'),
+        ):
+            self.assertNotEqual(wrap(content=content, version=other_version, account=other_account), wrapped)
+
+    def test_wrap_fallback(self):
+        # Test that we serialize the whole envelope if the Body tags can't be stripped from the body content
+        import exchangelib.transport
+        MockTZ = namedtuple('EWSTimeZone', ['ms_id'])
+        MockAccount = namedtuple('Account', ['access_type', 'primary_smtp_address', 'default_timezone'])
+        account = MockAccount(DELEGATE, 'foo@example.com', MockTZ('YYY'))
+        content = create_element('m:GetItem')
+        expected = wrap(content=content, version='BBB', account=account)
+        body_start = exchangelib.transport._BODY_START
+        exchangelib.transport._BODY_START = b'XXX'
+        try:
+            wrapped = wrap(content=content, version='BBB', account=account)
+        finally:
+            exchangelib.transport._BODY_START = body_start
+        self.assertEqual(len(to_xml(wrapped).findall('{%s}Body' % SOAPNS)), 1)
+        self.assertIsNone(to_xml(wrapped).find('{%s}Body/{%s}Body' % (SOAPNS, SOAPNS)))
+        self.assertEqual(to_xml(wrapped).find('{%s}Body/{%s}GetItem' % (SOAPNS, MNS)).tag, '{%s}GetItem' % MNS)
+        self.assertEqual(wrapped, expected)
+
 
 class UtilTest(unittest.TestCase):
     def test_chunkify(self):
@@ -1305,6 +2208,55 @@ class UtilTest(unittest.TestCase):
         )
 
 
+@unittest.skipIf(sys.version_info < (3, 6), 'exchangelib.aio requires Python 3.6 or later')
+class AsyncTest(unittest.TestCase):
+    class MockProtocol(object):
+        max_pool_size = 2
+
+    @staticmethod
+    def consume(async_iterator):
+        # Drive an async iterator to completion without using Python 3-only syntax in this file
+        import asyncio
+        loop = asyncio.new_event_loop()
+        res = []
+        try:
+            while True:
+                try:
+                    res.append(loop.run_until_complete(async_iterator.__anext__()))
+                except StopAsyncIteration:  # noqa
+                    return res
+        finally:
+            loop.close()
+
+    def test_iterate_blocking(self):
+        from exchangelib.aio import iterate_blocking
+        for batch_size in (1, 3, 10):
+            self.assertEqual(
+                self.consume(iterate_blocking(self.MockProtocol(), (i for i in range(7)), batch_size)),
+                list(range(7))
+            )
+        self.assertEqual(self.consume(iterate_blocking(self.MockProtocol(), [], 5)), [])
+
+    def test_bulk_calls_use_default_executor(self):
+        # Bulk calls do their own request pooling and must not occupy a worker in the thread pool of the protocol
+        import asyncio
+        from exchangelib.aio import AsyncAccount, _executors
+
+        class MockAccount(object):
+            protocol = self.MockProtocol()
+
+            def bulk_delete(self, ids, **kwargs):
+                return [True for _ in ids]
+
+        account = MockAccount()
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(loop.run_until_complete(AsyncAccount(account).bulk_delete(ids=[1, 2])), [True, True])
+        finally:
+            loop.close()
+        self.assertNotIn(account.protocol, _executors)
+
+
 class EWSTest(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -2004,7 +2956,7 @@ class CommonTest(EWSTest):
         # Rate limit exceeded
         protocol.credentials = ServiceAccount(username=credentials.username, password=credentials.password, max_wait=1)
         session.post = mock_post(url, 503, {'connection': 'close'})
-        protocol.renew_session = lambda s: s  # Return the same session so it's still mocked
+        protocol.cool_down = lambda s, seconds: s  # Return the same session so it's still mocked
         with self.assertRaises(RateLimitError) as rle:
             r, session = post_ratelimited(protocol=protocol, session=session, url='http://', headers=None, data='')
         self.assertEqual(rle.exception.url, url)
@@ -2144,6 +3096,196 @@ class CommonTest(EWSTest):
                     v.from_xml(elem=None, account=None)
 
 
+class AccountOfflineTest(unittest.TestCase):
+    def test_warm_up_from_snapshot(self):
+        config = Configuration(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('warm', 'B'),
+                               auth_type=NOAUTH, version=Version(Build(15, 1)))
+        with requests_mock.mock():
+            # Creating accounts and restoring their folders from a snapshot doesn't need any requests
+            accounts = [Account(primary_smtp_address='user%s@example.com' % i, access_type=DELEGATE, config=config,
+                                locale='da_DK', default_timezone=UTC) for i in range(3)]
+            snapshot = {
+                'user%s@example.com' % i: {
+                    'root': dict(id='root%s' % i, changekey='ck', name='root', folder_class=None, parent=None),
+                    'inbox': dict(id='inbox%s' % i, changekey='ck', name='Indbakke', folder_class='IPF.Note',
+                                  parent=['tois%s' % i, 'ck']),
+                    'calendar': None,
+                }
+                for i in range(3)
+            }
+            new_snapshot = warm_up(accounts, folder_classes=(Inbox, Calendar), snapshot=snapshot)
+            self.assertEqual(new_snapshot, snapshot)
+            for i, account in enumerate(accounts):
+                self.assertEqual(account.root.id, 'root%s' % i)
+                self.assertEqual(account.inbox.id, 'inbox%s' % i)
+                self.assertIsInstance(account.inbox, Inbox)
+                # Folders can still be found by name and parent after a warm start
+                self.assertEqual(account.inbox.name, 'Indbakke')
+                self.assertEqual(account.inbox.folder_class, 'IPF.Note')
+                self.assertEqual(account.inbox.parent_folder_id.id, 'tois%s' % i)
+        with self.assertRaises(ValueError):
+            warm_up(accounts, folder_classes=(Folder,))
+
+
+class FolderHierarchyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._orig_cache = Root.FOLDER_CACHE
+        Root.FOLDER_CACHE = FolderHierarchyCache(tempfile.mkdtemp())
+        config = Configuration(service_endpoint='https://example.com/Foo.asmx', credentials=Credentials('sync', 'B'),
+                               auth_type=NOAUTH, version=Version(Build(15, 1)))
+        with requests_mock.mock():
+            self.account = Account(primary_smtp_address='sync@example.com', access_type=DELEGATE, config=config,
+                                   locale='da_DK', default_timezone=UTC)
+
+    def tearDown(self):
+        Root.FOLDER_CACHE = self._orig_cache
+
+    def _fake_sync(self, expected_sync_state, changes):
+        def sync_folder_hierarchy(shape, sync_state=None, additional_fields=None):
+            self.assertEqual(sync_state, expected_sync_state)
+            for change in changes:
+                yield change
+        self.account.sync_folder_hierarchy = sync_folder_hierarchy
+
+    def test_folder_hierarchy_cache(self):
+        Root.FOLDER_CACHE.set('Sync@example.com', dict(root='root', sync_state='state1', folders=[
+            dict(folder_cls='Inbox', is_distinguished=True, id='inbox', changekey='ck', parent=['root', 'ck'],
+                 name='Inbox', folder_class='IPF.Note', total_count=0, unread_count=0, child_folder_count=1),
+            dict(folder_cls='Folder', is_distinguished=False, id='foo', changekey='ck', parent=['inbox', 'ck'],
+                 name='Foo', folder_class='IPF.Note', total_count=0, unread_count=0, child_folder_count=0),
+        ]))
+        root = Root(account=self.account, id='root', changekey='ck', is_distinguished=True)
+        self.account.root = root
+        parent_folder_id = ParentFolderId(id='inbox', changekey='ck2')
+        self._fake_sync('state1', [
+            CreateFolderChange(folder=Folder(account=self.account, id='bar', changekey='ck', name='Bar',
+                                             parent_folder_id=parent_folder_id)),
+            DeleteFolderChange(item_id=('foo', 'ck')),
+            UpdateFolderChange(folder=Folder(account=self.account, id='inbox', changekey='ck2', name='Indbakke',
+                                             parent_folder_id=ParentFolderId(id='root', changekey='ck'))),
+            'state2',
+        ])
+        # The hierarchy is loaded from the cache, and only the changes are requested
+        inbox = root.get_default_folder(Inbox)
+        self.assertIsInstance(inbox, Inbox)
+        self.assertTrue(inbox.is_distinguished)
+        self.assertEqual((inbox.name, inbox.changekey), ('Indbakke', 'ck2'))
+        self.assertEqual([f.name for f in root.walk()], ['Indbakke', 'Bar'])
+        self.assertEqual([f.id for f in root.glob('**/Bar')], ['bar'])
+
+        # The changes were stored in the cache
+        snapshot = Root.FOLDER_CACHE.get('sync@example.com')
+        self.assertEqual(snapshot, root.get_snapshot())
+        self.assertEqual(snapshot['sync_state'], 'state2')
+        self.assertEqual(sorted(f['id'] for f in snapshot['folders']), ['bar', 'inbox'])
+
+        # A new process starts where the last one stopped
+        root = Root(account=self.account, id='root', changekey='ck', is_distinguished=True)
+        self.account.root = root
+        self._fake_sync('state2', ['state2'])
+        self.assertEqual(sorted(f.name for f in root.walk()), ['Bar', 'Indbakke'])
+        self.assertEqual(root.get_folder('bar').parent.id, 'inbox')
+
+        # Snapshots for a different root folder are not used
+        self.assertFalse(Root(account=self.account, id='other', changekey='ck')._load_snapshot(snapshot))
+
+    def test_cold_folder_hierarchy_cache(self):
+        root = Root(account=self.account, id='root', changekey='ck', is_distinguished=True)
+        self.account.root = root
+        root_id = ParentFolderId(id='root', changekey='ck')
+        inbox = Inbox(account=self.account, id='inbox', changekey='ck', name='Inbox', is_distinguished=True,
+                      parent_folder_id=root_id)
+        self._fake_sync(None, [
+            CreateFolderChange(folder=Folder(account=self.account, id='inbox', changekey='ck', name='Inbox',
+                                             parent_folder_id=root_id)),
+            CreateFolderChange(folder=Folder(account=self.account, id='bar', changekey='ck', name='Bar',
+                                             parent_folder_id=ParentFolderId(id='inbox', changekey='ck'))),
+            'state1',
+        ])
+
+        def find_folders(*args, **kwargs):
+            raise AssertionError('The hierarchy must only be fetched once')
+
+        orig_get_folders, orig_find_folders = FolderCollection.get_folders, FolderCollection.find_folders
+        FolderCollection.get_folders = lambda *args, **kwargs: [inbox]
+        FolderCollection.find_folders = find_folders
+        try:
+            # The hierarchy is built from a full SyncFolderHierarchy, and distinguished folders keep their class
+            self.assertEqual([f.name for f in root.walk()], ['Inbox', 'Bar'])
+            self.assertIs(root.get_default_folder(Inbox), inbox)
+            self.assertEqual(Root.FOLDER_CACHE.get('sync@example.com')['sync_state'], 'state1')
+        finally:
+            FolderCollection.get_folders, FolderCollection.find_folders = orig_get_folders, orig_find_folders
+
+    def test_folder_hierarchy_published_when_complete(self):
+        # Other threads must not see the hierarchy while only the distinguished folders are loaded
+        Root.FOLDER_CACHE = None
+        root = Root(account=self.account, id='root', changekey='ck', is_distinguished=True)
+        self.account.root = root
+        root_id = ParentFolderId(id='root', changekey='ck')
+        inbox = Inbox(account=self.account, id='inbox', changekey='ck', name='Inbox', is_distinguished=True,
+                      parent_folder_id=root_id)
+
+        def find_folders(*args, **kwargs):
+            self.assertIsNone(root._subfolders)
+            yield Folder(account=self.account, id='bar', changekey='ck', name='Bar', parent_folder_id=root_id)
+
+        orig_get_folders, orig_find_folders = FolderCollection.get_folders, FolderCollection.find_folders
+        FolderCollection.get_folders = lambda *args, **kwargs: [inbox]
+        FolderCollection.find_folders = find_folders
+        try:
+            self.assertEqual([f.name for f in root.walk()], ['Inbox', 'Bar'])
+        finally:
+            FolderCollection.get_folders, FolderCollection.find_folders = orig_get_folders, orig_find_folders
+
+    def test_folder_indexes(self):
+        root = Root(account=self.account, id='root', changekey='ck', name='root', is_distinguished=True)
+        self.account.root = root
+
+        def make_folder(folder_id, name, parent):
+            return Folder(account=self.account, id=folder_id, changekey='ck', name=name,
+                          parent_folder_id=ParentFolderId(id=parent.id, changekey=parent.changekey))
+
+        a = make_folder('a', 'A', root)
+        b = make_folder('b', 'B', a)
+        c = make_folder('c', 'C', b)
+        d = make_folder('d', 'D', a)
+        root._set_folders_map(OrderedDict((f.id, f) for f in (root, a, b, c, d)))
+        self.assertEqual([f.name for f in root.children], ['A'])
+        self.assertEqual([f.name for f in a.children], ['B', 'D'])
+        self.assertEqual([f.name for f in root.walk()], ['A', 'B', 'C', 'D'])
+        self.assertEqual((root / 'A' / 'B' / 'C').id, 'c')
+        self.assertEqual([f.id for f in root.glob('A/B')], ['b'])
+        self.assertEqual([f.id for f in root.glob('A/*')], ['b', 'd'])
+        self.assertEqual(list(root.glob('A/X')), [])
+        with self.assertRaises(ErrorFolderNotFound):
+            root / 'X'
+
+        # Rename and move folders
+        b.name = 'B2'
+        root.update_folder(b)
+        d.parent = b
+        root.update_folder(d)
+        self.assertEqual([f.name for f in a.children], ['B2'])
+        self.assertEqual([f.name for f in b.children], ['C', 'D'])
+        self.assertEqual((root / 'A' / 'B2' / 'D').id, 'd')
+        self.assertEqual(d.absolute, '/root/A/B2/D')
+        with self.assertRaises(ErrorFolderNotFound):
+            root / 'A' / 'B'
+
+        # Folders renamed without update_folder() are still found by name
+        c.name = 'C2'
+        self.assertEqual((b / 'C2').id, 'c')
+
+        # Add and remove folders
+        root.remove_folder(d)
+        self.assertEqual([f.name for f in b.children], ['C2'])
+        self.assertIsNone(root.get_folder('d'))
+        root.add_folder(make_folder('e', 'E', root))
+        self.assertEqual([f.name for f in root.children], ['A', 'E'])
+        self.assertEqual(root.tree(), 'root\n├── A\n│   └── B2\n│       └── C2\n└── E')
+
+
 class AccountTest(EWSTest):
     def test_magic(self):
         self.account.fullname = 'John Doe'
@@ -2202,6 +3344,17 @@ class AccountTest(EWSTest):
         finally:
             Calendar.get_distinguished = _orig
 
+    def test_warm_up(self):
+        account = Account(primary_smtp_address=self.account.primary_smtp_address, access_type=DELEGATE,
+                          config=self.config, locale='da_DK', default_timezone=self.tz)
+        snapshot = warm_up([account], folder_classes=(Inbox, Calendar))
+        folders = snapshot[account.primary_smtp_address.lower()]
+        self.assertEqual(folders['root']['id'], account.root.id)
+        self.assertEqual(folders['inbox']['id'], account.inbox.id)
+        self.assertEqual(folders['inbox']['name'], self.account.inbox.name)
+        self.assertEqual(folders['inbox']['parent'][0], self.account.inbox.parent_folder_id.id)
+        self.assertEqual(account.calendar.id, self.account.calendar.id)
+
     def test_sync_folder_hierarchy(self):
         for change in self.account.sync_folder_hierarchy(shape='AllProperties'):
             if isinstance(change, FolderChange):
@@ -2225,6 +3378,286 @@ class AccountTest(EWSTest):
                 assert change.folder.total_count is None
 
 
+class AutodiscoverOfflineTest(unittest.TestCase):
+    def setUp(self):
+        import exchangelib.autodiscover
+        self._orig_storage = exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE
+        exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE = os.path.join(tempfile.mkdtemp(), 'cache.sqlite')
+
+    def tearDown(self):
+        import exchangelib.autodiscover
+        exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE = self._orig_storage
+
+    def test_locked_cache(self):
+        import sqlite3
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        cache._set(AutodiscoverCache.STRATEGY, 'example.com', 'https')
+
+        def locked():
+            raise sqlite3.OperationalError('database is locked')
+
+        # A locked database is skipped, not deleted
+        cache._get_connection = locked
+        cache._memory.clear()
+        self.assertIsNone(cache._get(AutodiscoverCache.STRATEGY, 'example.com'))
+        cache._set(AutodiscoverCache.STRATEGY, 'example.com', 'dns')
+        self.assertTrue(os.path.exists(cache._storage_file))
+        del cache._get_connection
+        cache._memory.clear()
+        self.assertEqual(cache._get(AutodiscoverCache.STRATEGY, 'example.com'), 'https')
+
+    def test_unsafe_cache_path(self):
+        # A database that other users could have planted or modified is ignored
+        import exchangelib.autodiscover
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        cache._set(AutodiscoverCache.STRATEGY, 'example.com', 'https')
+        path = os.path.dirname(cache._storage_file)
+        os.chmod(path, 0o777)
+        try:
+            cache = AutodiscoverCache()
+            self.assertIsNone(cache._get(AutodiscoverCache.STRATEGY, 'example.com'))
+        finally:
+            os.chmod(path, 0o700)
+        self.assertEqual(AutodiscoverCache()._get(AutodiscoverCache.STRATEGY, 'example.com'), 'https')
+        link = os.path.join(path, 'link.sqlite')
+        os.symlink(cache._storage_file, link)
+        exchangelib.autodiscover.AUTODISCOVER_PERSISTENT_STORAGE = link
+        self.assertIsNone(AutodiscoverCache()._get(AutodiscoverCache.STRATEGY, 'example.com'))
+
+    def test_email_cache(self):
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        self.assertIsNone(cache.get_email('foo@example.com'))
+        cache.set_email('Foo@example.com', ('foo@example.com', 'https://example.com/EWS/Exchange.asmx'))
+        cache.set_email('bar@example.com', 'bar@example.org')
+        self.assertEqual(cache.get_email('foo@example.com'),
+                         ('foo@example.com', 'https://example.com/EWS/Exchange.asmx'))
+        # Entries are shared with other caches, e.g. in other processes
+        other_cache = AutodiscoverCache()
+        self.assertEqual(other_cache.get_email('FOO@example.com'),
+                         ('foo@example.com', 'https://example.com/EWS/Exchange.asmx'))
+        self.assertEqual(other_cache.get_email('bar@example.com'), 'bar@example.org')
+        # Deleted entries disappear from other caches when their in-memory entry expires
+        other_cache.del_email('foo@example.com')
+        self.assertIsNone(other_cache.get_email('foo@example.com'))
+        self.assertIsNotNone(cache.get_email('foo@example.com'))
+        cache._memory.clear()
+        self.assertIsNone(cache.get_email('foo@example.com'))
+        # Entries expire
+        cache.EMAIL_TTL = -1
+        cache.set_email('baz@example.com', 'baz@example.org')
+        self.assertIsNone(cache.get_email('baz@example.com'))
+
+    def test_negative_cache(self):
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        self.assertFalse(cache.has_failed('example.com'))
+        cache.set_failed('example.com')
+        self.assertTrue(cache.has_failed('example.com'))
+        self.assertFalse(cache.has_failed('example.org'))
+        cache.NEGATIVE_TTL = -1
+        cache.set_failed('example.com')
+        self.assertFalse(cache.has_failed('example.com'))
+
+    def test_discover_from_cache(self):
+        from exchangelib.autodiscover import _autodiscover_cache
+        orig_cache = Protocol.ENDPOINT_CACHE
+        Protocol.ENDPOINT_CACHE = EndpointCache(tempfile.mkdtemp())
+        try:
+            Protocol.ENDPOINT_CACHE.set('https://cached.example.com/EWS/Exchange.asmx', NTLM, Version(Build(15, 1)))
+            _autodiscover_cache.set_email('alias@cached.example.com', 'user@cached.example.com')
+            _autodiscover_cache.set_email('user@cached.example.com', (
+                'user@cached.example.com', 'https://cached.example.com/EWS/Exchange.asmx'
+            ))
+            _autodiscover_cache.set_failed('failed.example.com')
+            with requests_mock.mock():
+                # A warm cache needs no requests at all
+                primary_smtp_address, protocol = discover(email='alias@cached.example.com',
+                                                          credentials=Credentials('cached', 'B'))
+                with self.assertRaises(AutoDiscoverFailed):
+                    discover(email='user@failed.example.com', credentials=Credentials('cached', 'B'))
+            self.assertEqual(primary_smtp_address, 'user@cached.example.com')
+            self.assertEqual(protocol.service_endpoint, 'https://cached.example.com/EWS/Exchange.asmx')
+        finally:
+            Protocol.ENDPOINT_CACHE = orig_cache
+
+    def test_concurrent_probing(self):
+        import exchangelib.autodiscover
+        from exchangelib.autodiscover import _autodiscover_cache, _try_autodiscover_concurrently
+        orig_strategies = exchangelib.autodiscover.AUTODISCOVER_STRATEGIES
+        orig_cache = Protocol.ENDPOINT_CACHE
+        Protocol.ENDPOINT_CACHE = EndpointCache(tempfile.mkdtemp())
+        Protocol.ENDPOINT_CACHE.set('https://race.example.com/EWS/Exchange.asmx', NTLM, Version(Build(15, 1)))
+        autodiscover_protocol = namedtuple('P', ['service_endpoint', 'auth_type'])(
+            'https://race.example.com/Autodiscover/Autodiscover.xml', NTLM
+        )
+        calls = []
+
+        def fail(domain, credentials, email, cancelled):
+            calls.append('fail')
+            raise AutoDiscoverFailed('No luck')
+
+        def slow(domain, credentials, email, cancelled):
+            calls.append('slow')
+            cancelled.wait(5)
+            raise AutoDiscoverFailed('Cancelled')
+
+        def succeed(domain, credentials, email, cancelled):
+            calls.append('succeed')
+            return autodiscover_protocol, ('https://race.example.com/EWS/Exchange.asmx', 'user@race.example.com')
+
+        try:
+            exchangelib.autodiscover.AUTODISCOVER_STRATEGIES = OrderedDict([
+                ('fail', fail), ('slow', slow), ('succeed', succeed),
+            ])
+            credentials = Credentials('race', 'B')
+            # The first valid response wins, and the winning strategy is remembered
+            t1 = time.time()
+            primary_smtp_address, protocol = _try_autodiscover_concurrently(
+                domain='race.example.com', credentials=credentials, email='user@race.example.com'
+            )
+            self.assertLess(time.time() - t1, 5)
+            self.assertEqual(primary_smtp_address, 'user@race.example.com')
+            self.assertEqual(protocol.service_endpoint, 'https://race.example.com/EWS/Exchange.asmx')
+            self.assertEqual(_autodiscover_cache.get_strategy('race.example.com'), 'succeed')
+            self.assertIn(('race.example.com', credentials), _autodiscover_cache)
+
+            # The remembered strategy runs first, and the others are not started if it succeeds
+            del calls[:]
+            _try_autodiscover_concurrently(domain='race.example.com', credentials=credentials,
+                                           email='user@race.example.com')
+            self.assertEqual(calls, ['succeed'])
+
+            # A plain HTTP redirect must not win over HTTPS, and unused protocols are closed
+            class MockAutodiscoverProtocol(object):
+                auth_type = NTLM
+
+                def __init__(self, service_endpoint):
+                    self.service_endpoint = service_endpoint
+                    self.closed = False
+
+                def close(self):
+                    self.closed = True
+
+            http_protocol = MockAutodiscoverProtocol('https://redirected.example.com/Autodiscover/Autodiscover.xml')
+            https_protocol = MockAutodiscoverProtocol('https://race.example.com/Autodiscover/Autodiscover.xml')
+
+            def http_redirect(domain, credentials, email, cancelled):
+                return http_protocol, ('https://race.example.com/EWS/Exchange.asmx', 'user@race.example.com')
+
+            def slow_https(domain, credentials, email, cancelled):
+                time.sleep(0.5)
+                return https_protocol, ('https://race.example.com/EWS/Exchange.asmx', 'user@race.example.com')
+
+            exchangelib.autodiscover.AUTODISCOVER_STRATEGIES = OrderedDict([
+                ('https', fail), ('autodiscover_https', slow_https), ('autodiscover_http', http_redirect),
+            ])
+            _try_autodiscover_concurrently(domain='deferred.example.com', credentials=credentials,
+                                           email='user@deferred.example.com')
+            self.assertEqual(_autodiscover_cache.get_strategy('deferred.example.com'), 'autodiscover_https')
+            self.assertFalse(https_protocol.closed)
+            self.assertTrue(http_protocol.closed)
+            # The redirect is used when HTTPS fails
+            http_protocol.closed = False
+            exchangelib.autodiscover.AUTODISCOVER_STRATEGIES = OrderedDict([
+                ('https', fail), ('autodiscover_https', fail), ('autodiscover_http', http_redirect),
+            ])
+            _try_autodiscover_concurrently(domain='deferred2.example.com', credentials=credentials,
+                                           email='user@deferred2.example.com')
+            self.assertEqual(_autodiscover_cache.get_strategy('deferred2.example.com'), 'autodiscover_http')
+            self.assertFalse(http_protocol.closed)
+
+            # All strategies failing is an error
+            exchangelib.autodiscover.AUTODISCOVER_STRATEGIES = OrderedDict([('fail', fail), ('fail2', fail)])
+            with self.assertRaises(AutoDiscoverFailed):
+                _try_autodiscover_concurrently(domain='race.example.com', credentials=credentials,
+                                               email='user@race.example.com')
+        finally:
+            exchangelib.autodiscover.AUTODISCOVER_STRATEGIES = orig_strategies
+            Protocol.ENDPOINT_CACHE = orig_cache
+
+    @requests_mock.mock()
+    def test_probe_autodiscover_http(self, m):
+        from exchangelib.autodiscover import _probe_autodiscover_http
+        url = 'http://autodiscover.example.com/Autodiscover/Autodiscover.xml'
+        # Only HTTPS redirects are followed, and we never POST to a plain HTTP URL
+        m.get(url, status_code=302, headers={'location': 'http://example.com/Autodiscover/Autodiscover.xml'})
+        with self.assertRaises(AutoDiscoverFailed):
+            _probe_autodiscover_http(domain='example.com', credentials=Credentials('a', 'b'),
+                                     email='user@example.com', cancelled=threading.Event())
+        m.get(url, status_code=200)
+        with self.assertRaises(AutoDiscoverFailed):
+            _probe_autodiscover_http(domain='example.com', credentials=Credentials('a', 'b'),
+                                     email='user@example.com', cancelled=threading.Event())
+        self.assertEqual({r.method for r in m.request_history}, {'GET'})
+
+    @requests_mock.mock()
+    def test_discover_many(self, m):
+        from exchangelib.autodiscover import _autodiscover_cache, discover_many
+        orig_cache = Protocol.ENDPOINT_CACHE
+        Protocol.ENDPOINT_CACHE = EndpointCache(tempfile.mkdtemp())
+        Protocol.ENDPOINT_CACHE.set('https://many.example.com/EWS/Exchange.asmx', NTLM, Version(Build(15, 1)))
+        credentials = Credentials('many', 'B')
+        autodiscover_url = 'https://many.example.com/Autodiscover/Autodiscover.xml'
+        _autodiscover_cache[('many.example.com', credentials)] = AutodiscoverProtocol(
+            service_endpoint=autodiscover_url, credentials=credentials, auth_type=NOAUTH
+        )
+        _autodiscover_cache.set_failed('failed.example.com')
+
+        def response(request, context):
+            email = re.search(r'<EMailAddress>(.*)</EMailAddress>', request.text).group(1)
+            return '''\
+<?xml version="1.0" encoding="utf-8"?>
+<Autodiscover xmlns="http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006">
+    <Response xmlns="http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a">
+        <User>
+            <AutoDiscoverSMTPAddress>primary.%s</AutoDiscoverSMTPAddress>
+        </User>
+        <Account>
+            <AccountType>email</AccountType>
+            <Action>settings</Action>
+            <Protocol>
+                <Type>EXPR</Type>
+                <EwsUrl>https://many.example.com/EWS/Exchange.asmx</EwsUrl>
+            </Protocol>
+        </Account>
+    </Response>
+</Autodiscover>''' % email
+
+        m.post(autodiscover_url, text=response)
+        try:
+            emails = ['user%s@many.example.com' % i for i in range(20)] + ['user@failed.example.com']
+            results = {r[0]: r[1:] for r in discover_many(emails, credentials, max_workers=5)}
+            self.assertEqual(set(results), set(emails))
+            for email in emails[:-1]:
+                primary_smtp_address, protocol = results[email]
+                self.assertEqual(primary_smtp_address, 'primary.%s' % email)
+                self.assertEqual(protocol.service_endpoint, 'https://many.example.com/EWS/Exchange.asmx')
+            self.assertIsInstance(results['user@failed.example.com'][0], AutoDiscoverFailed)
+            self.assertIsNone(results['user@failed.example.com'][1])
+            self.assertEqual(m.call_count, 20)
+            # The session pool was grown so all workers can send requests to the same domain at the same time
+            self.assertEqual(_autodiscover_cache[('many.example.com', credentials)].session_pool_size, 5)
+        finally:
+            Protocol.ENDPOINT_CACHE = orig_cache
+
+    def test_corrupt_cache(self):
+        from exchangelib.autodiscover import AutodiscoverCache
+        cache = AutodiscoverCache()
+        cache.set_email('foo@example.com', 'foo@example.org')
+        cache._local.conn.close()
+        cache._local.conn = None
+        for db_file in glob.glob(cache._storage_file + '*'):
+            with open(db_file, 'w') as f:
+                f.write('XXX')
+        cache._memory.clear()
+        self.assertIsNone(cache.get_email('foo@example.com'))
+        cache.set_email('foo@example.com', 'foo@example.org')
+        self.assertEqual(cache.get_email('foo@example.com'), 'foo@example.org')
+
+
 class AutodiscoverTest(EWSTest):
     def test_magic(self):
         # Just test we don't fail
@@ -2326,7 +3759,9 @@ class AutodiscoverTest(EWSTest):
         for db_file in glob.glob(_autodiscover_cache._storage_file + '*'):
             with open(db_file, 'w') as f:
                 f.write('XXX')
-        # Check that we can recover from a destroyed file and that the entry no longer exists
+        # Check that we can recover from a destroyed file and that the entry no longer exists. Bypass the in-memory
+        # cache, which would otherwise still know the entry.
+        _autodiscover_cache._memory.clear()
         self.assertFalse(key in _autodiscover_cache)
 
     def test_autodiscover_from_account(self):
@@ -2353,9 +3788,12 @@ class AutodiscoverTest(EWSTest):
         del _autodiscover_cache
 
     def test_autodiscover_redirect(self):
+        from exchangelib.autodiscover import _autodiscover_cache
         # Prime the cache
         email, p = discover(email=self.account.primary_smtp_address, credentials=self.account.protocol.credentials)
         _orig = exchangelib.autodiscover._autodiscover_quick
+        # Only keep the cache entry for the domain, so discover() calls _autodiscover_quick()
+        _autodiscover_cache.del_email(self.account.primary_smtp_address)
 
         # Test that we can get another address back than the address we're looking up
         def _mock1(credentials, email, protocol):
@@ -2363,6 +3801,7 @@ class AutodiscoverTest(EWSTest):
         exchangelib.autodiscover._autodiscover_quick = _mock1
         test_email, p = discover(email=self.account.primary_smtp_address, credentials=self.account.protocol.credentials)
         self.assertEqual(test_email, 'john@example.com')
+        _autodiscover_cache.del_email(self.account.primary_smtp_address)
 
         # Test that we can survive being asked to lookup with another address
         def _mock2(credentials, email, protocol):
@@ -2372,6 +3811,10 @@ class AutodiscoverTest(EWSTest):
         exchangelib.autodiscover._autodiscover_quick = _mock2
         with self.assertRaises(ErrorNonExistentMailbox):
             discover(email=self.account.primary_smtp_address, credentials=self.account.protocol.credentials)
+        # The redirect was cached
+        self.assertEqual(_autodiscover_cache.get_email(self.account.primary_smtp_address),
+                         'xxxxxx@' + self.account.domain)
+        _autodiscover_cache.del_email(self.account.primary_smtp_address)
 
         # Test that we catch circular redirects
         def _mock3(credentials, email, protocol):